@@ -0,0 +1,35 @@
+"""Benchmarks (airspeed velocity style) for applying the ELUT to L1A pixel data.
+
+The bundled L1A file has a single time bin, so it is repeated along the time axis to give a realistically long observation. The ELUT is read from STX_CONF, which defaults to the minimal copy of STIX-CONF in tests/stx_conf, see *common*. The fused pixel sum is compared with the implementation it replaced, *tests.reference.apply_elut_l1_tiled*."""
+import os
+
+from stix2xspec.spectrogram import Spectrogram
+from tests.reference import apply_elut_l1_tiled
+from .common import scaled_pixel_data
+
+class ApplyElutL1:
+    params = [100, 1000]
+    param_names = ['n_times']
+
+    def setup_cache(self):
+        """Write the input files into the current directory, asv's cache directory for setup_cache, which asv removes after the run."""
+        for n_times in self.params:
+            scaled_pixel_data(n_times, f"pixel_data_{n_times}.fits")
+        return os.getcwd()
+
+    def setup(self, cache_dir, n_times):
+        self.spec = Spectrogram(os.path.join(cache_dir, f"pixel_data_{n_times}.fits"))
+        self.energy_bins, self.pixels_used, self.detectors_used = self.spec._elut_setup()
+        self.spec._get_eff_ewidth(self.pixels_used, self.detectors_used)
+
+    def time_fused(self, cache_dir, n_times):
+        self.spec._pixel_sums(self.pixels_used, self.detectors_used, energy_bins = self.energy_bins, eff_ewidth = self.spec.eff_ewidth)
+
+    def time_tiled(self, cache_dir, n_times):
+        apply_elut_l1_tiled(self.spec, self.energy_bins, self.pixels_used, self.detectors_used)
+
+    def peakmem_fused(self, cache_dir, n_times):
+        self.spec._pixel_sums(self.pixels_used, self.detectors_used, energy_bins = self.energy_bins, eff_ewidth = self.spec.eff_ewidth)
+
+    def peakmem_tiled(self, cache_dir, n_times):
+        apply_elut_l1_tiled(self.spec, self.energy_bins, self.pixels_used, self.detectors_used)
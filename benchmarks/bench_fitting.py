@@ -0,0 +1,59 @@
+"""Benchmarks (airspeed velocity style) for fitting STIX spectra with the NumPy fitting engine and the precomputed thermal grid."""
+import time
+import numpy as np
+
+from stix2xspec.fitting import SpectrumFitter
+from stix2xspec.response import ResponseMatrix
+from stix2xspec.thermal_grid import ThermalGrid
+
+def synthetic_fitter(exposure = 20., seed = 0):
+    """Fitter for a Poisson realization of a thermal + broken power-law spectrum folded through the bundled SRM."""
+    response = ResponseMatrix.from_fits()
+    model = SpectrumFitter(np.zeros(response.n_channels), np.ones(response.n_channels), exposure, response)
+    rate = model.model_rate(['thermal', 'bknpower'], [(1.8, 0.5), (3e6, 4., 18., 6.)])[0]
+    counts = np.random.default_rng(seed).poisson(rate*exposure)
+    return SpectrumFitter(counts/exposure, np.sqrt(np.maximum(counts, 1))/exposure, exposure, response, sys_err = 0.02)
+
+class FitSpectrum:
+    params = [['chi', 'cstat'], ['bknpower', None]]
+    param_names = ['statMethod', 'ntmodel']
+
+    def setup(self, statMethod, ntmodel):
+        self.fitter = synthetic_fitter()
+        self.kwargs = {'ntmodel': ntmodel, 'lowErange': [4, 10], 'highErange': [10, 40], 'statMethod': statMethod}
+        self.start = self.fitter.fit(**self.kwargs)['params']
+
+    def time_fit(self, statMethod, ntmodel):
+        self.fitter.fit(**self.kwargs)
+
+    def time_fit_warm_start(self, statMethod, ntmodel):
+        self.fitter.fit(start = self.start, **self.kwargs)
+
+    def track_fits_per_second(self, statMethod, ntmodel):
+        n_fits = 20
+        t0 = time.perf_counter()
+        for _ in range(n_fits):
+            self.fitter.fit(**self.kwargs)
+        return n_fits/(time.perf_counter() - t0)
+    track_fits_per_second.unit = 'fits/s'
+
+class EstimateThermalGrid:
+    params = [[100, 10000], [False, True]]
+    param_names = ['n_times', 'power_law']
+
+    def setup_cache(self):
+        return {False: ThermalGrid.compute(), True: ThermalGrid.compute(index = np.arange(2, 10.1, 0.25))}
+
+    def setup(self, grids, n_times, power_law):
+        self.grid = grids[power_law]
+        fitter = synthetic_fitter()
+        rng = np.random.default_rng(0)
+        self.rate = fitter.rate*rng.uniform(0.5, 2., (n_times, 1))
+        self.stat_err = np.broadcast_to(fitter.stat_err, self.rate.shape)
+        self.e_min = fitter.response.e_min
+
+    def time_estimate(self, grids, n_times, power_law):
+        self.grid.estimate(self.rate, self.stat_err, self.e_min, Erange = [4, 20])
+
+    def time_compute_grid(self, grids, n_times, power_law):
+        ThermalGrid.compute(index = self.grid.index)
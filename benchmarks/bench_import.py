@@ -0,0 +1,20 @@
+"""Benchmarks (airspeed velocity style) for the import time of the stix2xspec modules. Plotting, display and table libraries are imported by the functions that use them, so importing a module for conversion or fitting only pays for numpy and astropy.io.fits.
+
+*track_import_time* measures each module in a fresh interpreter and fails if it exceeds its budget in IMPORT_TIME_BUDGET or pulls in one of LAZY_DEPENDENCIES (both in *tests.import_budget*, which *tests/test_import.py* checks too), so a regression shows up as a failed benchmark rather than as a slower number."""
+from tests.import_budget import IMPORT_TIME_BUDGET, measure_import
+
+class ImportTime:
+    params = list(IMPORT_TIME_BUDGET)
+    param_names = ['module']
+
+    def timeraw_import(self, module):
+        return f"import {module}"
+
+    def track_import_time(self, module):
+        seconds, loaded = measure_import(module)
+        if loaded:
+            raise RuntimeError(f"Importing {module} also imports {', '.join(loaded)}")
+        if seconds > IMPORT_TIME_BUDGET[module]:
+            raise RuntimeError(f"Importing {module} took {seconds:.2f} s, over the budget of {IMPORT_TIME_BUDGET[module]:.2f} s")
+        return seconds
+    track_import_time.unit = 'seconds'
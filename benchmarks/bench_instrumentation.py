@@ -0,0 +1,41 @@
+"""Benchmarks (airspeed velocity style) for the overhead of *stix2xspec.instrumentation*: a call of an instrumented function, and the conversion of the bundled spectrogram, with stage recording off, on, and on with tracemalloc. With recording off the overhead should not be measurable."""
+import shutil
+import tempfile
+
+from .common import L1A_FILE, L4_FILE, sample_file
+from stix2xspec.instrumentation import StageRecorder, instrument_stage
+from stix2xspec.stix2xspec import convert_spectrogram
+
+MODES = ['off', 'on', 'trace_memory']
+
+@instrument_stage('noop')
+def _noop():
+    return None
+
+class _Recording:
+    """Run the benchmark with a StageRecorder active unless the mode is 'off'."""
+    params = [MODES]
+    param_names = ['recording']
+
+    def setup(self, recording):
+        self.recorder = None if recording == 'off' else StageRecorder(trace_memory = recording == 'trace_memory').start()
+
+    def teardown(self, recording):
+        if self.recorder is not None:
+            self.recorder.stop()
+
+class StageCall(_Recording):
+    def time_call(self, recording):
+        _noop()
+
+class ConvertSpectrogram(_Recording):
+    def setup(self, recording):
+        self.out_dir = tempfile.mkdtemp()
+        super().setup(recording)
+
+    def teardown(self, recording):
+        super().teardown(recording)
+        shutil.rmtree(self.out_dir, ignore_errors = True)
+
+    def time_convert(self, recording):
+        convert_spectrogram(sample_file(L4_FILE), sample_file(L1A_FILE), to_fits = True, out_dir = self.out_dir)
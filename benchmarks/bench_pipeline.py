@@ -0,0 +1,144 @@
+"""Benchmarks (airspeed velocity style) for the stages of *stix2xspec.convert_spectrogram*: reading the FITS file, applying the ELUT, livetime correction, processing the background, background subtraction and writing the converted spectrogram.
+
+Each stage is a value of the 'stage' parameter, so that its time and peak memory are tracked separately from run to run; the setup runs the conversion up to that stage. Peak memory is the tracemalloc peak of the stage alone, i.e. the largest amount of memory allocated on top of its inputs (asv's peakmem_ would include the setup). The Scale* classes repeat the stages for synthetic pixel data scaled along time, detectors and energies."""
+import os
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+
+from .common import L1A_FILE, L4_FILE, sample_file, scaled_pixel_data
+from stix2xspec.spectrogram import Spectrogram
+from stix2xspec.stix2xspec import convert_spectrogram, process_background, background_subtract
+
+STAGES = ['read', 'apply_elut', 'correct_counts', 'background', 'background_subtract', 'spectrum_to_fits']
+
+def pipeline_state(data_file, bk_file, stage):
+    """Run the conversion of data_file, as in *convert_spectrogram*, up to (not including) the given stage.
+
+    Args:
+        data_file (str): Full path to the FITS file to be converted.
+        bk_file (str): Full path to the FITS background file.
+        stage (str): One of STAGES.
+
+    Returns:
+        dict: The inputs of the stage: 'data_file', 'bk_file', 'out_dir' (a new temporary directory), and depending on the stage 'spec', 'counts_spec' and 'spec_bk'."""
+    state = {'data_file': data_file, 'bk_file': bk_file, 'out_dir': tempfile.mkdtemp()}
+    if stage == 'spectrum_to_fits':
+        state['spec'] = convert_spectrogram(data_file, bk_file)
+        return state
+    if stage == 'read':
+        return state
+    spec = Spectrogram(data_file, background = False)
+    state['spec'] = spec
+    if stage == 'apply_elut':
+        return state
+    spec.apply_elut()
+    state['counts_spec'] = spec.counts if spec.counts.ndim == 2 else np.sum(spec.counts, axis = 1)
+    if stage == 'correct_counts':
+        return state
+    spec.correct_counts()
+    if stage == 'background':
+        return state
+    state['spec_bk'] = process_background(bk_file, spec)
+    return state
+
+def run_stage(state, stage):
+    """Run one stage of the conversion on the state returned by *pipeline_state*."""
+    if stage == 'read':
+        Spectrogram(state['data_file'], background = False)
+    elif stage == 'apply_elut':
+        state['spec'].apply_elut()
+    elif stage == 'correct_counts':
+        state['spec'].correct_counts()
+    elif stage == 'background':
+        process_background(state['bk_file'], state['spec'])
+    elif stage == 'background_subtract':
+        background_subtract(state['spec'], state['spec_bk'], state['counts_spec'])
+    elif stage == 'spectrum_to_fits':
+        state['spec'].spectrum_to_fits(os.path.join(state['out_dir'], 'stx_spectrum.fits'))
+    else:
+        raise ValueError(f"Unknown stage {stage}")
+
+def stage_peak_memory(state, stage):
+    """Peak memory in bytes allocated while running one stage, as traced by tracemalloc."""
+    tracemalloc.start()
+    try:
+        run_stage(state, stage)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+class _Stages:
+    """Time and peak memory of each stage. Subclasses set params (the input, then the stage) and *files*."""
+    number = 1 #every stage changes its inputs, so each measurement gets a fresh setup
+    repeat = (3, 10, 20.)
+
+    def files(self, cache_dir, case):
+        raise NotImplementedError
+
+    def setup(self, *args):
+        *cache_dir, case, stage = args
+        self.stage = stage
+        self.state = pipeline_state(*self.files(cache_dir[0] if cache_dir else None, case), stage)
+
+    def teardown(self, *args):
+        shutil.rmtree(self.state['out_dir'], ignore_errors = True)
+
+    def time_stage(self, *args):
+        run_stage(self.state, self.stage)
+
+    def track_peak_memory(self, *args):
+        return stage_peak_memory(self.state, self.stage)
+    track_peak_memory.unit = 'bytes'
+
+class ConvertSample(_Stages):
+    params = [['spectrogram', 'pixel_data'], STAGES]
+    param_names = ['data', 'stage']
+
+    def files(self, cache_dir, data):
+        return sample_file(L4_FILE if data == 'spectrogram' else L1A_FILE), sample_file(L1A_FILE)
+
+class _ScaledStages(_Stages):
+    """Stages for pixel data files made with *scaled_pixel_data*, with keyword arguments from *scaled_kwargs*. asv shares the result of a setup_cache between the classes that inherit it, so each subclass defines its own, calling *write_cases*."""
+    def scaled_kwargs(self, case):
+        raise NotImplementedError
+
+    def write_cases(self):
+        """Write the input file of every case into the current directory (asv's cache directory for setup_cache)."""
+        for case in self.params[0]:
+            scaled_pixel_data(fits_path = f"pixel_data_{case}.fits", **self.scaled_kwargs(case))
+        return os.getcwd()
+
+    def files(self, cache_dir, case):
+        return os.path.join(cache_dir, f"pixel_data_{case}.fits"), sample_file(L1A_FILE)
+
+class ScaleTime(_ScaledStages):
+    params = [[10, 100, 1000], STAGES]
+    param_names = ['n_times', 'stage']
+
+    def setup_cache(self):
+        return self.write_cases()
+
+    def scaled_kwargs(self, n_times):
+        return {'n_times': n_times}
+
+class ScaleDetectors(_ScaledStages):
+    params = [[4, 8, 16, 32], STAGES]
+    param_names = ['n_detectors', 'stage']
+
+    def setup_cache(self):
+        return self.write_cases()
+
+    def scaled_kwargs(self, n_detectors):
+        return {'n_times': 100, 'n_detectors': n_detectors}
+
+class ScaleEnergies(_ScaledStages):
+    params = [[8, 16, 32], STAGES]
+    param_names = ['n_energies', 'stage']
+
+    def setup_cache(self):
+        return self.write_cases()
+
+    def scaled_kwargs(self, n_energies):
+        return {'n_times': 100, 'n_energies': n_energies}
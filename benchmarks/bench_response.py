@@ -0,0 +1,35 @@
+"""Benchmarks (airspeed velocity style) for folding photon spectra through the bundled STIX SRM."""
+import numpy as np
+
+from stix2xspec.response import ResponseMatrix
+from stix2xspec.spectrogram_utils import open_full_srm
+
+class FoldSpectra:
+    params = [1, 100, 1000]
+    param_names = ['n_spectra']
+
+    def setup(self, n_spectra):
+        self.response = ResponseMatrix.from_fits()
+        self.dense = np.array(open_full_srm()[1].data['MATRIX'], dtype = float)
+        self.flux = np.random.default_rng(0).random((n_spectra, self.response.n_energies))
+        self.response.fold(self.flux[:1]) #build the cached fold index and dense kernel
+
+    def time_fold(self, n_spectra):
+        self.response.fold(self.flux)
+
+    def time_fold_sparse(self, n_spectra):
+        self.response.fold(self.flux, method = 'sparse')
+
+    def time_dense_matrix_product(self, n_spectra):
+        self.flux @ self.dense
+
+class CropResponse:
+    def setup(self):
+        self.response = ResponseMatrix.from_fits()
+        self.channels = np.arange(2, 25)
+
+    def time_crop(self):
+        self.response.crop(self.channels)
+
+    def time_load(self):
+        ResponseMatrix.from_fits()
@@ -0,0 +1,7 @@
+"""Shared fixtures for the benchmarks: the bundled sample files, a minimal STIX-CONF and synthetic inputs made by scaling the samples up along time, detectors and energies, all from *tests.samples*.
+
+Importing this module points STX_CONF to the minimal copy of STIX-CONF in tests/stx_conf unless it is already set."""
+import os
+from tests.samples import STX_CONF, L1A_FILE, L4_FILE, sample_file, scaled_pixel_data
+
+os.environ.setdefault('STX_CONF', STX_CONF)
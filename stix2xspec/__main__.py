@@ -1,24 +1,13 @@
 # type: ignore[attr-defined]
-from typing import Optional
+from typing import List, Optional
 
-from enum import Enum
-from random import choice
+import time
+from pathlib import Path
 
 import typer
 from rich.console import Console
 
 from stix2xspec import version
-from stix2xspec.example import hello
-
-
-class Color(str, Enum):
-    white = "white"
-    red = "red"
-    cyan = "cyan"
-    magenta = "magenta"
-    yellow = "yellow"
-    green = "green"
-
 
 app = typer.Typer(
     name="stix2xspec",
@@ -35,17 +24,8 @@ def version_callback(print_version: bool) -> None:
         raise typer.Exit()
 
 
-@app.command(name="")
+@app.callback()
 def main(
-    name: str = typer.Option(..., help="Person to greet."),
-    color: Optional[Color] = typer.Option(
-        None,
-        "-c",
-        "--color",
-        "--colour",
-        case_sensitive=False,
-        help="Color for print. If not specified then choice will be random.",
-    ),
     print_version: bool = typer.Option(
         None,
         "-v",
@@ -55,12 +35,220 @@ def main(
         help="Prints the version of the stix2xspec package.",
     ),
 ) -> None:
-    """Print a greeting with a giving name."""
-    if color is None:
-        color = choice(list(Color))
+    """Convert STIX science data (L1A, L1, or L4 spectrograms or pixel data) to a format compatible with XSPEC"""
+
+
+def _expand(patterns: List[str]) -> List[str]:
+    """Expand glob patterns, exiting with a usage error if one matches nothing."""
+    from stix2xspec.batch import expand_paths
+
+    try:
+        return expand_paths(patterns)
+    except FileNotFoundError as e:
+        raise typer.BadParameter(str(e), param_hint="'FILES...'")
+
+
+def _finish(command: str, results: list, start: float, jobs: Optional[int], summary: Optional[Path]) -> None:
+    """Write the JSON summary of a batch run if requested, and exit with code 1 if any file failed."""
+    from stix2xspec.batch import batch_summary, write_summary
+
+    if summary:
+        write_summary(batch_summary(command, results, time.perf_counter() - start, jobs=jobs), str(summary))
+    if not all(r["success"] for r in results):
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def convert(
+    data_files: List[str] = typer.Argument(
+        ..., help="STIX FITS files to convert, or glob patterns matching them."
+    ),
+    background: Path = typer.Option(
+        ...,
+        "-b",
+        "--background",
+        exists=True,
+        dir_okay=False,
+        help="Background FITS file to subtract from every data file.",
+    ),
+    out_dir: Optional[Path] = typer.Option(
+        None,
+        "-o",
+        "--out-dir",
+        file_okay=False,
+        help="Directory for the converted FITS and .srm files. Defaults to the current directory.",
+    ),
+    jobs: Optional[int] = typer.Option(
+        None,
+        "-j",
+        "--jobs",
+        min=1,
+        help="Number of worker processes. Defaults to one per CPU.",
+    ),
+    elut_filename: Optional[Path] = typer.Option(
+        None,
+        "--elut",
+        exists=True,
+        dir_okay=False,
+        help="ELUT file to apply. Defaults to the ELUT valid at the observation time.",
+    ),
+    keep_short_bins: bool = typer.Option(
+        True,
+        "--keep-short-bins/--remove-short-bins",
+        help="Keep time bins shorter than the minimum time bin duration.",
+    ),
+    chunk_size: Optional[int] = typer.Option(
+        None,
+        "--chunk-size",
+        min=1,
+        help="Process L1A pixel data this many time bins at a time to bound memory use. Cannot be combined with --remove-short-bins.",
+    ),
+    summary: Optional[Path] = typer.Option(
+        None,
+        "--summary",
+        dir_okay=False,
+        help="Write a JSON summary with the timings per file and stage to this file ('-' for standard output).",
+    ),
+    stages: Optional[Path] = typer.Option(
+        None,
+        "--stages",
+        dir_okay=False,
+        help="Write wall time, CPU time, memory and array sizes of every pipeline stage of every file to this file as JSON lines ('-' for standard output).",
+    ),
+    trace_memory: bool = typer.Option(
+        False,
+        "--trace-memory",
+        help="With --stages, also record the peak memory allocated by each stage (slows down the conversion).",
+    ),
+) -> None:
+    """Background-subtract and convert STIX FITS files to OGIP spectrum files."""
+    from stix2xspec.instrumentation import write_jsonl
+    from stix2xspec.stix2xspec import convert_spectrograms
+
+    start = time.perf_counter()
+    files = _expand(data_files)
+    if out_dir:
+        out_dir.mkdir(parents=True, exist_ok=True)
+    results = convert_spectrograms(
+        files,
+        str(background),
+        jobs=jobs,
+        report="-" not in (str(summary), str(stages)),
+        instrument={"trace_memory": trace_memory} if stages else False,
+        elut_filename=str(elut_filename) if elut_filename else None,
+        keep_short_bins=keep_short_bins,
+        chunk_size=chunk_size,
+        out_dir=str(out_dir) if out_dir else None,
+    )
+    if stages:
+        write_jsonl([record for r in results for record in r.pop("records", [])], str(stages))
+    _finish("convert", results, start, jobs, summary)
+
+
+@app.command("extract-intervals")
+def extract_intervals(
+    spectrum_files: List[str] = typer.Argument(
+        ..., help="Converted spectrum files, or glob patterns matching them."
+    ),
+    intervals: Optional[Path] = typer.Option(
+        None,
+        "-i",
+        "--intervals",
+        exists=True,
+        dir_okay=False,
+        help="Text file with one 'start_time, end_time' pair per line. Only the intervals covered by a file are extracted from it.",
+    ),
+    every: Optional[float] = typer.Option(
+        None,
+        "--every",
+        min=0.1,
+        help="Instead of --intervals, split each file into consecutive windows of this many seconds.",
+    ),
+    out_dir: Optional[Path] = typer.Option(
+        None,
+        "-o",
+        "--out-dir",
+        file_okay=False,
+        help="Directory for the extracted spectra. Defaults to the directory of each input file.",
+    ),
+    pha2: bool = typer.Option(
+        False,
+        "--pha2",
+        help="Write the spectra of each file into one OGIP type II PHA file instead of one file per interval.",
+    ),
+    overwrite: bool = typer.Option(False, "--overwrite", help="Overwrite existing output files."),
+    jobs: Optional[int] = typer.Option(
+        None,
+        "-j",
+        "--jobs",
+        min=1,
+        help="Number of worker processes. Defaults to one per CPU.",
+    ),
+    summary: Optional[Path] = typer.Option(
+        None,
+        "--summary",
+        dir_okay=False,
+        help="Write a JSON summary with the timings per file and stage to this file ('-' for standard output).",
+    ),
+) -> None:
+    """Average converted spectra over time intervals for fitting."""
+    from stix2xspec.batch import extract_spectra, read_intervals
+    from stix2xspec.stix2xspec import conversion_report
+
+    if (intervals is None) == (every is None):
+        raise typer.BadParameter("Give exactly one of --intervals and --every.")
+    start = time.perf_counter()
+    files = _expand(spectrum_files)
+    if out_dir:
+        out_dir.mkdir(parents=True, exist_ok=True)
+    results = extract_spectra(
+        files,
+        intervals=read_intervals(str(intervals)) if intervals else None,
+        every=every,
+        out_dir=str(out_dir) if out_dir else None,
+        pha2=pha2,
+        overwrite=overwrite,
+        jobs=jobs,
+    )
+    if summary is None or str(summary) != "-":
+        console.print(conversion_report(results, verb="processed"), highlight=False, soft_wrap=True)
+        console.print(f"{sum(r['n_spectra'] for r in results)} spectra extracted", highlight=False, soft_wrap=True)
+    _finish("extract-intervals", results, start, jobs, summary)
+
+
+@app.command()
+def index(
+    spectrum_files: List[str] = typer.Argument(
+        ..., help="Converted spectrum files, or glob patterns matching them."
+    ),
+    output: Path = typer.Option(
+        "-",
+        "-o",
+        "--output",
+        dir_okay=False,
+        help="JSON file for the index. Defaults to standard output.",
+    ),
+    jobs: Optional[int] = typer.Option(
+        None,
+        "-j",
+        "--jobs",
+        min=1,
+        help="Number of worker processes. Defaults to one per CPU.",
+    ),
+    summary: Optional[Path] = typer.Option(
+        None,
+        "--summary",
+        dir_okay=False,
+        help="Write a JSON summary with the timings per file and stage to this file.",
+    ),
+) -> None:
+    """List time range, cadence, exposure, energy range and peak count rate of converted spectrum files as JSON."""
+    from stix2xspec.batch import index_spectra, write_summary
 
-    greeting: str = hello(name)
-    console.print(f"[bold {color}]{greeting}[/]")
+    start = time.perf_counter()
+    results = index_spectra(_expand(spectrum_files), jobs=jobs)
+    write_summary([{k: v for k, v in r.items() if k not in ("elapsed", "stages")} for r in results], str(output))
+    _finish("index", results, start, jobs, summary)
 
 
 if __name__ == "__main__":
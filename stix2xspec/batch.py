@@ -0,0 +1,194 @@
+import numpy as np
+import os
+import glob
+import json
+from .xspec_utils import read_rate_table, spectra_from_time_intervals, time_intervals_to_pha2, _interval_default_fitsname
+from .spectrogram_utils import _MJD_EPOCH
+from .jobs import map_jobs, run_reported
+from .instrumentation import stage
+
+def expand_paths(patterns):
+    """Expand glob patterns into a list of files. Patterns are expanded in the given order, each sorted by name, and files matched more than once are only listed once.
+
+    Args:
+        patterns (list): File names or glob patterns, e.g. 'stx_spectrum_202207*.fits'.
+
+    Returns:
+        list: The matching files."""
+    paths = []
+    for pattern in patterns:
+        pattern = os.path.expanduser(str(pattern))
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        matches = [m for m in matches if os.path.isfile(m)]
+        if not matches:
+            raise FileNotFoundError(f"No files match {pattern}")
+        paths.extend(m for m in matches if m not in paths)
+    return paths
+
+def read_intervals(filename):
+    """Read time intervals from a text file with one interval per line, given as start and end time separated by a comma or whitespace, in any format readable by astropy.Time. Empty lines and lines starting with # are skipped.
+
+    Args:
+        filename (str): Name of the text file.
+
+    Returns:
+        list: (start_time, end_time) tuples."""
+    intervals = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.replace(',', ' ').split()
+            if len(fields) != 2:
+                raise ValueError(f"Expected a start and an end time, got '{line}'")
+            intervals.append(tuple(fields))
+    return intervals
+
+def _mjd_to_datetime64(mjd):
+    return _MJD_EPOCH + np.round(np.asarray(mjd)*86400e3).astype('timedelta64[ms]')
+
+def _file_intervals(table, intervals, every):
+    """Intervals (as datetime64 pairs) of one converted file: those of *intervals* that contain at least one time bin, or consecutive windows of every seconds covering the file."""
+    time_mjd = table['time_mjd']
+    if every:
+        half_width = np.asarray(table['TIMEDEL'], dtype = float)/172800.
+        tstart = np.arange(time_mjd[0] - half_width[0], time_mjd[-1] + half_width[-1], every/86400.)
+        tend = tstart + every/86400.
+        start, end = _mjd_to_datetime64(tstart), _mjd_to_datetime64(tend)
+    else:
+        tstart, tend = intervals['mjd'].T
+        start, end = intervals['start'], intervals['end']
+    keep = np.searchsorted(time_mjd, tstart, side = 'left') < np.searchsorted(time_mjd, tend, side = 'left')
+    return list(zip(start[keep], end[keep]))
+
+def _extract_file(result, fitsfile, kwargs):
+    """Extract the spectra of one converted file, see *extract_spectra*."""
+    with stage('read', fitsfile):
+        table = read_rate_table(fitsfile)
+    intervals = _file_intervals(table, kwargs['intervals'], kwargs['every'])
+    out_dir = kwargs['out_dir'] or os.path.dirname(os.path.abspath(fitsfile))
+    basename = os.path.join(out_dir, os.path.basename(fitsfile))
+    with stage('write', fitsfile):
+        if intervals and kwargs['pha2']:
+            out_fitsname = f"{basename[:-5]}_pha2.fits"
+            result['n_spectra'] = time_intervals_to_pha2(table, intervals, out_fitsname, overwrite = kwargs['overwrite'])
+            result['output'] = out_fitsname
+            result['spectra'] = [out_fitsname]
+        elif intervals:
+            out_fitsnames = [_interval_default_fitsname(basename, start_time, end_time) for start_time, end_time in intervals]
+            if kwargs['overwrite']:
+                for name in out_fitsnames:
+                    if os.path.exists(name):
+                        os.remove(name)
+            result['spectra'] = spectra_from_time_intervals(table, intervals, out_fitsnames = out_fitsnames)
+            result['n_spectra'] = len(out_fitsnames)
+            result['output'] = out_dir
+
+def _extract_one(fitsfile, kwargs):
+    """Worker for *extract_spectra*: extract the spectra of one converted file and report the outcome instead of raising."""
+    return run_reported(_extract_file, {'file': fitsfile, 'output': None, 'spectra': [], 'n_spectra': 0}, fitsfile, kwargs)
+
+def extract_spectra(fitsfiles, intervals = None, every = None, out_dir = None, pha2 = False, overwrite = False, jobs = None):
+    """Average count rates over time intervals of many converted FITS files, in parallel over a pool of worker processes. Each file is read once, and only the intervals that contain at least one of its time bins are extracted from it, so one list of intervals (e.g. of flares) can be applied to a whole set of files.
+
+    Args:
+        fitsfiles (list): Names of the converted FITS files.
+        intervals (list, optional): Defaults to None. (start_time, end_time) tuples, in any format readable by astropy.Time.
+        every (float, optional): Defaults to None. Instead of intervals, split each file into consecutive windows of this many seconds, starting at its first time bin.
+        out_dir (str, optional): Defaults to None, i.e. next to each input file. Directory in which the spectra are written.
+        pha2 (bool, optional): Defaults to False. Write the spectra of each file as the rows of one OGIP type II PHA file, see *time_intervals_to_pha2*, instead of one file per interval, see *spectra_from_time_intervals*.
+        overwrite (bool, optional): Defaults to False. Overwrite existing output files.
+        jobs (int, optional): Defaults to None, in which case one worker per CPU is used. Number of worker processes. If 1, the files are processed in the current process.
+
+    Returns:
+        list: One dictionary per input file, in input order, with keys 'file', 'success', 'output' (output directory, or the PHA file), 'spectra' (files written), 'n_spectra', 'error' (None or the error message), 'elapsed' (seconds) and 'stages' (seconds spent in 'read' and 'write', see *jobs.run_reported*)."""
+    if (intervals is None) == (every is None):
+        raise ValueError("Exactly one of 'intervals' and 'every' must be given")
+    if intervals is not None:
+        from astropy.time import Time
+        intervals = list(intervals)
+        start, end = Time([i[0] for i in intervals]), Time([i[1] for i in intervals])
+        intervals = {'start': start.datetime64.astype('datetime64[ms]'), 'end': end.datetime64.astype('datetime64[ms]'), 'mjd': np.column_stack([start.mjd, end.mjd])}
+    elif every <= 0:
+        raise ValueError("Parameter 'every' must be positive")
+    fitsfiles = list(fitsfiles)
+    kwargs = {'intervals': intervals, 'every': every, 'out_dir': out_dir, 'pha2': pha2, 'overwrite': overwrite}
+    return map_jobs(_extract_one, fitsfiles, [kwargs] * len(fitsfiles), jobs = jobs)
+
+def _index_file(entry, fitsfile):
+    """Summarize one converted file, see *index_spectra*."""
+    with stage('read', fitsfile):
+        table = read_rate_table(fitsfile)
+    with stage('summarize', fitsfile):
+        half_width = np.asarray(table['TIMEDEL'], dtype = float)/172800.
+        livetime = table['LIVETIME'] if table['LIVETIME'].ndim == 1 else table['LIVETIME'][:,0]
+        total_rate = np.nansum(table['RATE'], axis = 1)
+        energies = table['energy_hdu'].data
+        entry.update({'start': str(_mjd_to_datetime64(table['time_mjd'][0] - half_width[0])),
+                      'end': str(_mjd_to_datetime64(table['time_mjd'][-1] + half_width[-1])),
+                      'n_times': int(table['time_mjd'].size),
+                      'n_channels': int(table['channel'].size),
+                      'e_min': float(np.min(energies['E_MIN'])),
+                      'e_max': float(np.max(energies['E_MAX'])),
+                      'cadence': float(np.median(table['TIMEDEL'])),
+                      'duration': float(np.sum(table['TIMEDEL'])),
+                      'exposure': float(np.sum(table['TIMEDEL']*livetime)),
+                      'peak_time': str(_mjd_to_datetime64(table['time_mjd'][np.argmax(total_rate)])),
+                      'peak_rate': float(np.max(total_rate)),
+                      'srm_file': table['rate_header'].get('RESPFILE')})
+
+def _index_one(fitsfile):
+    """Worker for *index_spectra*: summarize one converted file and report the outcome instead of raising."""
+    return run_reported(_index_file, {'file': fitsfile}, fitsfile)
+
+def index_spectra(fitsfiles, jobs = None):
+    """Summarize many converted FITS files, e.g. to find the files covering a given time or the brightest periods, in parallel over a pool of worker processes.
+
+    Args:
+        fitsfiles (list): Names of the converted FITS files.
+        jobs (int, optional): Defaults to None, in which case one worker per CPU is used. Number of worker processes. If 1, the files are processed in the current process.
+
+    Returns:
+        list: One dictionary per input file, in input order, with keys 'file', 'start' and 'end' (ISO times of the first and last bin edges), 'n_times', 'n_channels', 'e_min' and 'e_max' (keV), 'cadence' (median bin duration in seconds), 'duration' and 'exposure' (seconds), 'peak_time' and 'peak_rate' (of the count rate summed over channels), 'srm_file', as well as 'success', 'error', 'elapsed' and 'stages' (seconds spent in 'read' and 'summarize')."""
+    return map_jobs(_index_one, fitsfiles, jobs = jobs)
+
+def batch_summary(command, results, elapsed, jobs = None):
+    """Machine-readable summary of a batch run.
+
+    Args:
+        command (str): Name of the batch command, e.g. 'convert'.
+        results (list): Per-file result dictionaries, e.g. from *convert_spectrograms*, *extract_spectra* or *index_spectra*.
+        elapsed (float): Wall time of the whole run in seconds.
+        jobs (int, optional): Defaults to None. Number of worker processes used.
+
+    Returns:
+        dict: 'command', 'jobs', 'elapsed', 'n_files', 'n_failed', 'stages' (seconds per stage, summed over files; with several workers the sum exceeds the wall time, and stages run within other stages, e.g. 'read' within 'convert', are counted in both) and 'files' (the per-file results)."""
+    stages = {}
+    for r in results:
+        for name, seconds in r.get('stages', {}).items():
+            stages[name] = stages.get(name, 0.) + seconds
+    return {'command': command,
+            'jobs': jobs,
+            'elapsed': elapsed,
+            'n_files': len(results),
+            'n_failed': sum(not r['success'] for r in results),
+            'stages': stages,
+            'files': results}
+
+def _to_json(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+def write_summary(summary, filename):
+    """Write a summary (or any dictionary or list of results) as JSON.
+
+    Args:
+        summary (dict or list): The summary, see *batch_summary*.
+        filename (str): Name of the JSON file, or '-' for standard output."""
+    if filename == '-':
+        print(json.dumps(summary, indent = 1, default = _to_json))
+        return
+    with open(filename, 'w') as f:
+        json.dump(summary, f, indent = 1, default = _to_json)
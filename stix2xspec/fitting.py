@@ -0,0 +1,313 @@
+import numpy as np
+import os
+from .response import ResponseMatrix
+from .spectrogram_utils import match_energies
+
+#photon flux at 1 AU of an isothermal plasma, in photons s^-1 cm^-2 keV^-1 for EM = 1e49 cm^-3 (Kramers approximation, see e.g. Tandberg-Hanssen & Emslie 1988)
+_BREMSSTRAHLUNG_CONSTANT = 8.1e-39*1e49
+_KEV_TO_KELVIN = 1.160452e7
+
+def thermal_bremsstrahlung(energy, kT, EM):
+    """Free-free photon spectrum of an isothermal plasma at 1 AU. Line emission is not included.
+
+    Args:
+        energy (np.array): Photon energies in keV.
+        kT (float or np.array): Temperature in keV.
+        EM (float or np.array): Emission measure in units of 1e49 cm^-3.
+
+    Returns:
+        np.array: Photon flux in photons s^-1 cm^-2 keV^-1."""
+    return _BREMSSTRAHLUNG_CONSTANT*EM*np.exp(-energy/kT)/(energy*np.sqrt(kT*_KEV_TO_KELVIN))
+
+def power_law(energy, norm, index):
+    """Power-law photon spectrum, as XSPEC *powerlaw*.
+
+    Args:
+        energy (np.array): Photon energies in keV.
+        norm (float or np.array): Photon flux at 1 keV in photons s^-1 cm^-2 keV^-1.
+        index (float or np.array): Photon index.
+
+    Returns:
+        np.array: Photon flux in photons s^-1 cm^-2 keV^-1."""
+    return norm*energy**-index
+
+def broken_power_law(energy, norm, index1, break_energy, index2):
+    """Broken power-law photon spectrum, as XSPEC *bknpower*.
+
+    Args:
+        energy (np.array): Photon energies in keV.
+        norm (float or np.array): Photon flux at 1 keV in photons s^-1 cm^-2 keV^-1.
+        index1 (float or np.array): Photon index below the break.
+        break_energy (float or np.array): Break energy in keV.
+        index2 (float or np.array): Photon index above the break.
+
+    Returns:
+        np.array: Photon flux in photons s^-1 cm^-2 keV^-1."""
+    return np.where(energy <= break_energy, norm*energy**-index1, norm*break_energy**(index2 - index1)*energy**-index2)
+
+#model components: function, parameter names, start values, limits, which parameters are kept positive (fit in log space) and which one is the normalization
+MODELS = {'thermal': {'function': thermal_bremsstrahlung, 'parameters': ('kT', 'EM'), 'start': (1.5, 1.), 'limits': ((0.1, 64.), (0., np.inf)), 'positive': (True, True), 'norm': 1},
+          'powerlaw': {'function': power_law, 'parameters': ('norm', 'PhoIndex'), 'start': (1., 4.), 'limits': ((0., np.inf), (-3., 10.)), 'positive': (True, False), 'norm': 0},
+          'bknpower': {'function': broken_power_law, 'parameters': ('norm', 'PhoIndx1', 'BreakE', 'PhoIndx2'), 'start': (1., 4., 15., 6.), 'limits': ((0., np.inf), (-3., 10.), (0.01, 1e6), (-3., 10.)), 'positive': (True, False, True, False), 'norm': 0}}
+
+def bin_photon_flux(energ_lo, energ_hi, components, values):
+    """Photon flux of a sum of model components integrated over photon energy bins (Simpson's rule), for many parameter sets at once.
+
+    Args:
+        energ_lo (np.array): Lower edges of the photon energy bins (keV).
+        energ_hi (np.array): Upper edges of the photon energy bins (keV).
+        components (list): Names of model components in MODELS.
+        values (list): Parameter values of each component, each an array of shape (n_parameters,) or (n_sets, n_parameters).
+
+    Returns:
+        np.array: Photon flux per bin (photons s^-1 cm^-2), of shape (n_sets, n_energies)."""
+    nodes = np.stack([energ_lo, (energ_lo + energ_hi)/2., energ_hi])[:,None,:]
+    flux = 0.
+    for component, params in zip(components, values):
+        params = np.atleast_2d(params)
+        f = MODELS[component]['function'](nodes, *[p[None,:,None] for p in params.T])
+        flux = flux + (f[0] + 4*f[1] + f[2])/6.
+    return flux*(energ_hi - energ_lo)
+
+class SpectrumFitter:
+    """Fit photon models to one STIX count spectrum in NumPy, without XSPEC. The model photon flux is integrated over the photon energy bins of the response and folded through it, for many parameter sets at once (the model and all the finite-difference Jacobian columns in one call), and the fit statistic is minimized with Levenberg-Marquardt.
+
+    *fit* follows the staging of *xspec_utils.fit_thermal_nonthermal*. The thermal model is free-free emission only, so temperatures from spectra with strong Fe line emission (~6.7 keV) will differ from those of *apec* or *vth*. Use it for quick-look and surveys, and XSPEC for final results."""
+    #a fit has converged when an iteration improves the statistic by less than this, as XSPEC Fit.criticalDelta
+    CRITICAL_DELTA = 0.01
+
+    def __init__(self, rate, stat_err, exposure, response, sys_err = None):
+        """
+        Args:
+            rate (np.array): Count rate per channel (counts/s).
+            stat_err (np.array): Statistical error of the count rate.
+            exposure (float): Exposure (duration x livetime) in seconds, used to recover counts for C-stat.
+            response (stix2xspec.response.ResponseMatrix): Response, cropped to the channels of the spectrum.
+            sys_err (np.array, optional): Defaults to None, i.e. zero. Fractional systematic error per channel, as in the SYS_ERR column. Added in quadrature to the statistical error for chi-squared; not used by C-stat."""
+        self.rate = np.asarray(rate, dtype = float)
+        self.stat_err = np.asarray(stat_err, dtype = float)
+        if self.rate.size != response.n_channels:
+            raise ValueError(f"Spectrum has {self.rate.size} channels but the response has {response.n_channels}")
+        self.sys_err = np.zeros_like(self.rate) if sys_err is None else np.broadcast_to(np.asarray(sys_err, dtype = float), self.rate.shape)
+        self.exposure = float(exposure)
+        self.response = response
+        self.variance = self.stat_err**2 + (self.sys_err*self.rate)**2
+        self.e_mean = (response.e_min + response.e_max)/2.
+
+    @classmethod
+    def from_fits(cls, fitsfile, row = 0, srm_file = None):
+        """Make the fitter for one row of a converted FITS file, see *stix2xspec.convert_spectrogram* and *xspec_utils.spectrum_from_time_interval*.
+
+        Args:
+            fitsfile (str or dict): Name of the converted FITS file, or its rate table as returned by *xspec_utils.read_rate_table*.
+            row (int, optional): Defaults to 0. Row (time bin or interval) to fit.
+            srm_file (str, optional): Defaults to None, in which case the RESPFILE of the rate table is used, looked up next to fitsfile first. Response file, full or cropped.
+
+        Returns:
+            SpectrumFitter: The fitter."""
+        if isinstance(fitsfile, dict):
+            table, fitsdir = fitsfile, ''
+        else:
+            from .xspec_utils import read_rate_table
+            table, fitsdir = read_rate_table(fitsfile), os.path.dirname(fitsfile)
+        if srm_file is None:
+            srm_file = table['rate_header'].get('RESPFILE', 'stx_srm_full.fits')
+            if os.path.isfile(os.path.join(fitsdir, srm_file)):
+                srm_file = os.path.join(fitsdir, srm_file)
+        response = ResponseMatrix.from_fits(srm_file)
+        channels, matched = match_energies(table['energy_hdu'].data['E_MIN'], response.e_min)
+        if not matched.all():
+            raise ValueError(f"Energy channels of {srm_file} do not cover those of the spectrum")
+        exposure = table['TIMEDEL'][row]*np.ravel(table['LIVETIME'][row])[0]
+        return cls(table['RATE'][row], table['STAT_ERR'][row], exposure, response.crop(channels), sys_err = table['SYS_ERR'][row])
+
+    def photon_flux(self, components, values):
+        """Photon flux of a sum of model components integrated over each photon energy bin of the response, see *bin_photon_flux*."""
+        return bin_photon_flux(self.response.energ_lo, self.response.energ_hi, components, values)
+
+    def model_rate(self, components, values):
+        """Model count rate per channel (counts/s), for one or many parameter sets.
+
+        Args:
+            components (list): Names of model components in MODELS.
+            values (list): Parameter values of each component, see *photon_flux*.
+
+        Returns:
+            np.array: Count rate of shape (n_sets, n_channels)."""
+        return self.response.fold(self.photon_flux(components, values))
+
+    def noticed(self, Erange):
+        """Channels with their mean energy within Erange, excluding channels without errors.
+
+        Args:
+            Erange (list or tuple): Lower and upper energy in keV.
+
+        Returns:
+            np.array: Boolean mask over channels."""
+        return (self.e_mean >= Erange[0]) & (self.e_mean <= Erange[1]) & (self.variance > 0)
+
+    def _residuals(self, model, mask, statMethod):
+        """Residuals whose sum of squares is the fit statistic, for each row of model."""
+        if statMethod == 'chi':
+            return (self.rate[mask] - model[:,mask])/np.sqrt(self.variance[mask])
+        #C-stat as signed square roots of the Poisson deviance of each channel; background-subtracted counts are clipped at zero
+        data = np.clip(self.rate[mask]*self.exposure, 0, None)
+        mod = np.clip(model[:,mask]*self.exposure, 1e-30, None)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            dlog = np.where(data > 0, data*np.log(data/mod), 0.)
+        return np.sign(mod - data)*np.sqrt(np.clip(2*(mod - data + dlog), 0, None))
+
+    def _renorm(self, components, values, free, mask):
+        """Scale the free normalizations by the common factor that best matches the data, with the components whose normalization is frozen kept fixed, as XSPEC *Fit.renorm*."""
+        scaled = [c for c in components if free[c][MODELS[c]['norm']]]
+        if not scaled:
+            return
+        model = self.model_rate(scaled, [values[c] for c in scaled])[0,mask]
+        fixed = [c for c in components if c not in scaled]
+        target = self.rate[mask] - (self.model_rate(fixed, [values[c] for c in fixed])[0,mask] if fixed else 0.)
+        weight = 1./self.variance[mask]
+        denominator = np.sum(model**2*weight)
+        if denominator > 0:
+            scale = np.sum(target*model*weight)/denominator
+            if scale > 0:
+                for c in scaled:
+                    values[c][MODELS[c]['norm']] *= scale
+
+    def _minimize(self, components, values, free, limits, mask, statMethod, nIterations):
+        """Levenberg-Marquardt over the free parameters, updating values in place. Positive parameters are fit in log space, and steps are clipped to the parameter limits.
+
+        Returns:
+            tuple: Fit statistic, number of iterations, and the parameter sigmas of each component."""
+        index = [(c, i) for c in components for i in range(len(values[c])) if free[c][i]]
+        positive = np.array([MODELS[c]['positive'][i] for c, i in index])
+
+        def to_values(u):
+            """Parameter sets (one per row of u) as per-component arrays."""
+            sets = [np.tile(values[c], (u.shape[0], 1)) for c in components]
+            x = np.where(positive, np.exp(u), u)
+            for j, (c, i) in enumerate(index):
+                sets[components.index(c)][:,i] = x[:,j]
+            return sets
+
+        def residuals(u):
+            return self._residuals(self.model_rate(components, to_values(u)), mask, statMethod)
+
+        with np.errstate(divide = 'ignore'):
+            bounds = np.array([np.log(limits[c][i]) if p else limits[c][i] for (c, i), p in zip(index, positive)]).reshape((-1, 2))
+        u = np.clip([np.log(values[c][i]) if p else values[c][i] for (c, i), p in zip(index, positive)], bounds[:,0], bounds[:,1])
+        step = 1e-6*np.maximum(np.abs(u), 1.)
+        lam = 1e-3
+        r = residuals(u[None,:])[0]
+        stat = np.sum(r**2)
+        n_iter = 0
+        jac = np.zeros((r.size, u.size))
+        for n_iter in range(1, nIterations + 1):
+            step = np.where(u + np.abs(step) > bounds[:,1], -np.abs(step), np.abs(step)) #difference inwards at an upper limit
+            trial = np.vstack([u, u + np.diag(step)]) #model and all finite-difference columns in one evaluation
+            res = residuals(trial)
+            jac = ((res[1:] - res[0])/step[:,None]).T
+            jtj = jac.T @ jac
+            grad = jac.T @ r
+            improved = False
+            while lam < 1e10:
+                delta = np.clip(u + np.linalg.solve(jtj + lam*np.diag(np.diag(jtj) + 1e-12), -grad), bounds[:,0], bounds[:,1]) - u
+                r_new = residuals((u + delta)[None,:])[0]
+                stat_new = np.sum(r_new**2)
+                if np.isfinite(stat_new) and stat_new <= stat:
+                    improved = True
+                    lam = max(lam/10., 1e-10)
+                    break
+                lam *= 10.
+            if not improved:
+                break
+            converged = stat - stat_new < self.CRITICAL_DELTA
+            u, r, stat = u + delta, r_new, stat_new
+            if converged:
+                break
+        for (c, i), v, p in zip(index, u, positive):
+            values[c][i] = np.exp(v) if p else v
+
+        sigmas = {c: np.zeros(len(values[c])) for c in components}
+        try:
+            cov = np.linalg.inv(jac.T @ jac)
+            sigma_u = np.sqrt(np.clip(np.diag(cov), 0, None))
+        except np.linalg.LinAlgError:
+            sigma_u = np.full(u.size, np.nan)
+        for (c, i), s, p in zip(index, sigma_u, positive):
+            sigmas[c][i] = s*values[c][i] if p else s
+        return stat, n_iter, sigmas
+
+    def fit(self, thmodel = 'thermal', ntmodel = 'bknpower', lowErange = [2.0,10.0], highErange = [8.0,30.0], breakEstart = 15, breakEfrozen = False, statMethod = 'chi', nIterations = 1000, start = None):
+        """Fit thermal and non-thermal components with the steps of *xspec_utils.fit_thermal_nonthermal*:
+
+        1) fit thermal over low energy
+        2) fit non-thermal over high energy with the thermal frozen and the break energy (if any) frozen at breakEstart
+            2a) unfreeze break energy and fit non-thermal again
+        3) fit thermal and non-thermal together over the entire energy range
+
+        Args:
+            thmodel (str, optional): Defaults to 'thermal'. Thermal model, a key of MODELS.
+            ntmodel (str, optional): Defaults to 'bknpower'. Non-thermal model, 'bknpower', 'powerlaw' or None to fit only the thermal model.
+            lowErange (list or tuple, optional): Defaults to [2.0,10.0]. Energy range (keV) of the thermal fit.
+            highErange (list or tuple, optional): Defaults to [8.0,30.0]. Energy range (keV) of the non-thermal fit.
+            breakEstart (float, optional): Defaults to 15. Start value of the break energy.
+            breakEfrozen (bool, optional): Defaults to False. Keep the break energy frozen at breakEstart.
+            statMethod (str, optional): Defaults to 'chi'. 'chi' or 'cstat'.
+            nIterations (int, optional): Defaults to 1000. Maximum number of iterations of each step.
+            start (dict, optional): Defaults to None. Start values of each component's parameters, e.g. the 'params' of a previous fit. Steps 1 and 2 and the renormalization before step 3 are skipped if start values are given for all components.
+
+        Returns:
+            dict: 'params' and 'sigmas' (tuples per component, zero sigma for frozen parameters), 'statistic', 'dof' and the total number of 'iterations'."""
+        if statMethod not in ['chi', 'cstat']:
+            raise ValueError("Parameter 'statMethod' must be 'chi' or 'cstat'")
+        components = [thmodel] if ntmodel is None else [thmodel, ntmodel]
+        values = {c: np.array(MODELS[c]['start'], dtype = float) for c in components}
+        free = {c: np.ones(len(values[c]), dtype = bool) for c in components}
+        has_break = 'BreakE' in MODELS[components[-1]]['parameters']
+        limits = {c: np.array(MODELS[c]['limits'], dtype = float) for c in components}
+        if ntmodel is not None and has_break:
+            values[ntmodel][MODELS[ntmodel]['parameters'].index('BreakE')] = breakEstart
+            limits[ntmodel][MODELS[ntmodel]['parameters'].index('BreakE'), 1] = breakEstart + 2 #as in xspec_utils.fit_thermal_nonthermal
+        start = start or {}
+        for c in start:
+            values[c] = np.array(start[c], dtype = float)
+        warm = all(c in start for c in components)
+        n_iterations = 0
+
+        if not warm:
+            #step 1
+            mask = self.noticed(lowErange)
+            self._renorm([thmodel], values, free, mask)
+            stat, n, sigmas = self._minimize([thmodel], values, free, limits, mask, statMethod, nIterations)
+            n_iterations += n
+            if ntmodel is not None:
+                #step 2
+                free[thmodel][:] = False
+                mask = self.noticed(highErange)
+                if has_break:
+                    free[ntmodel][MODELS[ntmodel]['parameters'].index('BreakE')] = False
+                self._renorm(components, values, free, mask)
+                stat, n, sigmas = self._minimize(components, values, free, limits, mask, statMethod, nIterations)
+                n_iterations += n
+                if has_break and not breakEfrozen: #step 2a
+                    free[ntmodel][MODELS[ntmodel]['parameters'].index('BreakE')] = True
+                    stat, n, sigmas = self._minimize(components, values, free, limits, mask, statMethod, nIterations)
+                    n_iterations += n
+                free[thmodel][:] = True
+
+        if ntmodel is not None:
+            #step 3
+            mask = self.noticed([lowErange[0], highErange[1]])
+            if has_break:
+                free[ntmodel][MODELS[ntmodel]['parameters'].index('BreakE')] = not breakEfrozen
+            if not warm:
+                self._renorm(components, values, free, mask)
+            stat, n, sigmas = self._minimize(components, values, free, limits, mask, statMethod, nIterations)
+            n_iterations += n
+        elif warm:
+            mask = self.noticed(lowErange)
+            stat, n, sigmas = self._minimize(components, values, free, limits, mask, statMethod, nIterations)
+            n_iterations += n
+
+        n_free = sum(int(free[c].sum()) for c in components)
+        return {'params': {c: tuple(float(v) for v in values[c]) for c in components}, 'sigmas': {c: tuple(float(v) for v in sigmas[c]) for c in components}, 'statistic': float(stat), 'dof': int(mask.sum()) - n_free, 'iterations': n_iterations}
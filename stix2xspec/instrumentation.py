@@ -0,0 +1,232 @@
+import functools
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+from contextlib import nullcontext
+try:
+    import resource
+except ImportError: #not available on Windows
+    resource = None
+
+_recorders = [] #active StageRecorders; while empty, instrumented stages run without any bookkeeping
+_open_stages = [] #stages currently running, innermost last
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024 #ru_maxrss is in bytes on macOS and in kilobytes on Linux
+_reset_peak = getattr(tracemalloc, 'reset_peak', None) #Python 3.9+
+
+def _max_rss():
+    """Peak resident set size of the process so far, in bytes, or None where it is not available."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*_RSS_UNIT
+
+def _array_sizes(obj, result):
+    """Shapes of the arrays a stage worked on: the array attributes of obj (e.g. the Spectrogram) and the arrays returned by the stage, directly, in a tuple or as attributes of a returned object.
+
+    Returns:
+        tuple: dictionary of shapes, total size in bytes"""
+    arrays = {}
+    if hasattr(obj, '__dict__'):
+        arrays.update((k, v) for k, v in vars(obj).items() if isinstance(v, np.ndarray))
+    results = result if isinstance(result, tuple) else (result,)
+    for i, r in enumerate(results):
+        name = 'result' if len(results) == 1 else f"result[{i}]"
+        if isinstance(r, np.ndarray):
+            arrays[name] = r
+        elif hasattr(r, '__dict__') and r is not obj:
+            arrays.update((f"{name}.{k}", v) for k, v in vars(r).items() if isinstance(v, np.ndarray))
+    return {k: list(v.shape) for k, v in arrays.items()}, int(sum(v.nbytes for v in arrays.values()))
+
+class _Stage:
+    """Measure one run of a stage and pass the record to the active recorders, see *stage*."""
+    def __init__(self, name, obj = None):
+        self.name = name
+        self.obj = obj
+        self.result = None
+
+    def __enter__(self):
+        self.parent = _open_stages[-1] if _open_stages else None
+        self.tracing = _reset_peak is not None and tracemalloc.is_tracing()
+        if self.tracing: #the peak is reset for every stage, so hand the peak so far on to the enclosing stage first
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent._peak = max(self.parent._peak, peak)
+            _reset_peak()
+            self._traced_start = self._peak = current
+        self._rss_start = _max_rss()
+        _open_stages.append(self)
+        self._start = time.time()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        _open_stages.remove(self)
+        max_rss = _max_rss()
+        arrays, nbytes = _array_sizes(self.obj, self.result)
+        record = {'stage': self.name,
+                  'parent': None if self.parent is None else self.parent.name,
+                  'depth': len(_open_stages),
+                  'file': self.obj if isinstance(self.obj, str) else getattr(self.obj, 'filename', None),
+                  'start': self._start,
+                  'wall': wall,
+                  'cpu': cpu,
+                  'max_rss': max_rss,
+                  'max_rss_increase': None if max_rss is None else max_rss - self._rss_start,
+                  'traced_peak': None,
+                  'arrays': arrays,
+                  'nbytes': nbytes,
+                  'error': None if exc_type is None else exc_type.__name__}
+        if self.tracing:
+            self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            record['traced_peak'] = self._peak - self._traced_start
+            if self.parent is not None and self.parent.tracing:
+                self.parent._peak = max(self.parent._peak, self._peak)
+        for recorder in list(_recorders):
+            recorder.add(record)
+        return False
+
+def stage(name, obj = None):
+    """Context manager recording a block of code as a stage, if a *StageRecorder* is active. Set the *result* attribute of the returned object to include the arrays the block produced in the record, e.g.::
+
+        with stage('rebin', spec) as s:
+            s.result = rebin(spec)
+
+    Args:
+        name (str): Name of the stage.
+        obj (object, optional): Defaults to None. Object the stage works on, e.g. a Spectrogram, whose file name and array attributes are recorded, or a file name.
+
+    Returns:
+        context manager: A stage, or a no-op context manager (which yields None) if nothing is being recorded."""
+    if not _recorders:
+        return nullcontext()
+    return _Stage(name, obj)
+
+def instrument_stage(name):
+    """Decorator recording each call of a function or method as a stage, if a *StageRecorder* is active. The first argument (self for methods) is the object the stage works on, see *stage*. When nothing is being recorded the only overhead is one check of an empty list.
+
+    Args:
+        name (str): Name of the stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _recorders:
+                return func(*args, **kwargs)
+            with _Stage(name, args[0] if args else None) as s:
+                s.result = func(*args, **kwargs)
+            return s.result
+        return wrapper
+    return decorator
+
+class StageRecorder:
+    """Record the wall time, CPU time, memory use and array sizes of every instrumented stage that runs while the recorder is active: reading the FITS file ('read'), 'apply_elut', 'correct_counts', 'process_in_chunks', processing the background ('background'), 'background_subtract', writing the response ('write_srm') and 'spectrum_to_fits', each within a 'convert' stage when run by *convert_spectrogram*.
+
+    Each record is a dictionary with keys 'stage', 'parent' (enclosing stage or None), 'depth', 'file', 'start' (Unix time), 'wall' and 'cpu' (seconds; CPU time of the whole process), 'max_rss' (peak resident set size of the process in bytes at the end of the stage), 'max_rss_increase' (by how much the stage raised it), 'traced_peak' (bytes allocated by the stage on top of what was allocated before it, at its peak, if trace_memory is set), 'arrays' (shapes of the arrays of the Spectrogram the stage worked on, and of the arrays it returned), 'nbytes' (their total size) and 'error' (exception type, if the stage failed), updated with the recorder's context.
+
+    Recording is per process and not thread-safe. Use as a context manager, e.g.::
+
+        with StageRecorder(jsonl = 'stages.jsonl', context = {'run': 'test'}) as recorder:
+            convert_spectrogram(fitsfile, bgfile, to_fits = True)
+        print(recorder.summary())
+    """
+    def __init__(self, jsonl = None, trace_memory = False, hooks = None, context = None):
+        """Args:
+            jsonl (str, optional): Defaults to None. Append each record as a line of JSON to this file as soon as the stage ends.
+            trace_memory (bool, optional): Defaults to False. Trace Python memory allocations with tracemalloc (Python 3.9+) to get the peak memory of each stage, at the cost of slowing down allocations while recording.
+            hooks (list, optional): Defaults to None. Functions called with each record.
+            context (dict, optional): Defaults to None. Entries added to every record, e.g. a run or host name."""
+        self.jsonl = jsonl
+        self.trace_memory = trace_memory
+        self.hooks = list(hooks or [])
+        self.context = dict(context or {})
+        self.records = []
+        self._file = None
+        self._stop_tracing = False
+
+    def add_hook(self, hook):
+        """Call hook(record) for each new record."""
+        self.hooks.append(hook)
+
+    def add(self, record):
+        """Store a record, write it to the JSON lines file and pass it to the hooks."""
+        record = dict(self.context, **record)
+        self.records.append(record)
+        if self._file is not None:
+            self._file.write(json.dumps(record, default = str) + '\n')
+            self._file.flush()
+        for hook in self.hooks:
+            hook(record)
+
+    def start(self):
+        """Start recording."""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._stop_tracing = True
+        if self.jsonl is not None:
+            self._file = open(self.jsonl, 'a')
+        _recorders.append(self)
+        return self
+
+    def stop(self):
+        """Stop recording. The records are kept."""
+        if self in _recorders:
+            _recorders.remove(self)
+        if self._stop_tracing:
+            tracemalloc.stop()
+            self._stop_tracing = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def summary(self):
+        """Totals per stage, see *stage_summary*."""
+        return stage_summary(self.records)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def stage_summary(records):
+    """Totals per stage of a list of records.
+
+    Args:
+        records (list): Records of a *StageRecorder*, or read with *read_jsonl*.
+
+    Returns:
+        dict: For each stage, 'count', total 'wall' and 'cpu' time in seconds, and the largest 'traced_peak', 'max_rss' and 'nbytes' (None if not recorded)."""
+    summary = {}
+    for r in records:
+        s = summary.setdefault(r['stage'], {'count': 0, 'wall': 0., 'cpu': 0., 'traced_peak': None, 'max_rss': None, 'nbytes': None})
+        s['count'] += 1
+        s['wall'] += r['wall']
+        s['cpu'] += r['cpu']
+        for key in ['traced_peak', 'max_rss', 'nbytes']:
+            if r.get(key) is not None:
+                s[key] = r[key] if s[key] is None else max(s[key], r[key])
+    return summary
+
+def write_jsonl(records, filename):
+    """Write records as JSON lines.
+
+    Args:
+        records (list): Records of a *StageRecorder*.
+        filename (str): Name of the file, or '-' for standard output."""
+    lines = ''.join(json.dumps(r, default = str) + '\n' for r in records)
+    if filename == '-':
+        sys.stdout.write(lines)
+        return
+    with open(filename, 'w') as f:
+        f.write(lines)
+
+def read_jsonl(filename):
+    """Read records written by *write_jsonl* or by a *StageRecorder*.
+
+    Returns:
+        list: The records."""
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
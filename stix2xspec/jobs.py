@@ -0,0 +1,48 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .instrumentation import StageRecorder, stage_summary
+
+def map_jobs(worker, *iterables, jobs = None, initializer = None, initargs = ()):
+    """Call worker with one item of each iterable at a time, as *map* does, in the current process if jobs is 1 and otherwise in a pool of worker processes.
+
+    Args:
+        worker (callable): Function to call. Unless jobs is 1 it must be picklable, i.e. defined at the top level of a module.
+        *iterables: One iterable per positional argument of worker.
+        jobs (int, optional): Defaults to None, in which case one worker process per CPU is used. Number of worker processes. If 1, everything runs in the current process.
+        initializer (callable, optional): Defaults to None. Called with initargs once in each worker process, or once in the current process if jobs is 1, before the first item.
+        initargs (tuple, optional): Defaults to (). Arguments of initializer.
+
+    Returns:
+        list: The return values of worker, in input order."""
+    if jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return list(map(worker, *iterables))
+    with ProcessPoolExecutor(max_workers = jobs, initializer = initializer, initargs = initargs) as executor:
+        return list(executor.map(worker, *iterables))
+
+def run_reported(func, result, *args, instrument = False):
+    """Run the work on one item of a batch (one file or spectrum) and report the outcome in its result dictionary instead of raising, so that one bad input does not stop the batch. The instrumented stages that func runs are recorded with a *instrumentation.StageRecorder*.
+
+    Args:
+        func (callable): Called as func(result, *args); fills in the result.
+        result (dict): Result of the item, with the entries it has even if func fails, e.g. the input file name.
+        *args: Further arguments of func.
+        instrument (bool or dict, optional): Defaults to False. Also return the stage records, and create the recorder with the keyword arguments in instrument if it is a dictionary, e.g. {'trace_memory': True}.
+
+    Returns:
+        dict: result, with 'success', 'error' (None, or the type and message of the exception raised by func), 'elapsed' (seconds), 'stages' (wall time in seconds per stage, see *instrumentation.stage_summary*) and, with instrument, 'records' (the stage records)."""
+    recorder = StageRecorder(**(instrument if isinstance(instrument, dict) else {}))
+    result.update({'success': False, 'error': None})
+    start = time.perf_counter()
+    try:
+        with recorder:
+            func(result, *args)
+        result['success'] = True
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['elapsed'] = time.perf_counter() - start
+    result['stages'] = {name: s['wall'] for name, s in stage_summary(recorder.records).items()}
+    if instrument:
+        result['records'] = recorder.records
+    return result
@@ -1,12 +1,9 @@
 import numpy as np
-import pandas as pd
 #from astropy.io import fits
 #from astropy import constants
 import warnings
-from datetime import datetime as dt
-from datetime import timedelta as td
-from .triggergram import Triggergram
 from importlib import resources
+from functools import lru_cache
 
 #def pileup_corr_parameter():
 #    subc = construct_subcollimator()
@@ -16,51 +13,127 @@ from importlib import resources
 #    prob_diff_pix = (2./big_pixel_fraction - 1.)/(2./big_pixel_fraction)
 #    return prob_diff_pix
         
-def livetime_fraction(triggergram, det_used, adg_file = 'adg_table.json'):
-    """Calculate the livetime fraction. Equivalent to _stx_livetime_fraction.pro_. Pileup correction parameter is set to beta = 0.940591 rather than calculating directly via an equivalent to _stx_pileup_corr_parameter.pro_.
+@lru_cache(maxsize = 2)
+def _detector_adg_index(adg_file = 'adg_table.json'):
+    """Static map from detector index (0-31) to the index (1-16) of the accumulator detector group (ADG) whose trigger counter it shares. Read from the ADG table once per process.
     
     Args:
-        triggergram (stix2xspec.Triggergram): Triggers associated with input data
-        det_used (np.array): Array of detectors used in observation
         adg_file (str, optional): Name of the ADG file to use
         
     Returns:
-        np.array: livetime fraction"""
+        np.array: ADG index for each of the 32 detectors"""
+    import pandas as pd #only needed once per process
     with resources.path('stix2xspec.data', adg_file) as aa:
         adg_sc = pd.read_json(aa) #should probably be in STIX-CONF
     adg_sc.drop(0, inplace= True) # drop first row
-    det_select = det_used + 1#np.arange(32) + 1
-    ntrig = triggergram.triggerdata.shape[0]
-    tau_array = 10.1e-6 + np.zeros(ntrig) #10.1 microseconds readout time per event
-    eta_array = 2.63e-6 + np.zeros(ntrig) #2.63 microseconds latency time per event
-    beta = 0.940591 #pileup_corr_parameter() for now
-    
-    idx_select = [row.ADG_IDX for i,row in adg_sc.iterrows() if row.SC in det_select]
-    # these are the agd id needed (1-16)
+    adg_idx = np.zeros(32, dtype = int)
+    adg_idx[adg_sc.SC.values - 1] = adg_sc.ADG_IDX.values
+    adg_idx.setflags(write = False)
+    return adg_idx
 
-    # supposed to select the adg_idx of the corresponding collimator
-    ix_fordet = [list(triggergram.adg_idx).index(i) for i in idx_select]
-    
-    ndt = len(triggergram.t_axis.duration)
-    duration = np.tile(triggergram.t_axis.duration, ntrig).reshape((ntrig, ndt))
-    tau_rate =  np.tile(tau_array, ndt).reshape((ndt, ntrig)).T / duration
-    eta_rate =  np.tile(eta_array, ndt).reshape((ndt, ntrig)).T / duration
-    nin = triggergram.triggerdata / (1. -  triggergram.triggerdata * (tau_rate + eta_rate))
-    livetime_frac = np.exp( -1 * beta * eta_rate * nin) /(1. + (tau_rate + eta_rate) * nin)
+def _livetime_from_triggers(triggers, duration, tau = 10.1e-6, eta = 2.63e-6, beta = 0.940591):
+    """Dead-time model of _stx_livetime_fraction.pro_, evaluated by broadcasting the trigger counts against the time bin durations, which run along the last axis.
+    
+    Args:
+        triggers (np.array): Trigger counts, with time as the last axis.
+        duration (np.array): Duration of each time bin in seconds.
+        tau (float, optional): Defaults to 10.1 microseconds. Readout time per event.
+        eta (float, optional): Defaults to 2.63 microseconds. Latency time per event.
+        beta (float, optional): Defaults to 0.940591. Pileup correction parameter.
+        
+    Returns:
+        np.array: livetime fraction, same shape as triggers"""
+    tau_rate = tau / duration
+    eta_rate = eta / duration
+    nin = triggers / (1. - triggers * (tau_rate + eta_rate))
+    return np.exp( -1 * beta * eta_rate * nin) /(1. + (tau_rate + eta_rate) * nin)
 
-    sc_idx = list(adg_sc[adg_sc.SC.isin(det_select)].reset_index().sort_values(by='SC').index.values)
-    new_idx = [ix_fordet[idx] for idx in sc_idx]
+def _trigger_rows(adg_idx, det_used, adg_file = 'adg_table.json'):
+    """Row of the trigger array (ordered as *adg_idx*) that belongs to each detector used."""
+    adg_row = np.full(17, -1)
+    adg_row[np.asarray(adg_idx)] = np.arange(len(adg_idx))
+    rows = adg_row[_detector_adg_index(adg_file)[det_used]]
+    if np.any(rows < 0):
+        raise ValueError("Triggergram does not contain the trigger accumulators of all detectors used")
+    return rows
 
-    if livetime_frac.squeeze().ndim == 1:
-        result = livetime_frac[new_idx]
+def livetime_fraction(triggergram, det_used, adg_file = 'adg_table.json'):
+    """Calculate the livetime fraction. Equivalent to _stx_livetime_fraction.pro_. Pileup correction parameter is set to beta = 0.940591 rather than calculating directly via an equivalent to _stx_pileup_corr_parameter.pro_.
+    
+    The livetime is computed once per trigger accumulator and then mapped to the detectors used, which share accumulators pairwise.
+    
+    Args:
+        triggergram (stix2xspec.Triggergram): Triggers associated with input data
+        det_used (np.array): Array of detectors used in observation
+        adg_file (str, optional): Name of the ADG file to use
+        
+    Returns:
+        np.array: livetime fraction"""
+    rows = _trigger_rows(triggergram.adg_idx, det_used, adg_file = adg_file)
+    duration = np.ravel(triggergram.t_axis.duration)
+    livetime_frac = _livetime_from_triggers(triggergram.triggerdata, duration)
+    return livetime_frac[rows] #should be 32xM
+    
+def livetime_fractions(triggers, triggers_err, duration, det_used, level = 4, clip_low = None):
+    """Lower, nominal and upper livetime fractions of the detectors used, from the triggers -/+ their error. The three estimates are evaluated together along a leading axis of size 3.
+    
+    Args:
+        triggers (np.array): Triggers, 16 accumulators x time for level 1, time x 1 for level 4
+        triggers_err (np.array): Trigger errors, same shape as triggers
+        duration (np.array): Duration of each time bin in seconds
+        det_used (np.array): Array of detectors used in observation
+        level (int, optional): Data level of spectrogram. Defaults to 4.
+        clip_low (bool, optional): Defaults to None, in which case negative lower trigger estimates are set to zero if all trigger errors are positive. Pass the result of that test for the full observation when working on a slice of the time axis.
+        
+    Returns:
+        np.array: livetime fractions, 3 x ndet x ntimes for level 1 or 3 x ntimes for level 4"""
+    err = np.array([-1., 0., 1.]).reshape((3,) + (1,) * triggers_err.ndim) * triggers_err # low, none, high
+    if level == 4:
+        trig = np.swapaxes((triggers + err) * (np.ones(16)/16.), -1, -2)
     else:
-        result = livetime_frac[new_idx,:] #should be 32xM
+        trig = triggers + err
+    
+    if clip_low is None:
+        clip_low = np.all(triggers_err > 0) #lower estimate is entirely below the nominal triggers
+    if clip_low:
+        trig[0][trig[0] <= 0] = 0
+    trig = trig.astype(np.uint64) # as in Triggergram
     
-    return result
+    rows = _trigger_rows(np.arange(16) + 1, det_used)
+    livetime_fracs = _livetime_from_triggers(trig, np.ravel(duration))[:,rows] # 3 x ndet x ntimes
+    if level == 4:
+        livetime_fracs = livetime_fracs[:,0]
+    return livetime_fracs
+
+def livetime_correct(counts, error, livetime_fracs):
+    """Correct counts and errors for livetime, adding the spread between the lower and upper livetime estimates to the error.
+    
+    Args:
+        counts (np.array): Counts to correct
+        error (np.array): Errors of the counts, same shape
+        livetime_fracs (np.array): Lower, nominal and upper livetime fractions along the first axis, each broadcastable to the shape of counts
+        
+    Returns:
+        corrected_counts (np.array): Livetime-corrected counts
+        corrected_error (np.array): Livetime-corrected error"""
+    lt_low, lt_none, lt_high = livetime_fracs
+    corrected_counts = counts/lt_none
+    error_from_livetime = counts/lt_high
+    error_from_livetime -= counts/lt_low
+    error_from_livetime /= 2.
     
+    corrected_error = error/lt_none
+    corrected_error **= 2.
+    error_from_livetime **= 2.
+    corrected_error += error_from_livetime
+    np.sqrt(corrected_error, out = corrected_error)
+    return corrected_counts, corrected_error
+
 def spectrogram_livetime(spectrogram, level = 4):
     """Perform livetime correction to spectrogram counts. Equivalent to _stx_spectrogram_livetime.pro_.
     
+    The lower, nominal and upper trigger estimates (triggers -/+ their error) are evaluated together along a leading axis of size 3, and the livetime fractions are broadcast against the counts rather than tiled to their full shape.
+    
     Args:
         spectrogram (stix2xspec.Spectrogram): Input spectrogram from FITS file, with ELUT applied
         level (int, optional): Data level of spectrogram. Defaults to 4.
@@ -68,51 +141,27 @@ def spectrogram_livetime(spectrogram, level = 4):
     Returns:
         corrected_counts (np.array): Livetime-corrected counts
         corrected_error (np.array): Livetime-corrected error
-        livetime_frac (np.array): Livetime fraction
+        livetime_frac (np.array): Livetime fraction, as a read-only broadcast view with the shape of the counts
         """
+    if level not in [1,4]:
+        warnings.warn('Currently supported compaction levels are 1 (pixel data) and 4 (spectrogram)')
     ntimes = spectrogram.n_times
     nenergies = spectrogram.n_energies
     det_used = np.where(spectrogram.detector_mask == 1)[0]
     ndet = det_used.size
-    err_low = -1 * spectrogram.triggers_err
-    err_none = np.zeros_like(spectrogram.triggers_err)
-    err_high = spectrogram.triggers_err
-    
-    livetime_fracs = []
-    for err in [err_low, err_none, err_high]:
-        if level == 1:
-            dim_counts = (ndet, nenergies, ntimes)
-            trig = spectrogram.triggers + err
-            
-        elif level == 4:
-            dim_counts = (nenergies,ntimes)
-            trig = np.transpose((spectrogram.triggers + err) * (np.ones(16)/16.))
-        
-        if np.sum(np.sign(err))/err.size == -1:
-            trig[trig <=0] = 0
-
-        triggergram = Triggergram(trig, spectrogram.t_axis)
-        livetime_frac = livetime_fraction(triggergram, det_used)
-        if level == 4:
-            livetime_frac = livetime_frac[0,:]
-        livetime_frac = np.tile(livetime_frac,nenergies).reshape(dim_counts) #formerly tile by shape0
-        if level == 4:
-            livetime_frac = livetime_frac.T
-        livetime_fracs.append(livetime_frac)
     
-    if level not in [1,4]:
-        warnings.warn('Currently supported compaction levels are 1 (pixel data) and 4 (spectrogram)')
-    spec_counts = spectrogram.counts.copy()
-    corrected_counts_lower =  spec_counts/livetime_fracs[0]
-    corrected_counts =  spec_counts/livetime_fracs[1]
-    corrected_counts_upper =  spec_counts/livetime_fracs[2]
-
-    error_from_livetime = (corrected_counts_upper - corrected_counts_lower)/2.
-    temp_err = spectrogram.error.copy()
-    if temp_err.shape != livetime_fracs[1].shape: #still necessary?
+    livetime_fracs = livetime_fractions(spectrogram.triggers, spectrogram.triggers_err, spectrogram.t_axis.duration, det_used, level = level)
+    if level == 1:
+        dim_counts = (ndet, nenergies, ntimes)
+        livetime_fracs = livetime_fracs[:,:,np.newaxis,:]
+    elif level == 4:
+        dim_counts = (ntimes, nenergies)
+        livetime_fracs = livetime_fracs[:,:,np.newaxis]
+    
+    temp_err = spectrogram.error
+    if temp_err.shape != dim_counts: #still necessary?
         temp_err = spectrogram.error.T 
     
-    corrected_error = np.sqrt((temp_err/livetime_fracs[1])**2. + error_from_livetime**2.)
-
-    return corrected_counts, corrected_error, livetime_fracs[1]
+    corrected_counts, corrected_error = livetime_correct(spectrogram.counts, temp_err, livetime_fracs)
+    return corrected_counts, corrected_error, np.broadcast_to(livetime_fracs[1], dim_counts)
     
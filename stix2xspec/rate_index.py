@@ -0,0 +1,133 @@
+import numpy as np
+
+def prefix_sums(arr):
+    """Cumulative sum along the first (time) axis with a leading row of zeros, so that the sum over bins [i, j) is row j minus row i.
+
+    Args:
+        arr (np.array): Values per time bin, n_times or n_times x n_energies.
+
+    Returns:
+        np.array: Prefix sums, with one more row than arr."""
+    arr = np.asarray(arr, dtype = float)
+    return np.concatenate([np.zeros((1,) + arr.shape[1:]), np.cumsum(arr, axis = 0)])
+
+class RateIndex:
+    """Cumulative sums over time of the counts, variance, exposure (livetime x duration) and duration of a converted spectrogram. Built once, it gives the spectrum, errors and exposure of any time window from two rows of each sum, independent of the window length, so that thousands of overlapping windows (e.g. when scanning for background or peak intervals) can be evaluated at once.
+
+    A bin belongs to the window [t0, t1) if its center does, as in *xspec_utils.average_time_intervals*."""
+    def __init__(self, time_mean, counts, variance, duration, livetime):
+        """
+        Args:
+            time_mean (np.array): Bin centers in MJD, in increasing order.
+            counts (np.array): Livetime-corrected counts, n_times x n_energies.
+            variance (np.array): Variance of the counts, n_times x n_energies.
+            duration (np.array): Bin durations in seconds.
+            livetime (np.array): Livetime fraction of each bin."""
+        self.time_mean = np.asarray(time_mean, dtype = float)
+        if np.any(np.diff(self.time_mean) < 0):
+            raise ValueError("Parameter 'time_mean' must be in increasing order")
+        duration = np.ravel(duration).astype(float)
+        exposure = duration*np.ravel(livetime)
+        self.n_energies = np.shape(counts)[1]
+        self._counts = prefix_sums(counts)
+        self._variance = prefix_sums(variance)
+        self._exposure = prefix_sums(exposure)
+        self._duration = prefix_sums(duration)
+
+    @classmethod
+    def from_rates(cls, time_mean, rate, stat_err, duration, livetime):
+        """Make the index from a rate table, with counts and variance recovered from the rates as in *Spectrogram._counts_to_rate*.
+
+        Args:
+            time_mean (np.array): Bin centers in MJD.
+            rate (np.array): Count rate, n_times x n_energies.
+            stat_err (np.array): Error of the count rate, n_times x n_energies.
+            duration (np.array): Bin durations in seconds.
+            livetime (np.array): Livetime fraction of each bin, n_times or n_times x n_energies (the same for all energies).
+
+        Returns:
+            RateIndex: The index."""
+        livetime = np.asarray(livetime)
+        if livetime.ndim > 1:
+            livetime = livetime[:,0]
+        exposure = (np.ravel(duration)*livetime)[:,None]
+        rate = np.asarray(rate, dtype = float).reshape((exposure.size, -1))
+        stat_err = np.asarray(stat_err, dtype = float).reshape(rate.shape)
+        return cls(time_mean, rate*exposure, (stat_err*exposure)**2, duration, livetime)
+
+    @classmethod
+    def from_spectrogram(cls, spec):
+        """Make the index from a converted (background-subtracted) Spectrogram, see *stix2xspec.convert_spectrogram*.
+
+        Args:
+            spec (stix2xspec.Spectrogram): The converted spectrogram.
+
+        Returns:
+            RateIndex: The index."""
+        if not "counts_to_rate" in spec.history:
+            spec._counts_to_rate()
+        return cls.from_rates(spec.t_axis.time_mean_mjd, spec.rate, spec.stat_err, spec.t_axis.duration, spec.eff_livetime_fraction)
+
+    @classmethod
+    def from_fits(cls, fitsfile):
+        """Make the index from a converted FITS file.
+
+        Args:
+            fitsfile (str or dict): Name of the converted FITS file, or its rate table as returned by *xspec_utils.read_rate_table*.
+
+        Returns:
+            RateIndex: The index."""
+        if not isinstance(fitsfile, dict):
+            from .xspec_utils import read_rate_table
+            fitsfile = read_rate_table(fitsfile)
+        return cls.from_rates(fitsfile['time_mjd'], fitsfile['RATE'], fitsfile['STAT_ERR'], fitsfile['TIMEDEL'], fitsfile['LIVETIME'])
+
+    @staticmethod
+    def _to_mjd(times):
+        times = np.asarray(times)
+        if np.issubdtype(times.dtype, np.number):
+            return times.astype(float)
+        if np.issubdtype(times.dtype, np.datetime64):
+            from .spectrogram_utils import _MJD_EPOCH
+            return (times - _MJD_EPOCH)/np.timedelta64(1, 'D')
+        from astropy.time import Time
+        return Time(times).mjd
+
+    def bin_range(self, t0, t1):
+        """Indices [first, last) of the bins in each window [t0, t1).
+
+        Args:
+            t0 (float or array): Window starts, in MJD or any format readable by astropy.Time.
+            t1 (float or array): Window ends.
+
+        Returns:
+            tuple: Arrays of first and last (exclusive) bin indices."""
+        first = np.searchsorted(self.time_mean, self._to_mjd(t0), side = 'left')
+        last = np.searchsorted(self.time_mean, self._to_mjd(t1), side = 'left')
+        return first, np.maximum(last, first)
+
+    def query(self, t0, t1):
+        """Spectrum, errors and exposure of one or many windows [t0, t1).
+
+        The rate and error differ from those of *xspec_utils.average_time_intervals* (and of the spectra written by *xspec_utils.spectrum_from_time_interval*), which are the plain means of the RATE and STAT_ERR of the bins in the window. The rates are the same if all bins have the same exposure, but the error here is that of the summed counts, smaller than the mean STAT_ERR by about the square root of the number of bins.
+
+        Args:
+            t0 (float or array): Window starts, in MJD or any format readable by astropy.Time.
+            t1 (float or array): Window ends.
+
+        Returns:
+            dict: 'counts' and 'variance' (summed over the window), 'rate' and 'stat_err' (counts and their error divided by the exposure, i.e. the exposure-weighted mean rate and its error added in quadrature; NaN for empty windows), each n_windows x n_energies, and 'exposure' (sum of livetime x duration), 'duration' and 'n_bins', each of length n_windows. For scalar t0 and t1 the leading window axis is dropped."""
+        scalar = np.ndim(t0) == 0 and np.ndim(t1) == 0
+        first, last = self.bin_range(np.atleast_1d(t0), np.atleast_1d(t1))
+        counts = self._counts[last] - self._counts[first]
+        variance = np.maximum(self._variance[last] - self._variance[first], 0.) #guard against rounding in the difference
+        exposure = self._exposure[last] - self._exposure[first]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            rate = counts/exposure[:,None]
+            stat_err = np.sqrt(variance)/exposure[:,None]
+        rate[last == first] = np.nan
+        stat_err[last == first] = np.nan
+        result = {'counts': counts, 'variance': variance, 'rate': rate, 'stat_err': stat_err, 'exposure': exposure, 'duration': self._duration[last] - self._duration[first], 'n_bins': last - first}
+        if scalar:
+            result = {k: v[0] for k, v in result.items()}
+        return result
@@ -0,0 +1,145 @@
+import numpy as np
+from .spectrogram_utils import open_full_srm
+
+class ResponseMatrix:
+    """Spectral response matrix in compressed sparse row layout, with one row per photon energy bin and the non-zero entries of each row stored as (channel, value) pairs. Use it to fold model photon spectra through the STIX response outside of XSPEC.
+
+    Cropping to a subset of channels (*crop*) shares the stored entries with the original matrix instead of copying them.
+
+    The bundled STIX SRM has about 64% non-zero entries, at which point a dense matrix product beats any sparse kernel, so *fold* switches to a dense copy of the kept channels above DENSE_FOLD_DENSITY."""
+    #fraction of non-zero entries above which fold uses a dense matrix product
+    DENSE_FOLD_DENSITY = 0.05
+
+    def __init__(self, data, indices, indptr, n_channels, energ_lo, energ_hi, e_min, e_max, channels = None):
+        """
+        Args:
+            data (np.array): Non-zero matrix values, row by row.
+            indices (np.array): Channel index of each value in data.
+            indptr (np.array): Row start offsets into data, of length n_energies + 1.
+            n_channels (int): Number of channels of the full matrix.
+            energ_lo (np.array): Lower edges of the photon energy bins (keV).
+            energ_hi (np.array): Upper edges of the photon energy bins (keV).
+            e_min (np.array): Lower edges of all channels (keV).
+            e_max (np.array): Upper edges of all channels (keV).
+            channels (np.array, optional): Defaults to None, i.e. all channels. Indices of the channels kept, in output order."""
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.n_channels_full = n_channels
+        self.energ_lo = energ_lo
+        self.energ_hi = energ_hi
+        self._e_min = e_min
+        self._e_max = e_max
+        self.channels = np.arange(n_channels) if channels is None else np.asarray(channels)
+        self._fold_index = None
+        self._dense = None
+
+    @classmethod
+    def from_fits(cls, srm_file = "stx_srm_full.fits"):
+        """Read the response matrix from an OGIP SRM file, using the N_GRP, F_CHAN and N_CHAN columns to place the packed MATRIX values. Channel numbers start at the TLMIN of the F_CHAN column, or 1 if it is not set. Explicit zeros are not stored.
+
+        Args:
+            srm_file (str, optional): Defaults to "stx_srm_full.fits". Full path to the SRM file, or the name of a file in stix2xspec.data.
+
+        Returns:
+            ResponseMatrix: The response matrix."""
+        srm = open_full_srm(srm_file)
+        matrix = srm[1].data
+        ebounds = srm[2].data
+        n_channels = len(ebounds)
+        first_channel = srm[1].header.get(f"TLMIN{matrix.columns.names.index('F_CHAN') + 1}", 1) #OGIP default if TLMIN is not set
+
+        rows, cols, vals = [], [], []
+        for i, (n_grp, f_chan, n_chan, values) in enumerate(zip(matrix['N_GRP'], matrix['F_CHAN'], matrix['N_CHAN'], matrix['MATRIX'])):
+            f_chan = np.atleast_1d(f_chan)[:n_grp] - first_channel
+            n_chan = np.atleast_1d(n_chan)[:n_grp]
+            row_cols = np.concatenate([np.arange(f, f + n) for f, n in zip(f_chan, n_chan)]) if n_grp else np.zeros(0, dtype = int)
+            row_vals = np.atleast_1d(values)[:row_cols.size].astype(float)
+            nonzero = row_vals != 0
+            rows.append(np.full(nonzero.sum(), i))
+            cols.append(row_cols[nonzero])
+            vals.append(row_vals[nonzero])
+        rows = np.concatenate(rows)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength = len(matrix)))])
+        return cls(np.concatenate(vals), np.concatenate(cols).astype(np.int64), indptr, n_channels, np.array(matrix['ENERG_LO'], dtype = float), np.array(matrix['ENERG_HI'], dtype = float), np.array(ebounds['E_MIN'], dtype = float), np.array(ebounds['E_MAX'], dtype = float))
+
+    @property
+    def n_energies(self):
+        return self.indptr.size - 1
+
+    @property
+    def n_channels(self):
+        return self.channels.size
+
+    @property
+    def e_min(self):
+        return self._e_min[self.channels]
+
+    @property
+    def e_max(self):
+        return self._e_max[self.channels]
+
+    @property
+    def density(self):
+        """Fraction of non-zero entries in the kept channels."""
+        rows, _, _, _ = self._get_fold_index()
+        return rows.size/max(1, self.n_energies*self.n_channels)
+
+    def crop(self, channels):
+        """Restrict the matrix to a subset of channels. The stored entries are shared with this matrix, not copied.
+
+        Args:
+            channels (list): Indices (into the current channels) of the channels to keep, in output order.
+
+        Returns:
+            ResponseMatrix: The cropped matrix."""
+        return ResponseMatrix(self.data, self.indices, self.indptr, self.n_channels_full, self.energ_lo, self.energ_hi, self._e_min, self._e_max, channels = self.channels[np.asarray(channels)])
+
+    def _get_fold_index(self):
+        """Entries of the kept channels grouped by channel, for folding with one *np.add.reduceat*. Computed on first use."""
+        if self._fold_index is None:
+            out_col = np.full(self.n_channels_full, -1)
+            out_col[self.channels] = np.arange(self.n_channels)
+            entry_col = out_col[self.indices]
+            keep = np.where(entry_col >= 0)[0]
+            order = keep[np.argsort(entry_col[keep], kind = 'stable')]
+            sorted_col = entry_col[order]
+            starts = np.concatenate([[0], np.where(np.diff(sorted_col) != 0)[0] + 1])
+            rows = np.repeat(np.arange(self.n_energies), np.diff(self.indptr))
+            self._fold_index = (rows[order], self.data[order], starts, sorted_col[starts])
+        return self._fold_index
+
+    def fold(self, photon_flux, method = 'auto', block_size = 256):
+        """Fold photon spectra through the response.
+
+        Args:
+            photon_flux (np.array): Photon flux integrated over each photon energy bin, of shape (n_energies,) or (n_spectra, n_energies).
+            method (str, optional): Defaults to 'auto'. 'sparse' sums over the stored entries only, 'dense' uses a matrix product with a dense copy of the kept channels (made once and cached), and 'auto' picks 'dense' if *density* is above DENSE_FOLD_DENSITY.
+            block_size (int, optional): Defaults to 256. Number of spectra folded at a time by the sparse method, which bounds the size of the intermediate (spectra x entries) array.
+
+        Returns:
+            np.array: Counts per channel, of shape (n_channels,) or (n_spectra, n_channels)."""
+        flux = np.asarray(photon_flux, dtype = float)
+        single = flux.ndim == 1
+        flux = np.atleast_2d(flux)
+        if flux.shape[1] != self.n_energies:
+            raise ValueError(f"Expected photon spectra with {self.n_energies} energy bins, got {flux.shape[1]}")
+        if method not in ['auto', 'sparse', 'dense']:
+            raise ValueError("Parameter 'method' must be one of 'auto', 'sparse' or 'dense'")
+        if method == 'dense' or (method == 'auto' and self.density > self.DENSE_FOLD_DENSITY):
+            if self._dense is None:
+                self._dense = self.to_dense()
+            counts = flux @ self._dense
+        else:
+            rows, vals, starts, cols = self._get_fold_index()
+            counts = np.zeros((flux.shape[0], self.n_channels))
+            if rows.size:
+                for i in range(0, flux.shape[0], block_size):
+                    counts[i:i + block_size, cols] = np.add.reduceat(flux[i:i + block_size, rows]*vals, starts, axis = 1)
+        return counts[0] if single else counts
+
+    def to_dense(self):
+        """The matrix as a dense (n_energies, n_channels) array."""
+        dense = np.zeros((self.n_energies, self.n_channels_full))
+        dense[np.repeat(np.arange(self.n_energies), np.diff(self.indptr)), self.indices] = self.data
+        return dense[:,self.channels]
@@ -1,21 +1,16 @@
-import pandas as pd
 import numpy as np
 import os
 from datetime import datetime as dt
 from datetime import timedelta as td
-from importlib import resources
-from astropy.table import Table
 from astropy.io import fits
-from astropy.time import Time
 import warnings
-from .spectrogram_utils import *
-from .livetime import *
-from astropy.table import Table
-from .write_spectrum2fits import *
-from matplotlib import pyplot as plt
+from .spectrogram_utils import min_time_index, edge_products, match_energies, get_use_detectors, get_use_pixels, read_elut, open_spec_fits, get_header_corrections, get_hstart_time, shift_one_timestep, _MJD_EPOCH, date2elut_file, sum_over_pixels, chunk_size_for_budget, open_full_srm, cached_cropped_srm
+from .livetime import spectrogram_livetime, livetime_fractions, livetime_correct
+from .write_spectrum2fits import ogip_time_calcs, run_header_values, make_stix_header, set_rate_keywords, table_header, write_fits_buffered
+from .instrumentation import instrument_stage
 
 class Spectrogram:
-    def __init__(self, filename, background = False, use_discriminators = True, replace_doubles = False, keep_short_bins = True, shift_duration = None, time_bin_filename = None, det_ind = None, pix_ind = None):
+    def __init__(self, filename, background = False, use_discriminators = True, replace_doubles = False, keep_short_bins = True, shift_duration = None, time_bin_filename = None, det_ind = None, pix_ind = None, streaming = False):
         """Read in a STIX spectrogram or pixel data from a FITS file. .
         
         Args:
@@ -27,7 +22,8 @@ class Spectrogram:
             shift_duration (int, optional): Defaults to 0. Shift all time bins by 1 to account for FSW time input discrepancy prior to 09-Dec-2021. N.B. WILL ONLY WORK WITH FULL TIME RESOLUTION DATA WHICH IS OFTEN NOT THE CASE FOR PIXEL DATA.
             time_bin_filename (str, optional): Full path to time bin file. Not yet implemented.
             det_ind (list, optional): Defaults to None. Otherwise, list of detectors used.
-            pix_ind (list, optional): Defaults to None. Otherwise, list of pixels used."""
+            pix_ind (list, optional): Defaults to None. Otherwise, list of pixels used.
+            streaming (bool, optional): Defaults to False. For L1A pixel data (not background), keep the counts memory-mapped and defer the counts error calculation to *process_in_chunks*, so that the full counts cube is never held in memory. Cannot be combined with keep_short_bins = False."""
         self.filename = filename
         if 'spectrogram' in filename: #this isn't a sure thing but if it's from the SDC it will be in the filename
             self._alpha = 0
@@ -36,6 +32,7 @@ class Spectrogram:
         self.det_ind = det_ind
         self.pix_ind = pix_ind
         self.history = "init"
+        self._streaming = streaming
         self._from_fits(use_discriminators = use_discriminators, replace_doubles = replace_doubles, keep_short_bins = keep_short_bins, shift_duration = shift_duration, time_bin_filename = time_bin_filename)
         
     #attributes that are important to be read-only
@@ -63,9 +60,7 @@ class Spectrogram:
         # List when we have 1 second time bins, short or normal bins
         mask_long_bins = np.ones(self.n_time-1)
         
-        min_time_table = pd.read_csv(f"{os.environ['STX_CONF']}/detector/min_time_index.csv")
-
-        min_time = min_time_table.where(hstart_str < min_time_table.where(hstart_str > min_time_table[' start_date'])[' end_date']).dropna(how='all')['Mininmum time [cs]'].values[0]/10.
+        min_time = min_time_index().lookup(hstart_str)/10.
 
         if idx_short.size > 0:
             idx_double = np.where(self.duration[idx_short] == min_time)[0]
@@ -98,7 +93,7 @@ class Spectrogram:
         energy_edges_all2 = np.transpose([[energy.data.e_low], [energy.data.e_high]])
         _, _, _, energy_edges_all1, _ = edge_products(energy_edges_2.squeeze())
        
-        use_energies = np.where(energy_edges_all1 == energy_edges_1)[0]
+        use_energies = np.where(match_energies(energy_edges_all1, energy_edges_1)[1])[0]
 
         energy_edges_used = (energy_edges_all1 + energy_shift)[use_energies]
         out_mean, out_gmean, width, edges_1, edges_2 = edge_products(energy_edges_used)
@@ -135,6 +130,7 @@ class Spectrogram:
         eff_ewidth =  true_ewidth/ewidth
         self.eff_ewidth = eff_ewidth
         
+    @instrument_stage('read')
     def _from_fits(self, use_discriminators = True, replace_doubles = False, keep_short_bins = True, shift_duration = None, time_bin_filename = None):
         """Read spectrogram FITS file. Same function as *stx_read_spectrogram_fits_file.pro* and *stx_read_pixel_data_fits_file.pro*
         
@@ -151,9 +147,8 @@ class Spectrogram:
         energy_shift_low_dt = dt.strptime('2020-11-15T00:00:00',"%Y-%m-%dT%H:%M:%S")
         energy_shift_high_dt = dt.strptime('2021-12-04T00:00:00',"%Y-%m-%dT%H:%M:%S")
 
-        distance, time_shift = get_header_corrections(self.filename)
         primary_header, control, data, energy = open_spec_fits(self.filename)
-        counts_err = np.sqrt(data.data.counts_err**2 + data.data.counts)
+        distance, time_shift = get_header_corrections(primary_header)
         triggers_err = np.sqrt(data.data.triggers_err**2 + data.data.triggers)
         
         self.n_time = data.data['time'].size
@@ -167,6 +162,14 @@ class Spectrogram:
         if not hasattr(self, 'data_level'): #is there a nicer way to do this
             self._data_level = [int(c) for c in primary_header['LEVEL'].strip() if c in ['1','4']][0]
             
+        self._streaming = self._streaming and self.alpha and not self.background
+        if self._streaming and not keep_short_bins:
+            raise ValueError("Short time bins cannot be removed from streamed pixel data (streaming = True, e.g. a chunked conversion). Use keep_short_bins = True, or convert without chunking.")
+        if self._streaming: #combined chunk by chunk in process_in_chunks
+            counts_err = None
+        else:
+            counts_err = np.sqrt(data.data.counts_err**2 + data.data.counts)
+            
         #trigger_zero should always be 0 as far as I know... it gets modified by mreadfits 2.26
     #    try:
     #        trigger_zero = data.header['TZERO3']
@@ -202,7 +205,11 @@ class Spectrogram:
         axis = -1 if self.alpha else 0 #time axis is last for pixel data but first for spectrogram data
         
         self.counts = shift_one_timestep(data.data.counts, shift_step = shift_step, axis = axis)
-        self.counts_err = shift_one_timestep(counts_err, shift_step = shift_step, axis = axis)
+        if self._streaming:
+            self.counts_err = None
+            self._counts_err_raw = shift_one_timestep(data.data.counts_err, shift_step = shift_step, axis = axis)
+        else:
+            self.counts_err = shift_one_timestep(counts_err, shift_step = shift_step, axis = axis)
         self.triggers = shift_one_timestep(data.data.triggers, shift_step = shift_step, axis = axis)
         self.triggers_err = shift_one_timestep(triggers_err, shift_step = shift_step, axis = axis)
         self.duration = shift_one_timestep(data.data.timedel, shift_step = -1*shift_step)
@@ -256,18 +263,16 @@ class Spectrogram:
             factor = 100
 
         start_time = hstart_time + td(seconds = time_shift)
-        t_start = [start_time + td(seconds = bc/factor - d/(2.*factor)) for bc,d in zip(self.time_bin_center, self.duration)]
-        t_end = [start_time + td(seconds = bc/factor + d/(2.*factor)) for bc,d in zip(self.time_bin_center, self.duration)]
-        t_mean = [start_time + td(seconds = bc/factor) for bc in self.time_bin_center]
-        t_axis = stx_time_axis(time_mean = t_mean, time_start = t_start, time_end = t_end, duration = self.duration/factor)
+        t_axis = stx_time_axis.from_bin_centers(start_time, self.time_bin_center/factor, self.duration/factor)
 
         if (control.data.energy_bin_mask[0][0] or control.data.energy_bin_mask[0][-1]) and use_discriminators:
             control.data.energy_bin_mask[0][0] = 0
             control.data.energy_bin_mask[0][-1] = 0
-            self.counts[...,0] = 0. #originally [0,:]
-            self.counts[...,-1] = 0.
-            self.counts_err[...,0] = 0.
-            self.counts_err[...,-1] = 0.
+            if not self._streaming: #the masked channels are never selected in process_in_chunks, and writing to the memory-mapped counts would copy them
+                self.counts[...,0] = 0. #originally [0,:]
+                self.counts[...,-1] = 0.
+                self.counts_err[...,0] = 0.
+                self.counts_err[...,-1] = 0.
             
         energies_used = np.where(control.data.energy_bin_mask == 1)[1]
         use_energies, out_mean, out_gmean, width, edges_1, edges_2 = self._get_energy_edges(energy, energies_used, self.energy_shift)
@@ -293,26 +298,18 @@ class Spectrogram:
         self.hstart_str = hstart_str
         self.request_id = control.data.request_id[0]
         
-    def apply_elut(self, elut_filename = None, n_energies = None):
-        """Apply the ELUT to the spectrogram.
+    def _elut_setup(self, elut_filename = None, n_energies = None):
+        """Find the ELUT and the energy bins, pixels and detectors used. Shared by *apply_elut* and *process_in_chunks*.
         
-        Everything that happens after calls to *stx_read_..._fits_file* and before *stix_convert_science_data2ospex* in *stx_convert_...pro*.
-        
-        Args:
-            elut_filename (str, optional): Defaults to None. Name of the ELUT to use.
-            n_energies (int, optional): Defaults to None. Needs to be set to equal the number of energies in the data spectrogram in the case that the current spectrogram is the background to be subtracted from that one."""
-            
+        Returns:
+            tuple: energy bins, pixels used, detectors used"""
         # Find corresponding ELUT
         if not elut_filename:
             self.elut_filename = f"{os.environ['STX_CONF']}/elut/{date2elut_file(self.hstart_str)}"
         else:
             self.elut_filename = elut_filename
             
-        counts_in = self.counts
-        #self.counts_in = counts_in
-        counts_err_in = self.counts_err
-        #self.counts_err_in = counts_err_in
-        dim_counts = counts_in.shape
+        dim_counts = self.counts.shape
         self.n_times = 1
 
         if len(dim_counts) > 1:
@@ -334,25 +331,51 @@ class Spectrogram:
         detector_mask_used = np.zeros(32)
         detector_mask_used[detectors_used] = 1
         self.n_detectors = int(sum(detector_mask_used))
+        self._pixel_mask_used = pixel_mask_used
+        self._detector_mask_used = detector_mask_used
+        return energy_bins, pixels_used, detectors_used
+        
+    def _pixel_sums(self, pixels_used, detectors_used, energy_bins = None, eff_ewidth = None, time_slice = slice(None)):
+        """Sum L1A counts and errors (in quadrature) over the pixels used for a slice of the time axis, see *sum_over_pixels*.
+        
+        Returns:
+            tuple: counts and counts error, each of shape (time, detector used, energy)"""
+        counts = self.counts[time_slice]
+        counts_spec = sum_over_pixels(counts, pixels_used, detectors_used, energy_bins = energy_bins, eff_ewidth = eff_ewidth)
+        if self._streaming: #counts_err**2 = counts_err_raw**2 + counts
+            counts_err2 = sum_over_pixels(self._counts_err_raw[time_slice], pixels_used, detectors_used, energy_bins = energy_bins, eff_ewidth = eff_ewidth, squared = True)
+            counts_err2 += sum_over_pixels(counts, pixels_used, detectors_used, energy_bins = energy_bins, eff_ewidth = None if eff_ewidth is None else eff_ewidth**2)
+        else:
+            counts_err2 = sum_over_pixels(self.counts_err[time_slice], pixels_used, detectors_used, energy_bins = energy_bins, eff_ewidth = eff_ewidth, squared = True)
+        return counts_spec, np.sqrt(counts_err2)
+        
+    @instrument_stage('apply_elut')
+    def apply_elut(self, elut_filename = None, n_energies = None):
+        """Apply the ELUT to the spectrogram.
+        
+        Everything that happens after calls to *stx_read_..._fits_file* and before *stix_convert_science_data2ospex* in *stx_convert_...pro*.
+        
+        Args:
+            elut_filename (str, optional): Defaults to None. Name of the ELUT to use.
+            n_energies (int, optional): Defaults to None. Needs to be set to equal the number of energies in the data spectrogram in the case that the current spectrogram is the background to be subtracted from that one."""
+        energy_bins, pixels_used, detectors_used = self._elut_setup(elut_filename = elut_filename, n_energies = n_energies)
 
         if not self.background:
             self._get_eff_ewidth(pixels_used, detectors_used)
         
-            if not self.alpha: #L4
-                spec_in = counts_in.T.copy()
-                counts_spec =  np.transpose(spec_in[energy_bins,:] / np.repeat(self.eff_ewidth, self.n_times).reshape((self.n_energies, self.n_times)))#transpose back to make life easier
-                error_in = counts_err_in.T.copy()
-                counts_err = np.transpose(error_in[energy_bins,:]/ np.repeat(self.eff_ewidth, self.n_times).reshape((self.n_energies, self.n_times)))
-            else: #L1
-                counts_spec = counts_in[...,energy_bins]/np.reshape(np.tile(self.eff_ewidth, self.n_times*32*12),(self.n_times,32,12,self.n_energies))
-                counts_err = counts_err_in[...,energy_bins]/np.reshape(np.tile(self.eff_ewidth, self.n_times*32*12),(self.n_times,32,12,self.n_energies))
+        if self.alpha: #L1 and background, sum over pixels (and divide by the effective energy width for L1)
+            if not self.background:
+                counts_spec, counts_err = self._pixel_sums(pixels_used, detectors_used, energy_bins = energy_bins, eff_ewidth = self.eff_ewidth)
+            else:
+                counts_spec, counts_err = self._pixel_sums(pixels_used, detectors_used)
+        elif not self.background: #L4
+            spec_in = self.counts.T.copy()
+            counts_spec =  np.transpose(spec_in[energy_bins,:] / np.repeat(self.eff_ewidth, self.n_times).reshape((self.n_energies, self.n_times)))#transpose back to make life easier
+            error_in = self.counts_err.T.copy()
+            counts_err = np.transpose(error_in[energy_bins,:]/ np.repeat(self.eff_ewidth, self.n_times).reshape((self.n_energies, self.n_times)))
         else:
-            counts_spec = counts_in
-            counts_err = counts_err_in
-                            
-        if self.alpha: #L1 and background, sum over pixels
-            counts_spec = np.sum(counts_spec[:,detectors_used][:,:,pixels_used], axis = 2)
-            counts_err = np.sqrt(np.sum(counts_err[:,detectors_used][:,:,pixels_used]**2, axis = 2))
+            counts_spec = self.counts
+            counts_err = self.counts_err
 
         #insert the information from the telemetry file into the expected stx_fsw_sd_spectrogram structure
         self.type = "stx_spectrogram"
@@ -372,12 +395,13 @@ class Spectrogram:
             self.triggers = np.expand_dims(self.triggers,-1)
             self.triggers_err = np.expand_dims(self.triggers_err,-1)
          
-        self.pixel_mask = pixel_mask_used
-        self.detector_mask = detector_mask_used
+        self.pixel_mask = self._pixel_mask_used
+        self.detector_mask = self._detector_mask_used
         self.rcr = self.data['rcr']
         self.error = counts_err
         self.history += f"+applied_{self.elut_filename}"
         
+    @instrument_stage('correct_counts')
     def correct_counts(self):
         """Perform livetime correction of counts."""
         if self.alpha:
@@ -404,6 +428,57 @@ class Spectrogram:
         self.livetime_fraction = livetime_frac
         self.history += "+livetime_correction"
         
+    @instrument_stage('process_in_chunks')
+    def process_in_chunks(self, elut_filename = None, chunk_size = None, memory_budget = None):
+        """Apply the ELUT and the livetime correction to L1A pixel data chunk by chunk along the time axis, summing over pixels and detectors as they go. Equivalent to *apply_elut* followed by *correct_counts*, but only the reduced (time, energy) products are kept, so that peak memory is bounded by the chunk size rather than by the length of the observation. Works best with a Spectrogram opened with streaming = True.
+        
+        Args:
+            elut_filename (str, optional): Defaults to None. Name of the ELUT to use.
+            chunk_size (int, optional): Defaults to None. Number of time bins per chunk. If not set, it is derived from memory_budget.
+            memory_budget (int, optional): Defaults to None, in which case 256 MB are used. Memory in bytes that the working arrays of one chunk may use."""
+        if not self.alpha or self.background:
+            raise ValueError("Chunked processing is only available for L1A pixel data that is not a background")
+        energy_bins, pixels_used, detectors_used = self._elut_setup(elut_filename = elut_filename)
+        self._get_eff_ewidth(pixels_used, detectors_used)
+        if not chunk_size:
+            chunk_size = chunk_size_for_budget(memory_budget or 256 * 2**20, self.counts[:1].nbytes)
+
+        n_times, n_energies, n_det = self.n_times, self.n_energies, detectors_used.size
+        counts = np.zeros((n_times, n_energies))
+        error = np.zeros((n_times, n_energies))
+        counts_before_livetime = np.zeros((n_times, n_energies))
+        livetime_frac = np.zeros((n_det, n_times))
+        duration = np.ravel(self.t_axis.duration)
+        clip_low = np.all(self.triggers_err > 0)
+        
+        for t0 in range(0, n_times, chunk_size):
+            sl = slice(t0, t0 + chunk_size)
+            counts_spec, counts_err = self._pixel_sums(pixels_used, detectors_used, energy_bins = energy_bins, eff_ewidth = self.eff_ewidth, time_slice = sl) # time x detector x energy
+            
+            lt = livetime_fractions(self.triggers[sl].T, self.triggers_err[sl].T, duration[sl], detectors_used, level = 1, clip_low = clip_low) # 3 x detector x time
+            corrected_counts, corrected_error = livetime_correct(counts_spec, counts_err, np.moveaxis(lt, 2, 1)[...,np.newaxis])
+            
+            counts[sl] = np.sum(corrected_counts, axis = 1) #sum over detectors
+            error[sl] = np.sqrt(np.sum(corrected_error**2, axis = 1))
+            counts_before_livetime[sl] = np.sum(counts_spec, axis = 1)
+            livetime_frac[:,sl] = lt[1]
+            
+        #same attributes as after apply_elut and correct_counts, but summed over detectors
+        self.type = "stx_spectrogram"
+        self.triggers = self.triggers.squeeze().T
+        self.triggers_err = self.triggers_err.squeeze().T
+        if self.triggers.ndim == 1:
+            self.triggers = np.expand_dims(self.triggers,-1)
+            self.triggers_err = np.expand_dims(self.triggers_err,-1)
+        self.pixel_mask = self._pixel_mask_used
+        self.detector_mask = self._detector_mask_used
+        self.rcr = self.data['rcr']
+        self.counts = counts
+        self.error = error
+        self.counts_before_livetime = counts_before_livetime.T[np.newaxis] # 1 x energy x time, detector axis summed
+        self.livetime_fraction = np.broadcast_to(livetime_frac, (n_energies, n_det, n_times))
+        self.history += f"+applied_{self.elut_filename}+livetime_correction"
+        
     def to_rate(self):
         """Convert counts to count rate"""
         self._counts_to_rate()
@@ -462,8 +537,7 @@ class Spectrogram:
         
     def _select_energy_channels(self, elow):
         """Trim converted data to match the channels in an existing srm file, since unable to generate srm files via Python at the moment """
-        ll=list(self.e_axis.low)
-        chan_idx = [ll.index(e) for e in ll if e in elow]
+        chan_idx = np.where(match_energies(self.e_axis.low, elow)[1])[0]
         #fix energy axis
         self.e_axis.num_energy = len(chan_idx)
         for a in ['energy_mean','gmean','low','high','edges_1','edges_2']: #,'low_fsw_idx','high_fsw_idx' #leave out for now, have to think about how to handle this
@@ -473,25 +547,28 @@ class Spectrogram:
         #fix rate array etc
         self.n_energies = len(chan_idx)
         self.counts = self.counts[:,chan_idx]
-        self.error = self.error[chan_idx,:]
-        
-    def _write_srm_from_file(self, srm_file = "stx_srm_full.fits"):
-        """For now, write SRM by selecting matching energy channels from pre-generated .srm file and writing to a new file if necessary."""
-        with resources.path('stix2xspec.data',srm_file) as srmfile:
-            srm = fits.open(str(srmfile)) # Need to match the number of channels in here!
+        self.error = self.error[:,chan_idx]
+        if hasattr(self, 'total_error'): #used instead of error after background subtraction
+            self.total_error = self.total_error[:,chan_idx]
+        
+    @instrument_stage('write_srm')
+    def _write_srm_from_file(self, srm_file = "stx_srm_full.fits", srm_dir = None):
+        """For now, write SRM by selecting matching energy channels from pre-generated .srm file and writing to a new file if necessary. Cropped files are cached by channel selection, see *cached_cropped_srm*."""
+        srm = open_full_srm(srm_file) # Need to match the number of channels in here!
         self._select_energy_channels(srm[2].data.E_MIN + self.energy_shift) #have to add energy shift if necessary!
         srm_nenergies = srm[1].data.N_CHAN[0]
         if srm_nenergies != self.n_energies or self.energy_shift:
-            srm_edges = np.array([[mn,mx] for mn,mx in zip(srm[2].data.E_MIN + self.energy_shift, srm[2].data.E_MAX + self.energy_shift)])
-            spec_edges = np.float32(self.e_axis.edges_2)
-            srm_channels = [np.where(srm_edges == e1)[0][0] for e1 in spec_edges if e1 in srm_edges]
-            respfile = write_cropped_srm(srm,srm_channels, request_id = self.request_id)
+            spec_edges = self.e_axis.edges_2
+            low_idx, low_matched = match_energies(spec_edges[:,0], srm[2].data.E_MIN + self.energy_shift)
+            high_idx, high_matched = match_energies(spec_edges[:,1], srm[2].data.E_MAX + self.energy_shift)
+            srm_channels = np.where(low_matched, low_idx, high_idx)[low_matched | high_matched].tolist()
+            respfile = cached_cropped_srm(srm, srm_channels, srm_dir = srm_dir)
         else:
             respfile = srm_file[srm_file.rfind('/')+1:]
-        srm.close()
         print(f"Response file: {respfile}")
         self.respfile = respfile
     
+    @instrument_stage('spectrum_to_fits')
     def spectrum_to_fits(self, fitsfilename, srm_file = "stx_srm_full.fits", write_srm = True):
         """Write the spectrogram to an OGIP-compatible FITS file. It can either be background-subtracted or not. Currently cannot be used to write background files.
         
@@ -502,7 +579,7 @@ class Spectrogram:
         """
         
         if write_srm:
-            self._write_srm_from_file()
+            self._write_srm_from_file(srm_file = srm_file, srm_dir = os.path.dirname(fitsfilename) or None)
             
         try:
             timedict = ogip_time_calcs(self)
@@ -512,25 +589,33 @@ class Spectrogram:
 
         self.exposure = timedict['exposure']
         # Make the primary header
-        primary_header = make_stix_header(self,primary = True)
+        run_values = run_header_values() #same DATE and OBSERVER in all headers
+        primary_header = make_stix_header(self,primary = True, run_values = run_values)
 
-        # Make the rate table
-        rate_names = ['RATE', 'STAT_ERR', 'CHANNEL', 'LIVETIME', 'SPEC_NUM', 'TIME', 'TIMEDEL','SYS_ERR']
-        
+        # Make the rate table, filled in place in the on-disk (big-endian) layout
         if not "counts_to_rate" in self.history:
             self._counts_to_rate()
-        sys_err = self._energy_dependent_sys_err()
-        rate_table = Table([self.rate, self.stat_err, timedict['channel'].astype('>i4'), self.eff_livetime_fraction, timedict['specnum'].astype('>i2'), Time(timedict['timecen']).mjd, timedict['timedel'].astype('>f4'),sys_err], names = rate_names)
+        n_energies = self.rate.shape[1]
+        rate_data = np.empty(self.rate.shape[0], dtype = [('RATE', '>f8', (n_energies,)), ('STAT_ERR', '>f8', (n_energies,)), ('CHANNEL', '>i4', (n_energies,)), ('LIVETIME', '>f8'), ('SPEC_NUM', '>i2'), ('TIME', '>f8'), ('TIMEDEL', '>f4'), ('SYS_ERR', '>f8', (n_energies,))])
+        rate_data['RATE'] = self.rate
+        rate_data['STAT_ERR'] = self.stat_err
+        rate_data['CHANNEL'] = timedict['channel'][0]
+        rate_data['LIVETIME'] = self.eff_livetime_fraction
+        rate_data['SPEC_NUM'] = timedict['specnum']
+        rate_data['TIME'] = timedict['timecen']
+        rate_data['TIMEDEL'] = timedict['timedel']
+        rate_data['SYS_ERR'] = self._energy_dependent_sys_err()
 
         # Make the energy channel table
-        # Update keywords that need updating
         ct_edges_2 = self.e_axis.edges_2
-        energy_names = ('CHANNEL', 'E_MIN', 'E_MAX')
-        energy_table = Table([timedict['channel'][0].astype('>i4'), ct_edges_2[:,0].astype('>f4'), ct_edges_2[:,1].astype('>f4')], names = energy_names)
+        energy_data = np.empty(n_energies, dtype = [('CHANNEL', '>i4'), ('E_MIN', '>f4'), ('E_MAX', '>f4')])
+        energy_data['CHANNEL'] = timedict['channel'][0]
+        energy_data['E_MIN'] = ct_edges_2[:,0]
+        energy_data['E_MAX'] = ct_edges_2[:,1]
 
         # Make the attenuator state table
         # Get the rcr states and the times of rcr changes from the ql_lightcurves structure
-        ut_rcr = np.array(self.t_axis.time_start) #ok to write datetimes to FITS
+        ut_rcr = self.t_axis.time_start_mjd
         ## IDL          #find_changes, rcr, index, state, count=count
         change_idx = np.where(self.rcr[:-1] != self.rcr[1:])[0] # An array of indices into inarray where the value of the array changes
         change_state = self.rcr[change_idx] #and an array of the value of inarray at each change.
@@ -538,39 +623,93 @@ class Spectrogram:
         change_state = np.insert(change_state,0,self.rcr[0])
         ##   ;add the rcr information to a specpar structure so it can be incuded in the spectrum FITS file
         ##   specpar = { sp_atten_state :  {time:ut_rcr[index], state:state} }
-        att_names = ('SP_ATTEN_STATE$$TIME', 'SP_ATTEN_STATE$$STATE')
-        att_table = Table([Time(ut_rcr[change_idx]).mjd, change_state.astype('u1')], names = att_names)
-
-        primary_HDU = fits.PrimaryHDU(header = primary_header)
-        rate_HDU = fits.BinTableHDU(data = rate_table)
-        energy_HDU = fits.BinTableHDU(data = energy_table)
-        att_HDU = fits.BinTableHDU(data = att_table)
-        # fill out headers
-        make_rate_header(rate_HDU.header, self, respfile = self.respfile) #should update in place
-        make_stix_header(self,hdr = energy_HDU.header, extname='ENEBAND', respfile = self.respfile)
-        make_stix_header(self, hdr = att_HDU.header, extname='STIX Spectral Object Parameters', respfile = self.respfile)
-        hdul = fits.HDUList([primary_HDU, rate_HDU, energy_HDU, att_HDU])
-        hdul.writeto(fitsfilename)
-        print(f"Spectrogram written to {os.getcwd()}/{fitsfilename}")
+        att_data = np.empty(change_idx.size, dtype = [('SP_ATTEN_STATE$$TIME', '>f8'), ('SP_ATTEN_STATE$$STATE', 'u1')])
+        att_data['SP_ATTEN_STATE$$TIME'] = ut_rcr[change_idx]
+        att_data['SP_ATTEN_STATE$$STATE'] = change_state
+
+        # fill out headers from one template of the keywords shared by all extensions
+        template = make_stix_header(self, hdr = fits.Header(), respfile = self.respfile, run_values = run_values)
+        rate_header = set_rate_keywords(table_header(rate_data, template, extname = 'RATE'), self)
+        energy_header = table_header(energy_data, template, extname = 'ENEBAND')
+        att_header = table_header(att_data, template, extname = 'STIX Spectral Object Parameters')
+        write_fits_buffered(fitsfilename, primary_header, [(rate_header, rate_data), (energy_header, energy_data), (att_header, att_data)])
+        print(f"Spectrogram written to {os.path.abspath(fitsfilename)}")
     
 class stx_time_axis:
-    """Time axis class for spectrogram. Compare to *stx_time_axis.pro*."""
+    """Time axis class for spectrogram. Compare to *stx_time_axis.pro*.
+    
+    Times are stored as datetime64[ns] arrays (*time_mean_dt64*, *time_start_dt64*, *time_end_dt64*) together with the corresponding float MJD arrays (*time_mean_mjd*, ...). *time_mean*, *time_start* and *time_end* give lists of datetime objects for compatibility; these are only built when first accessed."""
     def __init__(self, time_mean = None, time_start = None, time_end = None, duration = None):
-        for k,v in locals().items():
-            if k != 'self':
-                setattr(self,k,v)
+        """Args:
+            time_mean (list or np.array, optional): Times of the bin centers, as datetimes or datetime64.
+            time_start (list or np.array, optional): Times of the bin starts.
+            time_end (list or np.array, optional): Times of the bin ends.
+            duration (np.array, optional): Durations of the bins in seconds."""
+        self.time_mean = time_mean
+        self.time_start = time_start
+        self.time_end = time_end
+        self.duration = duration
         self.type = 'stx_time_axis'
+        
+    @classmethod
+    def from_bin_centers(cls, start_time, time_bin_center, duration):
+        """Make the time axis from bin centers and durations relative to a start time, without creating a Python object per bin.
+        
+        Args:
+            start_time (datetime or np.datetime64): Reference time.
+            time_bin_center (np.array): Bin centers in seconds after start_time.
+            duration (np.array): Bin durations in seconds.
+            
+        Returns:
+            stx_time_axis: The time axis."""
+        start = np.datetime64(start_time, 'ns')
+        center = np.asarray(time_bin_center, dtype = float)
+        half = np.asarray(duration, dtype = float)/2.
+        def offset(seconds):
+            return np.round(seconds*1e9).astype('timedelta64[ns]')
+        return cls(time_mean = start + offset(center), time_start = start + offset(center - half), time_end = start + offset(center + half), duration = duration)
+        
+    @staticmethod
+    def _to_datetime64(times):
+        if times is None:
+            return None
+        return np.atleast_1d(np.asarray(times, dtype = 'datetime64[ns]'))
+        
+    @classmethod
+    def _split_mjd(cls, times):
+        """Integer MJD and fraction of day, computed separately so that the fraction keeps full precision."""
+        days = times.astype('datetime64[D]')
+        return (days - _MJD_EPOCH).astype(int), (times - days)/np.timedelta64(1, 'D')
+        
+    def _set_times(self, name, times):
+        times = self._to_datetime64(times)
+        setattr(self, f"{name}_dt64", times)
+        if times is None:
+            setattr(self, f"{name}_mjd", None)
+        else:
+            mjd_int, mjd_frac = self._split_mjd(times)
+            setattr(self, f"{name}_mjd", mjd_int + mjd_frac)
+        self.__dict__.pop(f"_{name}_list", None)
+        
+    def _get_list(self, name):
+        if f"_{name}_list" not in self.__dict__:
+            times = getattr(self, f"{name}_dt64")
+            self.__dict__[f"_{name}_list"] = None if times is None else times.astype('datetime64[us]').tolist()
+        return self.__dict__[f"_{name}_list"]
+        
+    time_mean = property(lambda self: self._get_list('time_mean'), lambda self, times: self._set_times('time_mean', times), doc = "Bin centers as a list of datetimes.")
+    time_start = property(lambda self: self._get_list('time_start'), lambda self, times: self._set_times('time_start', times), doc = "Bin starts as a list of datetimes.")
+    time_end = property(lambda self: self._get_list('time_end'), lambda self, times: self._set_times('time_end', times), doc = "Bin ends as a list of datetimes.")
+    
+    def __len__(self):
+        return self.time_mean_dt64.size
     
     def RHESSI_format_times(self):
         """Calculate certain MJD time values for FITS header."""
-        tstart = Time(self.time_start[0]).mjd
-        tstop = Time(self.time_end[-1]).mjd
-        timezeri = int(tstart)
-        tstartf = tstart - timezeri #fraction of day #int(np.rint((tstart - timezeri)*8.64e7)) #ms since start of day
+        timezeri, tstartf = self._split_mjd(self.time_start_dt64[:1]) #fraction of day #int(np.rint((tstart - timezeri)*8.64e7)) #ms since start of day
         #timezerf = 0.0
-        tstopi = int(tstop)
-        tstopf = tstop - tstopi
-        return timezeri, tstartf, tstopi, tstopf
+        tstopi, tstopf = self._split_mjd(self.time_end_dt64[-1:])
+        return int(timezeri[0]), float(tstartf[0]), int(tstopi[0]), float(tstopf[0])
         
 class stx_energy_axis:
     """Energy axis class for spectrogram. Compare to *stx_energy_axis.pro*."""
@@ -1,46 +1,206 @@
 import numpy as np
-import pandas as pd
 import os
 import glob
+import hashlib
+import tempfile
 from astropy.io import fits
-from astropy.time import Time
-from astropy.table import Table
-from astropy import constants
-import warnings
+from collections import namedtuple
+from functools import lru_cache
+from importlib import resources
 from datetime import datetime as dt
-from datetime import timedelta as td
 
+_AU = 149597870700. #astronomical unit in m (IAU 2012, exact), as astropy.constants.au
+_MJD_EPOCH = np.datetime64('1858-11-17', 'D') #MJD 0
+
+
+class ConfDateIndex:
+    """Interval index over one of the STIX-CONF date tables (*elut/elut_index.csv*, *detector/min_time_index.csv*), which assign a value to each validity period [start_date, end_date]. The table is parsed once, the intervals are sorted by start date, and lookups are binary searches, for a single date or a whole array of dates at once."""
+    def __init__(self, start_date, end_date, values, closed = 'right'):
+        """
+        Args:
+            start_date (array-like): Start dates of the validity periods.
+            end_date (array-like): End dates of the validity periods. Open-ended periods should use a date far in the future.
+            values (array-like): Value that applies during each period.
+            closed (str, optional): Defaults to 'right'. Which end of the interval includes its end point, 'right' for start < date <= end or 'neither' for start < date < end."""
+        if closed not in ['right', 'neither']:
+            raise ValueError("Parameter 'closed' must be 'right' or 'neither'")
+        start_date = self._to_datetime64(start_date)
+        order = np.argsort(start_date, kind = 'stable')
+        self.start_date = start_date[order]
+        self.end_date = self._to_datetime64(end_date)[order]
+        self.values = np.asarray(values)[order]
+        self.closed = closed
+        self.type = 'stx_conf_date_index'
+        
+    @staticmethod
+    def _to_datetime64(dates):
+        """Convert a date or array of dates (str, datetime, np.datetime64) to a 1-D datetime64[ms] array."""
+        return np.atleast_1d(np.array(dates, dtype = 'datetime64[ms]'))
+        
+    @classmethod
+    def from_csv(cls, filename, value_column, closed = 'right'):
+        """Read a STIX-CONF date table. Column names and entries are stripped of the padding whitespace used in these files, and an end date of 'none' means the period is still valid.
+        
+        Args:
+            filename (str): Full path to the csv file.
+            value_column (str): Name of the column holding the values to look up.
+            closed (str, optional): Defaults to 'right'. See *ConfDateIndex*.
+            
+        Returns:
+            ConfDateIndex: The index over the table."""
+        import pandas as pd #the csv readers are only needed on a cache miss, so pandas is imported here rather than with the module
+        table = pd.read_csv(filename, skipinitialspace = True, dtype = str)
+        table.columns = table.columns.str.strip()
+        table = table.apply(lambda col: col.str.strip())
+        end_date = table['end_date'].replace('none', '9999-12-31T23:59:59')
+        try:
+            values = pd.to_numeric(table[value_column]).to_numpy()
+        except ValueError: #filenames etc.
+            values = np.array(table[value_column].tolist(), dtype = str)
+        return cls(table['start_date'].values, end_date.values, values, closed = closed)
+        
+    def lookup(self, dates):
+        """Find the value that applies to each date.
+        
+        Args:
+            dates (str, datetime.datetime, np.datetime64 or array-like): Date(s) to look up.
+            
+        Returns:
+            Value for a single date, or np.array of values for an array of dates."""
+        scalar = np.ndim(dates) == 0
+        dates = self._to_datetime64(dates)
+        idx = np.searchsorted(self.start_date, dates, side = 'left') - 1 # last period starting strictly before each date
+        found = idx >= 0
+        idx[~found] = 0
+        if self.closed == 'right':
+            found &= dates <= self.end_date[idx]
+        else:
+            found &= dates < self.end_date[idx]
+        if not found.all():
+            raise IndexError(f"No entry valid for date(s) {dates[~found]}")
+        values = self.values[idx]
+        return values[0].item() if scalar else values
+        
+@lru_cache(maxsize = 8)
+def _load_conf_date_index(filename, mtime, value_column, closed):
+    """Cached ConfDateIndex.from_csv. The modification time is part of the cache key so that a table that changes on disk is read again."""
+    return ConfDateIndex.from_csv(filename, value_column, closed = closed)
+    
+def elut_index(stx_conf = None):
+    """The ELUT date index from STIX-CONF, parsed once per process.
+    
+    Args:
+        stx_conf (str, optional): Path to STIX-CONF. Defaults to None, in which case the environment variable STX_CONF is used.
+        
+    Returns:
+        ConfDateIndex: Index mapping observation dates to ELUT filenames."""
+    if not stx_conf:
+        stx_conf = os.environ['STX_CONF']
+    filename = f"{stx_conf}/elut/elut_index.csv"
+    return _load_conf_date_index(filename, os.path.getmtime(filename), 'elut_file', 'right')
+    
+def min_time_index(stx_conf = None):
+    """The minimum time bin duration index from STIX-CONF, parsed once per process.
+    
+    Args:
+        stx_conf (str, optional): Path to STIX-CONF. Defaults to None, in which case the environment variable STX_CONF is used.
+        
+    Returns:
+        ConfDateIndex: Index mapping observation dates to the minimum time bin duration in centiseconds."""
+    if not stx_conf:
+        stx_conf = os.environ['STX_CONF']
+    filename = f"{stx_conf}/detector/min_time_index.csv"
+    return _load_conf_date_index(filename, os.path.getmtime(filename), 'Mininmum time [cs]', 'neither')
 
 def date2elut_file(date, stx_conf = None):
     """Find the ELUT table to be applied, given the date of the observation. ELUT tables are available in STIX-CONF https://github.com/i4Ds/STIX-CONF
     
     Args:
-        date (str, datetime.datetime): Date for which to find ELUT file.
+        date (str, datetime.datetime or array-like): Date for which to find ELUT file, or an array of dates (e.g. the start times of many observations), which are looked up in one call.
         stx_conf (str, optional): Path to ELUT files. Defaults to None. If not set, the program will look for an environment variable STX_CONF which points to the correct location of the files mentioned above.
         
     Returns:
-        str: ELUT filename"""
+        str or np.array: ELUT filename, or array of ELUT filenames if an array of dates was given"""
+    return elut_index(stx_conf).lookup(date)
+
+def _elut_sidecar_filename(elut_filename):
+    """Name of the precompiled .npz sidecar belonging to an ELUT csv file."""
+    return f"{os.path.splitext(elut_filename)[0]}.npz"
+
+def _readonly(arr):
+    """Flag an array that lives in one of the module caches as read-only, so that callers cannot modify the cached copy by accident."""
+    arr.setflags(write = False)
+    return arr
+
+def _parse_elut_csv(elut_filename):
+    """Parse an ELUT csv file into the unscaled offset and gain, the ADC 4096 channel edges, pixel and detector IDs and the actual energy edges in keV."""
+    import pandas as pd
+    elut = pd.read_csv(elut_filename, header = 2)
+    offset = elut.Offset.values.reshape((32,12))
+    gain = elut["Gain keV/ADC"].values.reshape((32,12))
+    adc4096 = np.transpose(elut.values[:,4:].T.reshape((31,32,12)), axes = (0,2,1)).T # 31 x 12 x 32 but in correct order
+    return {"offset": offset,
+            "gain": gain,
+            "adc4096": adc4096,
+            "pix_id": elut.Pixel.values.reshape((32,12)).T,
+            "det_id": elut.Detector.values.reshape((32,12)).T,
+            "ekev_actual": (adc4096 - offset[...,np.newaxis]) * gain[...,np.newaxis], # offset and gain scalings cancel out
+           }
+
+def compile_elut(elut_filename, npz_filename = None):
+    """Precompile an ELUT csv file into a binary .npz sidecar, which *read_elut* loads instead of parsing the csv as long as the sidecar is newer than the csv file.
     
-    if not stx_conf:
-        stx_conf = os.environ['STX_CONF']
-    elut_index=glob.glob(f"{stx_conf}/elut/elut_index.csv")[0]
-    elut_df=pd.read_csv(elut_index)
-    elut_df[' end_date'].replace('none',dt.now().strftime("%Y-%m-%dT%H:%M:%S"),inplace=True)
-    elut_df['start_date'] = pd.to_datetime(elut_df[' start_date'])
-    elut_df['end_date'] = pd.to_datetime(elut_df[' end_date'])
-    #elut_df.drop(columns=[' start_date',' end_date'], inplace=True)
-    if isinstance(date,str):
-        date = pd.to_datetime(date)
-    elut_filename = elut_df.query("@date > start_date and @date <= end_date")[' elut_file'].iloc[0]# elut filename that applies to desired date
-    return elut_filename
+    Args:
+        elut_filename (str): Full path to the ELUT csv file.
+        npz_filename (str, optional): Defaults to None, in which case the sidecar is written next to the csv file with the extension replaced by .npz.
+        
+    Returns:
+        str: Full path of the written .npz file."""
+    if not npz_filename:
+        npz_filename = _elut_sidecar_filename(elut_filename)
+    np.savez(npz_filename, **_parse_elut_csv(elut_filename))
+    return npz_filename
+
+@lru_cache(maxsize = 16)
+def _load_elut(elut_filename, mtime, use_sidecar = True):
+    """Cached ELUT loader. The modification time is part of the cache key so that an ELUT file that changes on disk is read again."""
+    sidecar = _elut_sidecar_filename(elut_filename)
+    if use_sidecar and os.path.isfile(sidecar) and os.path.getmtime(sidecar) >= mtime:
+        with np.load(sidecar) as npz:
+            elut = {k: npz[k] for k in npz.files}
+    else:
+        elut = _parse_elut_csv(elut_filename)
+    return {k: _readonly(v) for k,v in elut.items()}
+
+@lru_cache(maxsize = 4)
+def _load_science_energy_channels(filename, mtime):
+    """Cached read of the science energy channel edges in keV."""
+    import pandas as pd
+    science_energy_channels = pd.read_csv(filename, header = 21, skiprows = [22,23])
+    return _readonly(pd.to_numeric(science_energy_channels['Energy Edge '][1:32]).values)
+
+def elut_cache_info():
+    """Hit and miss counters of the process-wide ELUT cache.
+    
+    Returns:
+        functools._CacheInfo: Named tuple of hits, misses, maxsize and currsize."""
+    return _load_elut.cache_info()
 
-def read_elut(elut_filename = None, scl = 4.0, ekev_actual = True):
+def clear_elut_cache():
+    """Empty the process-wide ELUT cache and reset its counters."""
+    _load_elut.cache_clear()
+    _load_science_energy_channels.cache_clear()
+
+def read_elut(elut_filename = None, scl = 4.0, ekev_actual = True, use_sidecar = True):
     """ This function finds the most recent ELUT csv file, reads it, and returns the gain and offset used to make it along with the edges of the Edges in keV (Exact) and ADC 4096, rounded. Translation of _stx_read_elut.pro_.
     
+    ELUT files are cached per process by path and modification time, so repeated calls for the same ELUT do not re-parse it. The cached arrays are read-only. If a precompiled sidecar written by *compile_elut* exists and is up to date, it is loaded instead of the csv.
+    
     Args:
         elut_filname (str, optional): Name of the ELUT file to use. Defaults to None, in which case the most recent ELUT file will be used.
         scl (float, optional): Default 4.0. Otherwise should be set to 1. Scale factor for offset.
         ekev_actual (bool, optional): Return channel edges with true energies based on full adc 4096 bins
+        use_sidecar (bool, optional): Defaults to True. Load the precompiled .npz sidecar of the ELUT if there is one.
         
     Returns:
         gain (np.array):
@@ -49,69 +209,65 @@ def read_elut(elut_filename = None, scl = 4.0, ekev_actual = True):
     stx_conf = os.environ['STX_CONF']
     if not elut_filename:
         elut_filename = sorted(glob.glob(f"{stx_conf}/elut/elut_table*.csv"), key=os.path.getmtime)[-1] #most recent ELUT
-        elut_filename = f"{stx_conf}/elut/{elut_filename}"
         
-    elut = pd.read_csv(elut_filename, header = 2)
+    elut = _load_elut(os.path.abspath(elut_filename), os.path.getmtime(elut_filename), use_sidecar = use_sidecar)
         
 #    if scale1024:
 #        scl = 4.0
 #    else:
 #        scl = 1.0
         
-    offset = (elut.Offset.values / scl).reshape((32,12))
-    gain = (elut["Gain keV/ADC"].values * scl).reshape((32,12))
+    offset = elut["offset"] / scl
+    gain = elut["gain"] * scl
         
-    adc4096 = np.transpose(elut.values[:,4:].T.reshape((31,32,12)), axes = (0,2,1)).T # 31 x 12 x 32 but in correct order
-    science_energy_channels = pd.read_csv(f"{stx_conf}/detector/ScienceEnergyChannels_1000.csv", header = 21, skiprows = [22,23])
-    ekev = pd.to_numeric(science_energy_channels['Energy Edge '][1:32]).values
+    science_energy_channels = f"{stx_conf}/detector/ScienceEnergyChannels_1000.csv"
+    ekev = _load_science_energy_channels(science_energy_channels, os.path.getmtime(science_energy_channels))
     adc4096_dict = {"ELUT_FILE": elut_filename,
                 "EKEV": ekev, # Science energy channel edges in keV
-                "ADC4096": adc4096, # 4096 ADC channel value based on EKEV and gain/offset
-                "PIX_ID": elut.Pixel.values.reshape((32,12)).T, # Pixel cell of detector, 0-11
-                "DET_ID": elut.Detector.values.reshape((32,12)).T, # Detector ID 0-31
+                "ADC4096": elut["adc4096"], # 4096 ADC channel value based on EKEV and gain/offset
+                "PIX_ID": elut["pix_id"], # Pixel cell of detector, 0-11
+                "DET_ID": elut["det_id"], # Detector ID 0-31
                 }
     if ekev_actual:
-        gain4096 = np.zeros((32,12,31))
-        offset4096 = np.zeros((32,12,31))
-        for i in range(31):
-            gain4096[:,:,i] = gain/scl
-            offset4096[:,:,i] = offset * scl
-        ekev_act = (adc4096 - offset4096) * gain4096
-        return gain, offset, adc4096_dict, ekev_act
+        return gain, offset, adc4096_dict, elut["ekev_actual"]
     else:
         return gain, offset, adc4096_dict
 
-def get_header_corrections(fits_path):
+def get_header_corrections(primary_header):
     """Returns distance from the Sun and time shift from primary header information.
     
     Args:
-        fits_path (str): Full path to FITS file
+        primary_header (astropy.header or str): Primary header of the observation file, or full path to the FITS file (which is then opened and closed again just to read the header).
         
     Returns:
          tuple : Distance from the Sun in AU, time shift in seconds between spacecraft and Earth time.
         """
-    primary_header =fits.open(fits_path)[0].header
-    au = constants.au.value # Already in meters
+    if isinstance(primary_header, str):
+        primary_header = fits.getheader(primary_header, 0)
     distance_sun_m = primary_header['DSUN_OBS']
-    distance = distance_sun_m/au
+    distance = distance_sun_m/_AU
     time_shift = primary_header['EAR_TDEL']
     return distance, time_shift
+
+#header and (memory-mapped) table data of one HDU of a STIX science FITS file, as returned by open_spec_fits
+SpecHDU = namedtuple('SpecHDU', ['name', 'header', 'data'])
     
-def open_spec_fits(fits_path):
-    """Open a L1, L1A, or L4 FITS file and return the HDUs
+def open_spec_fits(fits_path, memmap = True):
+    """Open a L1, L1A, or L4 FITS file and return the HDUs. The file is opened once; with *memmap* the table data are memory-mapped copy-on-write, so columns are zero-copy views into the file until something writes to them.
     
     Args:
         fits_path (str): Full path to FITS file
+        memmap (bool, optional): Defaults to True. Memory-map the table data instead of reading it into memory.
         
     Returns:
-        tuple : astropy Primary HDU header, control HDU, data HDU, energy HDU
+        tuple : astropy Primary HDU header, control, data and energy SpecHDU (name, header, data)
     
     """
-    with fits.open(fits_path) as hdul:
-        primary_header = hdul[0].header.copy()
-        control = hdul[1].copy()
-        data = hdul[2].copy()
-        energy = hdul[3].copy() if hdul[3].name == 'ENERGIES' else hdul[4].copy()
+    with fits.open(fits_path, memmap = memmap) as hdul:
+        primary_header = hdul[0].header
+        energy_ext = 3 if hdul[3].name == 'ENERGIES' else 4
+        #keep references to the data rather than the HDUs: closing the file drops the HDUs' data attribute, but the mapping stays alive as long as the arrays are referenced
+        control, data, energy = [SpecHDU(hdul[i].name, hdul[i].header, hdul[i].data) for i in (1, 2, energy_ext)]
     return primary_header, control, data, energy
     
 def get_hstart_time(primary_header):
@@ -201,6 +357,32 @@ def edge_products(edges):
     #width = width[~np.isinf(width)] #if there's an inf get rid of it
     return out_mean, gmean, width, edges_1, edges_2
 
+def match_energies(values, reference, rtol = 1e-6, atol = 1e-6):
+    """Find energies (e.g. channel edges or means) in a reference array, in one vectorised call. Finite values match if they agree to within atol + rtol*|value|, so that edges stored as float32 in one file and float64 in another (or shifted by an ELUT energy shift) are not silently dropped by exact comparison. Infinite values only match an equal entry, and NaN matches nothing.
+    
+    Args:
+        values (np.array): Energies to look up.
+        reference (np.array): Energies to look them up in. Does not need to be sorted.
+        rtol (float, optional): Defaults to 1e-6. Relative tolerance.
+        atol (float, optional): Defaults to 1e-6. Absolute tolerance in keV.
+        
+    Returns:
+        tuple: Index into reference of the nearest entry for each value (-1 where there is no match; the first occurrence if reference has duplicates), and a boolean array that is True where the value matched."""
+    values = np.atleast_1d(np.asarray(values, dtype = float))
+    reference = np.atleast_1d(np.asarray(reference, dtype = float))
+    if reference.size == 0:
+        return np.full(values.shape, -1), np.zeros(values.shape, dtype = bool)
+    order = np.argsort(reference, kind = 'stable')
+    sorted_reference = reference[order]
+    pos = np.searchsorted(sorted_reference, values)
+    left = np.clip(pos - 1, 0, reference.size - 1)
+    right = np.clip(pos, 0, reference.size - 1)
+    with np.errstate(invalid = 'ignore'): #inf - inf; non-finite values only match by exact equality
+        use_right = (sorted_reference[right] == values) | (np.abs(sorted_reference[right] - values) <= np.abs(sorted_reference[left] - values))
+        nearest = np.where(use_right, right, left)
+        matched = (sorted_reference[nearest] == values) | (np.isfinite(values) & (np.abs(sorted_reference[nearest] - values) <= atol + rtol*np.abs(values)))
+    return np.where(matched, order[nearest], -1), matched
+
 def shift_one_timestep(arr_in, axis = 0, shift_step = -1):
     """Shift an array along a given axis a given number of steps. Primarily used to shift time axis by one step.
     
@@ -220,7 +402,45 @@ def shift_one_timestep(arr_in, axis = 0, shift_step = -1):
     else:
         return shifted_arr[shift_step:]
     
-def write_cropped_srm(srm,keep_channels,fitsfilename=None, request_id = None):
+def sum_over_pixels(counts, pixels_used, detectors_used, energy_bins = None, eff_ewidth = None, squared = False):
+    """Sum L1A counts over the pixels used in a single pass, with the pixel selection applied as weights rather than by copying. Only the reduced (time, detector, energy) array is ever allocated.
+    
+    Args:
+        counts (np.array): Counts or counts error, shape (time, detector, pixel, energy).
+        pixels_used (np.array): Indices of the pixels to sum over.
+        detectors_used (np.array): Indices of the detectors to keep.
+        energy_bins (np.array, optional): Defaults to None, in which case all energies are kept. Indices of the energies to keep.
+        eff_ewidth (np.array, optional): Defaults to None. Effective energy bin width to divide by, one value per energy kept.
+        squared (bool, optional): Defaults to False. Sum the squares of the input instead, for adding errors in quadrature. eff_ewidth is then squared as well.
+        
+    Returns:
+        np.array: Array of shape (time, detector used, energy)."""
+    weights = np.zeros(counts.shape[2])
+    weights[pixels_used] = 1.
+    if squared:
+        summed = np.einsum('tdpe,tdpe,p->tde', counts, counts, weights)
+    else:
+        summed = np.einsum('tdpe,p->tde', counts, weights)
+    summed = summed[:,detectors_used]
+    if energy_bins is not None:
+        summed = summed[...,energy_bins]
+    if eff_ewidth is not None:
+        summed /= eff_ewidth**2 if squared else eff_ewidth
+    return summed
+    
+def chunk_size_for_budget(memory_budget, bytes_per_time_bin, working_copies = 8):
+    """Number of time bins to process at once so that the working arrays of one chunk fit into a memory budget.
+    
+    Args:
+        memory_budget (int): Memory in bytes available for one chunk.
+        bytes_per_time_bin (int): Size in bytes of the input data of one time bin.
+        working_copies (int, optional): Defaults to 8. Number of input-sized temporary arrays the processing of a chunk needs at its peak.
+        
+    Returns:
+        int: Chunk size in time bins, at least 1."""
+    return max(1, int(memory_budget // (working_copies * bytes_per_time_bin)))
+    
+def write_cropped_srm(srm,keep_channels,fitsfilename=None, request_id = None, overwrite = False):
     """Write a SRM FITS file with only the channels relevant to the observation retained. A shortcut to generating the full SRM, used because the STIX SRM is relatively stable.
     
     Args:
@@ -228,6 +448,7 @@ def write_cropped_srm(srm,keep_channels,fitsfilename=None, request_id = None):
         keep_channels (list): List of indices of energy channels to keep.
         fitsfilename (str, optional): Defaults to None. Name of output SRM FITS file.
         request_id (int or str, optional): Request ID associated with observation, to help in creating default filename.
+        overwrite (bool, optional): Defaults to False. Overwrite the output file if it exists.
         
     Returns:
         str: Full path and filename of written FITS file."""
@@ -241,6 +462,7 @@ def write_cropped_srm(srm,keep_channels,fitsfilename=None, request_id = None):
     #print("NEW_NCHAN",new_nchan[0])
     new_matrix = matrix.MATRIX[:,keep_channels] #can't do this have to make new ones
     
+    from astropy.table import Table
     matrix_table = Table([matrix.ENERG_LO, matrix.ENERG_HI, matrix.N_GRP, matrix.F_CHAN, new_nchan.astype('>i4'), new_matrix.astype('>f4')], names = matrix_names)
     
     ebounds = srm[2].data
@@ -264,6 +486,65 @@ def write_cropped_srm(srm,keep_channels,fitsfilename=None, request_id = None):
         fitsfilename = f"{srm[1].header['PHAFILE'][:-5]}_{len(keep_channels)}_chans.fits"
     if request_id:
         fitsfilename = f"{fitsfilename[:-5]}_{request_id}.fits"
-    hdul.writeto(fitsfilename)
+    hdul.writeto(fitsfilename, overwrite = overwrite)
+    return fitsfilename
+
+@lru_cache(maxsize = 2)
+def _open_srm(srm_path, mtime):
+    """Memory-map the SRM file once per process. The file stays open for the lifetime of the cache entry, so the HDUList must not be closed by callers."""
+    return fits.open(srm_path, memmap = True)
+
+def open_full_srm(srm_file = "stx_srm_full.fits"):
+    """Open a pre-generated SRM, memory-mapped and shared by all calls in this process.
+    
+    Args:
+        srm_file (str, optional): Defaults to "stx_srm_full.fits". Full path to the SRM file, or the name of a file in stix2xspec.data.
+        
+    Returns:
+        astropy.io.fits.HDUList: The SRM. Do not close it."""
+    if not os.path.isfile(srm_file):
+        with resources.path('stix2xspec.data', srm_file) as srmfile:
+            srm_file = str(srmfile)
+    srm_path = os.path.abspath(srm_file)
+    return _open_srm(srm_path, os.path.getmtime(srm_path))
+
+def cropped_srm_key(srm, keep_channels):
+    """Content hash identifying a cropped SRM: the source SRM (matrix header, energy bins and response matrix) and the channels kept. An energy shift only changes which channels are kept, not the written file, so it is not part of the key.
+    
+    Args:
+        srm (astropy.io.fits.HDUList): Full SRM.
+        keep_channels (list): Indices of energy channels kept.
+        
+    Returns:
+        str: Hex digest."""
+    h = hashlib.sha1()
+    h.update(srm[1].header.tostring().encode('ascii'))
+    for column in [srm[1].data.ENERG_LO, srm[1].data.ENERG_HI, srm[1].data.MATRIX, srm[2].data.E_MIN, srm[2].data.E_MAX]:
+        h.update(np.ascontiguousarray(column).tobytes())
+    h.update(np.asarray(keep_channels, dtype = np.int64).tobytes())
+    return h.hexdigest()
+
+def cached_cropped_srm(srm, keep_channels, srm_dir = None):
+    """Return a cropped SRM file for the given channel selection, writing it with *write_cropped_srm* only if no file with the same content exists yet. Files are named after a hash of the selection (see *cropped_srm_key*), so conversions with the same channel set share one file, and written atomically so that parallel conversions do not collide.
+    
+    Args:
+        srm (astropy.io.fits.HDUList): Full SRM, e.g. from *open_full_srm*.
+        keep_channels (list): Indices of energy channels to keep.
+        srm_dir (str, optional): Defaults to None, the current directory. Directory of the cropped SRM files.
+        
+    Returns:
+        str: Path of the cropped SRM file, relative to srm_dir if given."""
+    fitsfilename = f"{srm[1].header['PHAFILE'][:-5]}_{len(keep_channels)}_chans_{cropped_srm_key(srm, keep_channels)[:12]}.fits"
+    srm_dir = srm_dir or os.getcwd()
+    srm_path = os.path.join(srm_dir, fitsfilename)
+    if not os.path.isfile(srm_path):
+        fd, tmp_path = tempfile.mkstemp(suffix = '.fits', dir = srm_dir)
+        os.close(fd) #the name stays reserved until it is replaced or removed
+        try:
+            write_cropped_srm(srm, keep_channels, fitsfilename = tmp_path, overwrite = True)
+            os.replace(tmp_path, srm_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
     return fitsfilename
 
@@ -1,17 +1,51 @@
 import numpy as np
 import os
-from astropy.io import fits
-from astropy import constants
-import warnings
-from datetime import datetime as dt
-from datetime import timedelta as td
-
-from .spectrogram import Spectrogram
-from .triggergram import Triggergram
-from .spectrogram_utils import *
-from matplotlib import pyplot as plt
-
-def convert_spectrogram(fits_path_data, fits_path_bk = None, shift_duration = 0, energy_shift = 0, distance = 1.0, elut_filename = None, replace_doubles = False, keep_short_bins = True, to_fits= False, use_discriminators = True, testing = False):
+from collections import OrderedDict
+
+from .spectrogram import Spectrogram, stx_energy_axis
+from .spectrogram_utils import edge_products, match_energies
+from .instrumentation import instrument_stage
+from .jobs import map_jobs, run_reported
+
+_background_cache = OrderedDict() #processed background spectrograms, per process
+_BACKGROUND_CACHE_SIZE = 8
+
+@instrument_stage('background')
+def process_background(fits_path_bk, spec, elut_filename = None, replace_doubles = False, keep_short_bins = True, cache = False):
+    """Read a background file and apply the ELUT and livetime correction to it, using the energy bins, pixels and detectors of the spectrogram it will be subtracted from.
+    
+    Args:
+        fits_path_bk (str): Full path to FITS background file.
+        spec (stix2xspec.Spectrogram): Data spectrogram, with ELUT applied, that the background will be subtracted from.
+        elut_filename (str, optional): Defaults to None. Name of the ELUT file to use.
+        replace_doubles (bool, optional): Defaults to False.
+        keep_short_bins (bool, optional): Defaults to True. Otherwise discards time bins shorter than a minimum value.
+        cache (bool, optional): Defaults to False. If True, the processed background is kept in a small per-process cache and reused for later data spectrograms with the same background file, ELUT, energy bins, pixels and detectors. The cached spectrogram must not be modified.
+        
+    Returns:
+        stix2xspec.Spectrogram: The processed background spectrogram."""
+    if cache:
+        key = (os.path.abspath(fits_path_bk), os.path.getmtime(fits_path_bk), elut_filename, replace_doubles, keep_short_bins, spec.n_energies, np.asarray(spec.control_data.energy_bin_mask).tobytes(), np.asarray(spec.pixel_mask).tobytes(), np.asarray(spec.detector_mask).tobytes())
+        if key in _background_cache:
+            _background_cache.move_to_end(key)
+            return _background_cache[key]
+            
+    spec_bk = Spectrogram(fits_path_bk, shift_duration = None, replace_doubles = replace_doubles, keep_short_bins = keep_short_bins, background = True, use_discriminators = False)
+    spec_bk.control_data.energy_bin_mask = spec.control_data.energy_bin_mask
+    spec_bk.pixel_mask = spec.pixel_mask
+    spec_bk.detector_mask = spec.detector_mask
+    spec_bk.apply_elut(elut_filename = elut_filename, n_energies = spec.n_energies)
+    spec_bk.n_energies = 32
+    spec_bk.correct_counts()
+    
+    if cache:
+        _background_cache[key] = spec_bk
+        if len(_background_cache) > _BACKGROUND_CACHE_SIZE:
+            _background_cache.popitem(last = False)
+    return spec_bk
+
+@instrument_stage('convert')
+def convert_spectrogram(fits_path_data, fits_path_bk = None, shift_duration = 0, energy_shift = 0, distance = 1.0, elut_filename = None, replace_doubles = False, keep_short_bins = True, to_fits= False, use_discriminators = True, testing = False, cache_background = False, chunk_size = None, memory_budget = None, out_dir = None):
     """Convert STIX spectrogram for use in XSPEC (translation of _stx_convert_spectrogram.pro_, which coverts STIX spectrograms for use with OPSEX, and also of _stx_convert_pixel_data.pro_, which does the same for L1A pixel data).
     
     Args:
@@ -25,29 +59,32 @@ def convert_spectrogram(fits_path_data, fits_path_bk = None, shift_duration = 0,
         keep_short_bins (bool, optional): Defaults to True. Otherwise discards time bins shorter than a minimum value.
         to_fits (bool, optional): Defaults to False. If True, a FITS file will be written.
         use_discriminators (bool, optional): Defaults to True.
+        cache_background (bool, optional): Defaults to False. Reuse the processed background from earlier calls in this process if possible, see *process_background*.
+        chunk_size (int, optional): Defaults to None. For L1A pixel data, process this many time bins at a time with *Spectrogram.process_in_chunks* instead of holding the whole counts cube in memory. Cannot be combined with keep_short_bins = False.
+        memory_budget (int, optional): Defaults to None. For L1A pixel data, process in chunks that fit into this many bytes. Ignored if chunk_size is set.
+        out_dir (str, optional): Defaults to None, i.e. the current working directory. Directory in which the FITS and .srm files are written.
     
     Returns:
         str: Full path to FITS file that has been written with the converted spectrogram."""
-    spec = Spectrogram(fits_path_data, shift_duration = shift_duration, replace_doubles = replace_doubles, keep_short_bins = keep_short_bins, background = False, use_discriminators = use_discriminators)
+    chunked = bool(chunk_size or memory_budget)
+    spec = Spectrogram(fits_path_data, shift_duration = shift_duration, replace_doubles = replace_doubles, keep_short_bins = keep_short_bins, background = False, use_discriminators = use_discriminators, streaming = chunked)
     dist_factor = 1./(spec.distance**2.) #when is this used?
-    spec.apply_elut(elut_filename = elut_filename)
-
-    if spec.counts.ndim == 2: #it's from a L4 spectrogram
-        #spec.data_level = 4
-        counts_spec = spec.counts
+    if chunked and spec.alpha:
+        spec.process_in_chunks(elut_filename = elut_filename, chunk_size = chunk_size, memory_budget = memory_budget)
+        counts_spec = spec.counts_before_livetime[0].T #already summed over detectors
     else:
-        counts_spec = np.sum(spec.counts,axis=1) #sum over detectors
-    spec.correct_counts()
+        spec.apply_elut(elut_filename = elut_filename)
+
+        if spec.counts.ndim == 2: #it's from a L4 spectrogram
+            #spec.data_level = 4
+            counts_spec = spec.counts
+        else:
+            counts_spec = np.sum(spec.counts,axis=1) #sum over detectors
+        spec.correct_counts()
     
     #print(".......... BACKGROUND ........")
     #background
-    spec_bk = Spectrogram(fits_path_bk, shift_duration = None, replace_doubles = replace_doubles, keep_short_bins = keep_short_bins, background = True, use_discriminators = False)
-    spec_bk.control_data.energy_bin_mask = spec.control_data.energy_bin_mask
-    spec_bk.pixel_mask = spec.pixel_mask
-    spec_bk.detector_mask = spec.detector_mask
-    spec_bk.apply_elut(elut_filename = elut_filename, n_energies = spec.n_energies)
-    spec_bk.n_energies = 32
-    spec_bk.correct_counts()
+    spec_bk = process_background(fits_path_bk, spec, elut_filename = elut_filename, replace_doubles = replace_doubles, keep_short_bins = keep_short_bins, cache = cache_background)
     
     #print(".......... BACKGROUND SUBTRACTION ........")
     #extra background corrections - stx_convert_science_data2ospex 153-190
@@ -78,10 +115,63 @@ def convert_spectrogram(fits_path_data, fits_path_bk = None, shift_duration = 0,
         return spec
     
     else: #write background-corrected counts to fits
-        fitsfilename = f"stx_spectrum_{spec.t_axis.time_mean[0] :%Y%m%d_%H%M%S}.fits"
+        fitsfilename = f"stx_spectrum_{spec.t_axis.time_mean_dt64[0].astype('datetime64[us]').item() :%Y%m%d_%H%M%S}.fits"
         #print(f"spec.e_axis {spec.e_axis.energy_mean}")
+        fitsfilename = os.path.abspath(os.path.join(out_dir or os.getcwd(), fitsfilename))
         spec.spectrum_to_fits(fitsfilename)
-        return f"{os.getcwd()}/{fitsfilename}"
+        return fitsfilename
+
+def _convert_file(result, fits_path_data, fits_path_bk, kwargs):
+    """Convert one file, see *convert_spectrograms*."""
+    result['output'] = convert_spectrogram(fits_path_data, fits_path_bk, to_fits = True, cache_background = True, **kwargs)
+
+def _convert_one(fits_path_data, fits_path_bk, kwargs, instrument = False):
+    """Worker for *convert_spectrograms*: convert one file and report the outcome instead of raising."""
+    return run_reported(_convert_file, {'file': fits_path_data, 'background': fits_path_bk, 'output': None}, fits_path_data, fits_path_bk, kwargs, instrument = instrument)
+
+def convert_spectrograms(fits_paths_data, fits_path_bk, jobs = None, report = True, instrument = False, **kwargs):
+    """Convert many STIX files for use in XSPEC, in parallel over a pool of worker processes. Each file is converted and written to FITS by *convert_spectrogram*. Every worker processes each distinct background (for a given ELUT, energy bin, pixel and detector selection) only once and reuses it for the following files.
+    
+    Args:
+        fits_paths_data (list): Full paths to the FITS files to be converted.
+        fits_path_bk (str or list): Full path to the FITS background file to be subtracted from all files, or a list with one background file per data file.
+        jobs (int, optional): Defaults to None, in which case one worker per CPU is used. Number of worker processes. If 1, the files are converted in the current process.
+        report (bool, optional): Defaults to True. Print a per-file success/failure report at the end of the run.
+        instrument (bool or dict, optional): Defaults to False. Return the records of the stages of each conversion, see *stix2xspec.instrumentation.StageRecorder*, which is created with the keyword arguments in instrument if it is a dictionary, e.g. {'trace_memory': True}.
+        **kwargs: Further keyword arguments for *convert_spectrogram*, e.g. elut_filename, keep_short_bins or out_dir.
+        
+    Returns:
+        list: One dictionary per input file, in input order, with keys 'file', 'background', 'success', 'output' (path of the written FITS file), 'error' (None or the error message), 'elapsed' (seconds), 'stages' (wall time in seconds of each stage, from the same records as 'records', see *jobs.run_reported*; 'convert' includes the others, and 'read', 'apply_elut' and 'correct_counts' include those of the background unless it was cached) and, with instrument, 'records' (the stage records)."""
+    fits_paths_data = list(fits_paths_data)
+    if isinstance(fits_path_bk, str):
+        fits_paths_bk = [fits_path_bk] * len(fits_paths_data)
+    else:
+        fits_paths_bk = list(fits_path_bk)
+        if len(fits_paths_bk) != len(fits_paths_data):
+            raise ValueError("Parameter 'fits_path_bk' must be a single file or have one entry per data file")
+    
+    n_files = len(fits_paths_data)
+    results = map_jobs(_convert_one, fits_paths_data, fits_paths_bk, [kwargs] * n_files, [instrument] * n_files, jobs = jobs)
+    if report:
+        print(conversion_report(results))
+    return results
+
+def conversion_report(results, verb = 'converted'):
+    """Format the results of *convert_spectrograms* (or of the other batch functions, see *stix2xspec.batch*) as a per-file report.
+    
+    Args:
+        results (list): Result dictionaries returned by *convert_spectrograms*.
+        verb (str, optional): Defaults to 'converted'. What was done to the files, for the last line of the report.
+        
+    Returns:
+        str: The report."""
+    lines = []
+    for r in results:
+        status = f"OK      {r['output']}" if r['success'] else f"FAILED  {r['error']}"
+        lines.append(f"{os.path.basename(r['file'])}  {r['elapsed']:.2f} s  {status}")
+    n_ok = sum(r['success'] for r in results)
+    lines.append(f"{n_ok} of {len(results)} files {verb}, {len(results) - n_ok} failed")
+    return "\n".join(lines)
 
 def bk_count_manipulations(bk_counts, duration, timedel, energy_bins, eff_ewidth, ntimes, error = False):
     """Adjust input counts for effective energy width and duration.
@@ -135,12 +225,13 @@ def new_energy_axis(spec, emin = 1, emax = 150):
 
     e_axis_new = stx_energy_axis(num_energy = len(new_energy_edges) - 1, energy_mean = out_mean, gmean = out_gmean, width = width, low = energy_low, high = energy_high, low_fsw_idx = low_fsw_idx, high_fsw_idx = high_fsw_idx, edges_1 = edges_1, edges_2 = edges_2)
 
-    new_energies = [i for i,e in enumerate(spec.e_axis.energy_mean) if e in e_axis_new.energy_mean]
+    new_energies = np.where(match_energies(spec.e_axis.energy_mean, e_axis_new.energy_mean)[1])[0].tolist()
     #self.e_axis = e_axis_new
     #self.counts =  spec_in_corr[new_energies,:]
     #self.error = total_error[new_energies,:]
     return e_axis_new, new_energies
 
+@instrument_stage('background_subtract')
 def background_subtract(spectrogram, spectrogram_bk, counts_spec, testing = False):
     """Perform background subtraction of spectrogram counts.
     
@@ -171,8 +262,8 @@ def background_subtract(spectrogram, spectrogram_bk, counts_spec, testing = Fals
         spectrogram.t_axis.duration = np.expand_dims(spectrogram.t_axis.duration,1)
     
     corrected_counts_bk = bk_count_manipulations(corrected_counts_bk, spectrogram.t_axis.duration, spectrogram_bk.data['timedel'], energy_bins, spectrogram.eff_ewidth, ntimes)
-    spec_in_bk = bk_count_manipulations(spec_in_bk, spectrogram.t_axis.duration, spectrogram_bk.data['timedel'], energy_bins, spectrogram.eff_ewidth, ntimes, name = 'spec_in_bk')
-    error_bk = bk_count_manipulations(corrected_error_bk, spectrogram.t_axis.duration, spectrogram_bk.data['timedel'], energy_bins, spectrogram.eff_ewidth, ntimes, name = 'error_bk', error = True)
+    spec_in_bk = bk_count_manipulations(spec_in_bk, spectrogram.t_axis.duration, spectrogram_bk.data['timedel'], energy_bins, spectrogram.eff_ewidth, ntimes)
+    error_bk = bk_count_manipulations(corrected_error_bk, spectrogram.t_axis.duration, spectrogram_bk.data['timedel'], energy_bins, spectrogram.eff_ewidth, ntimes, error = True)
 
     spec_in_corr = corrected_counts - corrected_counts_bk
     spec_in_uncorr = counts_spec - spec_in_bk #is this neccessary to keep or is it an OSPEX thing? would simplify input if didn't need to pass in counts_spec
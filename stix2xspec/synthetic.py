@@ -0,0 +1,230 @@
+import os
+import numpy as np
+from datetime import datetime as dt
+from datetime import timedelta as td
+from functools import lru_cache
+from importlib import resources
+from astropy.io import fits
+from .livetime import _detector_adg_index
+from .spectrogram_utils import _MJD_EPOCH
+
+L1A_TEMPLATE = 'solo_L1A_stix-sci-xray-l1-2207235029_20220723T113947-20220723T122747_079205_V01.fits'
+L4_TEMPLATE = 'solo_L1A_stix-sci-spectrogram-2207238956_20220723T122007-20220723T182511_079258_V01.fits'
+
+_ATTENUATOR_EKEV = 15.8 #transmission exp(-(E0/E)**3): about 2% at 10 keV and 60% at 20 keV, roughly that of the STIX aluminium attenuator
+_CHUNK_BYTES = 2**26 #target size of the rows generated and written at once
+
+def _sample_hdus(name):
+    """Copies of the HDUs of one of the bundled sample files, without checksums."""
+    with resources.path('stix2xspec.data', name) as f:
+        with fits.open(f) as hdul:
+            hdus = [hdu.copy() for hdu in hdul]
+    for hdu in hdus:
+        for key in ['CHECKSUM', 'DATASUM']:
+            hdu.header.remove(key, ignore_missing = True)
+    return hdus
+
+@lru_cache(maxsize = 1)
+def _sample_shapes():
+    """Distribution of counts over detectors, pixels and energy channels, normalized to 1, of the quiet background (the bundled pixel data) and of a flare (the energy spectrum of the peak of the bundled spectrogram above its median, spread over detectors and pixels like the background).
+
+    Returns:
+        tuple: background and flare distributions, each of shape (32 detectors, 12 pixels, 32 energies)."""
+    l1a = _sample_hdus(L1A_TEMPLATE)[2].data
+    background = np.sum(l1a['counts'], axis = 0)
+    background /= background.sum()
+    l4 = _sample_hdus(L4_TEMPLATE)[2].data
+    rates = l4['counts']/l4['timedel'][:,None]
+    flare_spectrum = np.clip(rates[np.argmax(rates.sum(axis = 1))] - np.median(rates, axis = 0), 0, None)
+    flare = np.sum(background, axis = 2)[:,:,None]*flare_spectrum/flare_spectrum.sum()
+    for shape in (background, flare):
+        shape.setflags(write = False)
+    return background, flare
+
+def attenuator_transmission(e_low, e_high):
+    """Approximate transmission of the attenuator in each energy channel, evaluated at the channel center (at the lower edge for the open-ended top channel).
+
+    Args:
+        e_low (np.array): Lower channel edges in keV.
+        e_high (np.array): Upper channel edges in keV.
+
+    Returns:
+        np.array: Transmission between 0 and 1."""
+    energy = np.where(np.isfinite(e_high), (np.asarray(e_low) + np.asarray(e_high))/2., e_low)
+    return np.exp(-(_ATTENUATOR_EKEV/np.maximum(energy, 1e-3))**3)
+
+def compress_counts(values, m):
+    """Quantize counts as the STIX onboard compression does, and return them with the compression error as given in the L1 files. Values below 2**(m+1) are kept exactly; larger values keep m mantissa bits and are decompressed to the middle of their interval.
+
+    Args:
+        values (np.array): Non-negative integer counts.
+        m (int): Number of mantissa bits of the compression scheme (the last entry of compression_scheme_*_skm).
+
+    Returns:
+        tuple: decompressed counts (int64) and their error (float64)."""
+    values = np.asarray(values, dtype = np.int64)
+    exponent = np.maximum(np.floor(np.log2(np.maximum(values, 1))).astype(np.int64) - m, 0)
+    width = np.left_shift(1, exponent)
+    compressed = (values // width)*width + width//2 - (width > 1)
+    error = np.where(width > 1, np.sqrt((width.astype(float)**2 + 2)/12.), 0.)
+    return compressed, error
+
+def flare_profile(peak_rate, peak_time, rise_time, decay_time):
+    """Count rate profile of a flare with a Gaussian rise and an exponential decay.
+
+    Args:
+        peak_rate (float): Count rate at the peak, in counts/s summed over all detectors, pixels and energies.
+        peak_time (float): Time of the peak in seconds after the start of the observation.
+        rise_time (float): Width (sigma) of the Gaussian rise in seconds.
+        decay_time (float): e-folding time of the decay in seconds.
+
+    Returns:
+        function: The count rate as a function of the time in seconds after the start of the observation."""
+    def profile(t):
+        t = np.asarray(t, dtype = float)
+        rise = np.exp(-0.5*((np.minimum(t, peak_time) - peak_time)/rise_time)**2)
+        decay = np.exp(-(np.maximum(t, peak_time) - peak_time)/decay_time)
+        return peak_rate*rise*decay
+    return profile
+
+def sdc_filename(start_time, duration, pixel_data = False, request_id = 0):
+    """File name in the format of the STIX data center, which *Spectrogram* relies on to tell L4 spectrograms from L1A pixel data.
+
+    Args:
+        start_time (datetime): Start of the observation.
+        duration (float): Length of the observation in seconds.
+        pixel_data (bool, optional): Defaults to False. Name of a L1A pixel data file instead of a L4 spectrogram.
+        request_id (int, optional): Defaults to 0. Data request ID.
+
+    Returns:
+        str: The file name."""
+    end_time = start_time + td(seconds = duration)
+    product = 'xray-l1' if pixel_data else 'spectrogram'
+    return f"solo_L1A_stix-sci-{product}-{request_id:010d}_{start_time:%Y%m%dT%H%M%S}-{end_time:%Y%m%dT%H%M%S}_000000_V01.fits"
+
+def _update_primary_header(header, fits_path, start_time, duration):
+    end_time = start_time + td(seconds = duration)
+    fmt = lambda t: dt.strftime(t, "%Y-%m-%dT%H:%M:%S.%f")[:-3]
+    header['FILENAME'] = os.path.basename(fits_path)
+    header['DATE'] = dt.strftime(dt.now(), "%Y-%m-%dT%H:%M:%S.%f")[:-3]
+    for key in ['DATE_OBS', 'DATE_BEG', 'DATEREF']:
+        header[key] = fmt(start_time)
+    header['DATE_AVG'] = fmt(start_time + td(seconds = duration/2.))
+    header['DATE_END'] = fmt(end_time)
+    header['DATE_EAR'] = fmt(start_time + td(seconds = header['EAR_TDEL']))
+    header['DATE_SUN'] = fmt(start_time - td(seconds = header['SUN_TIME']))
+    header['MJDREF'] = (np.datetime64(start_time, 'us') - _MJD_EPOCH)/np.timedelta64(1, 'D')
+    for key in ['OBT_BEG', 'OBT_END']:
+        header.remove(key, ignore_missing = True)
+    header.add_history('Synthetic data written by stix2xspec.synthetic')
+
+def write_synthetic_spectrogram(fits_path = None, duration = 3600., cadence = 4., pixel_data = False, start_time = '2022-07-23T12:00:00.000', profile = 'flare', peak_rate = 5e4, background_rate = 750., trigger_ratio = 1.3, rcr_thresholds = (2e4,), detector_mask = None, pixel_mask = None, energy_bin_mask = None, chunk_size = None, seed = None, overwrite = False):
+    """Write a synthetic L1A pixel data or L4 spectrogram FITS file, in the layout of the bundled samples (and so readable by *open_spec_fits* and *convert_spectrogram*), e.g. to test the conversion on inputs of a given size. The headers and the CONTROL and ENERGIES extensions are copied from the samples; the DATA rows are generated and written chunk by chunk, so memory use does not grow with the duration.
+
+    Counts are Poisson draws around a constant background and a time-variable flare component, with the spectra of the bundled samples, and are quantized and given errors like those of the onboard compression. Triggers are Poisson draws around trigger_ratio times the counts of all pixels and energies of the enabled detectors, per accumulator detector group for pixel data and in total for spectrograms. Whenever the total count rate exceeds one of rcr_thresholds the rate control regime (RCR) goes up by one, and from RCR 1 the flare counts are attenuated.
+
+    Args:
+        fits_path (str, optional): Defaults to None, i.e. the file name given by *sdc_filename* in the current directory. Full path of the output FITS file. The name of a L4 spectrogram must contain 'spectrogram', as files from the STIX data center do.
+        duration (float, optional): Defaults to 3600. Length of the observation in seconds.
+        cadence (float, optional): Defaults to 4. Duration of each time bin in seconds, e.g. 4 or 1.
+        pixel_data (bool, optional): Defaults to False. Write L1A pixel data (counts per detector, pixel and energy) instead of a L4 spectrogram (counts per energy).
+        start_time (str or datetime, optional): Defaults to '2022-07-23T12:00:00.000'. Start of the observation, as a datetime or in the format of DATE_BEG.
+        profile (str or function, optional): Defaults to 'flare'. Count rate of the flare component in counts/s, summed over all detectors, pixels and energies, as a function of the time in seconds after the start (see *flare_profile*), or 'flare' for a flare peaking at peak_rate a third of the way through the observation, or 'constant' for the background alone.
+        peak_rate (float, optional): Defaults to 5e4. Peak count rate of the 'flare' profile.
+        background_rate (float, optional): Defaults to 750, as in the bundled pixel data. Count rate of the background, which is not attenuated.
+        trigger_ratio (float, optional): Defaults to 1.3, as in the bundled samples. Ratio of triggers to counts.
+        rcr_thresholds (list, optional): Defaults to (2e4,). Increasing total count rates at which the RCR goes up by one. Empty for no RCR changes.
+        detector_mask (np.array, optional): Defaults to None, i.e. as in the sample file. Enabled (1) and disabled (0) detectors, 32 values.
+        pixel_mask (np.array, optional): Defaults to None, i.e. as in the sample file. Enabled pixels, 12 values.
+        energy_bin_mask (np.array, optional): Defaults to None, i.e. all 32 science energy channels. Enabled energy channels.
+        chunk_size (int, optional): Defaults to None, i.e. about 64 MB of rows. Number of time bins generated and written at once.
+        seed (int, optional): Defaults to None. Seed of the random number generator, for reproducible files.
+        overwrite (bool, optional): Defaults to False. Overwrite fits_path if it exists.
+
+    Returns:
+        str: Full path of the FITS file."""
+    if duration <= 0 or cadence <= 0:
+        raise ValueError("Parameters 'duration' and 'cadence' must be positive")
+    rcr_thresholds = np.sort(np.atleast_1d(np.asarray(rcr_thresholds, dtype = float)))
+    if rcr_thresholds.size > 7:
+        raise ValueError("At most 7 RCR thresholds can be given, RCR goes from 0 to 7")
+    if isinstance(start_time, str):
+        start_time = dt.strptime(start_time, "%Y-%m-%dT%H:%M:%S.%f")
+    if fits_path is None:
+        fits_path = sdc_filename(start_time, duration, pixel_data = pixel_data)
+    if ('spectrogram' in os.path.basename(fits_path)) == pixel_data:
+        raise ValueError(f"The file name {fits_path} must contain 'spectrogram' if and only if it is a L4 spectrogram, see *sdc_filename*")
+    if os.path.exists(fits_path) and not overwrite:
+        raise OSError(f"File {fits_path} already exists. If you mean to replace it then use the argument overwrite = True.")
+    if profile == 'flare':
+        profile = flare_profile(peak_rate, duration/3., duration/30., duration/6.)
+    elif profile == 'constant':
+        profile = lambda t: np.zeros(np.shape(t))
+    elif not callable(profile):
+        raise ValueError(f"Unknown profile {profile}, expected 'flare', 'constant' or a function")
+
+    primary, control, data, energies = _sample_hdus(L1A_TEMPLATE if pixel_data else L4_TEMPLATE)
+    _update_primary_header(primary.header, fits_path, start_time, duration)
+    if detector_mask is None:
+        detector_mask = control.data['detector_mask'][0] if not pixel_data else data.data['detector_masks'][0]
+    if pixel_mask is None:
+        pixel_mask = control.data['pixel_mask'][0] if not pixel_data else np.sum(data.data['pixel_masks'][0], axis = 0)
+    if energy_bin_mask is None:
+        energy_bin_mask = np.ones(32)
+    detector_mask, pixel_mask, energy_bin_mask = [(np.asarray(m) > 0).astype(np.uint8) for m in (detector_mask, pixel_mask, energy_bin_mask)]
+    control.data['energy_bin_mask'][:] = energy_bin_mask
+    if not pixel_data:
+        control.data['detector_mask'][:] = detector_mask
+        control.data['pixel_mask'][:] = pixel_mask
+    counts_m = control.data['compression_scheme_counts_skm'][0][2]
+    triggers_m = control.data['compression_scheme_triggers_skm'][0][2]
+
+    #expected counts and triggers per unit count rate, summed as in the output file
+    background, flare = _sample_shapes()
+    counted = detector_mask[:,None,None]*pixel_mask[None,:,None]*energy_bin_mask[None,None,:]
+    shape_bk, shape_fl = background*counted, flare*counted
+    if pixel_data:
+        groups = (_detector_adg_index()[None,:] == np.arange(1, 17)[:,None]).astype(float)
+    else:
+        shape_bk, shape_fl = np.sum(shape_bk, axis = (0,1)), np.sum(shape_fl, axis = (0,1))
+        groups = np.ones((1,32))
+    triggers_bk = groups @ (np.sum(background, axis = (1,2))*detector_mask)
+    triggers_fl = groups @ (np.sum(flare, axis = 1)*detector_mask[:,None])
+    transmission = attenuator_transmission(energies.data['e_low'], energies.data['e_high'])
+
+    n_rows = int(np.ceil(duration/cadence))
+    row_dtype = data.columns.dtype.newbyteorder('>')
+    header = data.header.copy()
+    header['NAXIS2'] = n_rows
+    if chunk_size is None:
+        chunk_size = max(1, _CHUNK_BYTES // row_dtype.itemsize)
+    template_row = data.data[:1]
+    rng = np.random.default_rng(seed)
+
+    with open(fits_path, 'wb') as f:
+        fits.HDUList([fits.PrimaryHDU(header = primary.header), control]).writeto(f)
+        f.write(header.tostring().encode('ascii'))
+        for first in range(0, n_rows, chunk_size):
+            n = min(chunk_size, n_rows - first)
+            rows = np.zeros(n, dtype = row_dtype)
+            for name in ['num_pixel_sets', 'num_energy_groups', 'control_index']:
+                if name in row_dtype.names:
+                    rows[name] = template_row[name][0]
+            rows['time'] = (first + np.arange(n) + 0.5)*cadence
+            rows['timedel'] = cadence
+            flare_rate = np.asarray(profile(rows['time']), dtype = float)
+            rows['rcr'] = np.searchsorted(rcr_thresholds, background_rate + flare_rate, side = 'right')
+            flare_rate = flare_rate[:,None]*np.where(rows['rcr'][:,None] > 0, transmission, 1.) #per energy
+            expected = background_rate*shape_bk + (flare_rate[:,None,None,:] if pixel_data else flare_rate)*shape_fl
+            rows['counts'], rows['counts_err'] = compress_counts(rng.poisson(expected*cadence), counts_m)
+            triggers = rng.poisson(trigger_ratio*cadence*(background_rate*triggers_bk + flare_rate @ triggers_fl.T))
+            triggers, triggers_err = compress_counts(triggers if pixel_data else triggers[:,0], triggers_m)
+            rows['triggers'], rows['triggers_err'] = triggers, triggers_err
+            if pixel_data:
+                rows['pixel_masks'] = np.diag(pixel_mask)
+                rows['detector_masks'] = detector_mask
+            f.write(rows.tobytes())
+        f.write(b'\0'*(-n_rows*row_dtype.itemsize % 2880)) #pad to a full FITS block
+    with fits.open(fits_path, mode = 'append') as hdul:
+        hdul.append(energies)
+    return os.path.abspath(fits_path)
@@ -0,0 +1,179 @@
+import numpy as np
+from .fitting import bin_photon_flux
+from .response import ResponseMatrix
+from .spectrogram_utils import match_energies
+
+class ThermalGrid:
+    """Count rates of isothermal bremsstrahlung models (and optionally power laws) over a grid of temperatures (and photon indices), folded through the STIX SRM once and stored on disk. *estimate* then fits the temperature and emission measure of every time bin of a spectrogram at once: the model normalizations are linear, so for each grid point they follow in closed form from weighted sums over channels, the best grid point is refined by parabolic interpolation of chi-squared in log(kT), and the normalizations are solved again at the interpolated temperature.
+
+    The thermal model is the free-free continuum of *fitting.thermal_bremsstrahlung*; see *fitting.SpectrumFitter* for full fits of selected intervals."""
+    def __init__(self, kT, thermal, e_min, e_max, index = None, power_law = None):
+        """
+        Args:
+            kT (np.array): Temperatures of the grid in keV, in increasing order.
+            thermal (np.array): Count rate per channel for an emission measure of 1e49 cm^-3, n_kT x n_channels.
+            e_min (np.array): Lower edges of the channels (keV).
+            e_max (np.array): Upper edges of the channels (keV).
+            index (np.array, optional): Defaults to None. Photon indices of the power-law grid.
+            power_law (np.array, optional): Defaults to None. Count rate per channel for a power law of unit flux at 1 keV, n_index x n_channels."""
+        self.kT = np.asarray(kT, dtype = float)
+        if np.any(np.diff(self.kT) <= 0):
+            raise ValueError("Parameter 'kT' must be in increasing order")
+        self.thermal = np.asarray(thermal, dtype = float)
+        self.e_min = np.asarray(e_min, dtype = float)
+        self.e_max = np.asarray(e_max, dtype = float)
+        self.index = None if index is None or np.size(index) == 0 else np.asarray(index, dtype = float)
+        self.power_law = None if self.index is None else np.asarray(power_law, dtype = float)
+
+    @classmethod
+    def compute(cls, srm_file = "stx_srm_full.fits", kT = None, index = None):
+        """Fold the model grid through a response.
+
+        Args:
+            srm_file (str, optional): Defaults to "stx_srm_full.fits". Full path to the SRM file, or the name of a file in stix2xspec.data. The full SRM serves spectrograms with any subset of its channels.
+            kT (np.array, optional): Defaults to None, in which case 181 temperatures logarithmically spaced from 0.5 to 5 keV (about 6 to 58 MK) are used. Temperatures of the grid in keV.
+            index (np.array, optional): Defaults to None, i.e. thermal models only. Photon indices of the power-law grid, e.g. np.arange(2, 10.1, 0.25).
+
+        Returns:
+            ThermalGrid: The grid."""
+        response = ResponseMatrix.from_fits(srm_file)
+        kT = np.geomspace(0.5, 5., 181) if kT is None else np.asarray(kT, dtype = float)
+        thermal = response.fold(bin_photon_flux(response.energ_lo, response.energ_hi, ['thermal'], [np.column_stack([kT, np.ones_like(kT)])]))
+        power_law = None
+        if index is not None:
+            index = np.asarray(index, dtype = float)
+            power_law = response.fold(bin_photon_flux(response.energ_lo, response.energ_hi, ['powerlaw'], [np.column_stack([np.ones_like(index), index])]))
+        return cls(kT, thermal, response.e_min, response.e_max, index = index, power_law = power_law)
+
+    def save(self, filename):
+        """Store the grid in a .npz file.
+
+        Args:
+            filename (str): Name of the file."""
+        np.savez(filename, kT = self.kT, thermal = self.thermal, e_min = self.e_min, e_max = self.e_max, index = np.zeros(0) if self.index is None else self.index, power_law = np.zeros((0, self.e_min.size)) if self.power_law is None else self.power_law)
+
+    @classmethod
+    def load(cls, filename):
+        """Read a grid stored with *save*.
+
+        Args:
+            filename (str): Name of the .npz file.
+
+        Returns:
+            ThermalGrid: The grid."""
+        with np.load(filename) as stored:
+            return cls(stored['kT'], stored['thermal'], stored['e_min'], stored['e_max'], index = stored['index'], power_law = stored['power_law'])
+
+    @staticmethod
+    def _solve(a_m, b_mm, a_p = None, b_pp = None, b_mp = None):
+        """Non-negative weighted least-squares normalizations of one or two templates m and p, in closed form from the sums a_x = sum(weight x rate x x) and b_xy = sum(weight x x x y) over channels.
+
+        Returns:
+            tuple: Normalizations (one array per template) and the chi-squared reduction, i.e. chi-squared is sum(weight x rate**2) minus it."""
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            only_m = np.where(b_mm > 0, np.clip(a_m, 0, None)/b_mm, 0.)
+        if a_p is None:
+            return (only_m,), only_m*a_m
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            det = b_mm*b_pp - b_mp**2
+            norm_m = (a_m*b_pp - a_p*b_mp)/det
+            norm_p = (a_p*b_mm - a_m*b_mp)/det
+            only_p = np.where(b_pp > 0, np.clip(a_p, 0, None)/b_pp, 0.)
+        both = np.isfinite(norm_m) & np.isfinite(norm_p) & (norm_m >= 0) & (norm_p >= 0)
+        use_m = only_m*a_m >= only_p*a_p #otherwise the better of the single-template fits
+        norm_m = np.where(both, norm_m, np.where(use_m, only_m, 0.))
+        norm_p = np.where(both, norm_p, np.where(use_m, 0., only_p))
+        return (norm_m, norm_p), norm_m*a_m + norm_p*a_p
+
+    def estimate(self, rate, stat_err, e_min, sys_err = None, Erange = [4.,10.], energy_shift = 0, block_size = 256):
+        """Fit every row (time bin) of a rate array against the grid.
+
+        Args:
+            rate (np.array): Count rates, n_times x n_channels.
+            stat_err (np.array): Statistical errors of the rates.
+            e_min (np.array): Lower channel edges of the rates (keV), used to find the corresponding grid channels.
+            sys_err (np.array, optional): Defaults to None, i.e. zero. Fractional systematic errors, added in quadrature.
+            Erange (list or tuple, optional): Defaults to [4.,10.]. Energy range (keV) of the channels used.
+            energy_shift (float, optional): Defaults to 0. Energy shift in keV of the rate channels relative to the SRM channels, see *Spectrogram.energy_shift*.
+            block_size (int, optional): Defaults to 256. Number of time bins searched at a time with a power-law grid, which bounds the size of the intermediate (time bins x kT x index) arrays.
+
+        Returns:
+            dict: 'kT' (keV), 'EM' (1e49 cm^-3), 'chisq', 'dof' and 'at_grid_edge' (True where the best temperature is the first or last of the grid, so not refined), each of length n_times. With a power-law grid also 'index' and 'norm'."""
+        channels, matched = match_energies(e_min, self.e_min + energy_shift)
+        if not matched.all():
+            raise ValueError("Energy channels of the rates are not all in the grid")
+        rate = np.atleast_2d(np.asarray(rate, dtype = float))
+        variance = np.atleast_2d(stat_err)**2 + (0. if sys_err is None else (np.asarray(sys_err)*rate)**2)
+        e_mean = (self.e_min[channels] + self.e_max[channels])/2.
+        use = (e_mean >= Erange[0]) & (e_mean <= Erange[1]) & (variance > 0) & np.isfinite(rate)
+        with np.errstate(divide = 'ignore'):
+            weight = np.where(use, 1./variance, 0.)
+        data = np.where(use, rate, 0.)
+        target = weight*data
+        total = np.sum(target*data, axis = 1)
+        thermal = self.thermal[:,channels]
+
+        #chi-squared at every grid point, all time bins at once
+        a_m, b_mm = target @ thermal.T, weight @ (thermal**2).T
+        if self.index is None:
+            _, reduction = self._solve(a_m, b_mm)
+            best_index = None
+        else:
+            power_law = self.power_law[:,channels]
+            a_p, b_pp = target @ power_law.T, weight @ (power_law**2).T
+            best_index = np.zeros(rate.shape[0], dtype = int)
+            reduction = np.zeros(a_m.shape)
+            for i in range(0, rate.shape[0], block_size):
+                block = slice(i, i + block_size)
+                b_mp = (weight[block,None,:]*thermal[None,:,:]) @ power_law.T
+                _, block_reduction = self._solve(a_m[block,:,None], b_mm[block,:,None], a_p[block,None,:], b_pp[block,None,:], b_mp)
+                best_index[block] = np.argmax(block_reduction.max(axis = 1), axis = 1)
+                reduction[block] = np.take_along_axis(block_reduction, best_index[block,None,None], axis = 2)[:,:,0]
+        chisq = total[:,None] - reduction
+
+        #parabolic refinement of the best temperature in log(kT)
+        n_kT = self.kT.size
+        best = np.argmin(chisq, axis = 1)
+        at_edge = (best == 0) | (best == n_kT - 1)
+        k = np.clip(best, 1, n_kT - 2)
+        x = np.log(self.kT)[np.stack([k - 1, k, k + 1])]
+        y = np.take_along_axis(chisq, np.stack([k - 1, k, k + 1]).T, axis = 1).T
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            numerator = (x[1] - x[0])**2*(y[1] - y[2]) - (x[1] - x[2])**2*(y[1] - y[0])
+            denominator = (x[1] - x[0])*(y[1] - y[2]) - (x[1] - x[2])*(y[1] - y[0])
+            log_kT = x[1] - 0.5*numerator/denominator
+        log_kT = np.where(at_edge | ~np.isfinite(log_kT), np.log(self.kT[best]), np.clip(log_kT, x[0], x[2]))
+        kT = np.exp(log_kT)
+
+        #normalizations at the interpolated temperature, from the template interpolated linearly in log(kT)
+        upper = np.clip(np.searchsorted(self.kT, kT), 1, n_kT - 1)
+        fraction = ((log_kT - np.log(self.kT[upper - 1]))/(np.log(self.kT[upper]) - np.log(self.kT[upper - 1])))[:,None]
+        template = (1 - fraction)*thermal[upper - 1] + fraction*thermal[upper]
+        a_m, b_mm = np.sum(target*template, axis = 1), np.sum(weight*template**2, axis = 1)
+        if self.index is None:
+            (EM,), reduction = self._solve(a_m, b_mm)
+            n_params = 2
+        else:
+            p = power_law[best_index]
+            (EM, norm), reduction = self._solve(a_m, b_mm, np.sum(target*p, axis = 1), np.sum(weight*p**2, axis = 1), np.sum(weight*template*p, axis = 1))
+            n_params = 4
+        result = {'kT': kT, 'EM': EM, 'chisq': total - reduction, 'dof': use.sum(axis = 1) - n_params, 'at_grid_edge': at_edge}
+        if self.index is not None:
+            result['index'] = self.index[best_index]
+            result['norm'] = norm
+        return result
+
+    def estimate_spectrogram(self, spec, Erange = [4.,10.]):
+        """Fit every time bin of a converted (background-subtracted) Spectrogram, see *stix2xspec.convert_spectrogram*.
+
+        Args:
+            spec (stix2xspec.Spectrogram): The converted spectrogram.
+            Erange (list or tuple, optional): Defaults to [4.,10.]. Energy range (keV) of the channels used.
+
+        Returns:
+            dict: As *estimate*, plus 'time' (bin centers as datetime64)."""
+        if not "counts_to_rate" in spec.history:
+            spec._counts_to_rate()
+        result = self.estimate(spec.rate, spec.stat_err, spec.e_axis.low, sys_err = spec._energy_dependent_sys_err(), Erange = Erange, energy_shift = spec.energy_shift)
+        result['time'] = spec.t_axis.time_mean_dt64
+        return result
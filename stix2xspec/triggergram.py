@@ -1,7 +1,4 @@
-import pandas as pd
 import numpy as np
-import os
-from datetime import datetime as dt
 
 class Triggergram:
     """This creates a class containing the triggergram data with its time and accumulator axes. Translation of *stx_triggergram.pro*"""
@@ -24,7 +21,7 @@ class Triggergram:
             raise ValueError("Parameter 'triggerdata' must be a 16 x M or 1 x M int array")
         if self.t_axis.type != 'stx_time_axis':
             raise TypeError("Parameter 't_axis' must be a stx_time_axis object")
-        if len(triggerdata.shape) == 2 and triggerdata.shape[1] != len(self.t_axis.time_mean):
+        if len(triggerdata.shape) == 2 and triggerdata.shape[1] != len(self.t_axis):
             raise ValueError("'t_axis' dimensions do not agree with 'triggerdata' dimensions")
             
     def calc_triggerdata(self, triggerdata):
@@ -1,31 +1,35 @@
-import pandas as pd
 import os
 import numpy as np
 from datetime import datetime as dt
-import glob
 #from .spectrogram_utils import *
 from astropy.io import fits
-from astropy.table import Table
-from astropy.time import Time
 #from .spectrogram import Spectrogram
 #from .spectrogram_axes import stx_energy_axis, stx_time_axis
 
-def make_stix_header(spec, hdr = None, primary = False, respfile=None,extname=''):
+def run_header_values():
+    """File creation date and observer. Determine them once per file and pass them to *make_stix_header* for each of its headers, so that they agree and the clock and environment are not queried for every header.
+    
+    Returns:
+        tuple: DATE and OBSERVER keyword values."""
+    return dt.strftime(dt.now(),"%Y-%m-%dT%H:%M:%S"), os.environ.get('USER', 'Unknown')
+
+def make_stix_header(spec, hdr = None, primary = False, respfile=None,extname='', run_values = None):
     """Make the primary header and default headers for all HDUs.
     
     Args:
         spec (stix2xspec.Spectrogram): Input spectrogram to make FITS headers for.
-        hdr (astropy.header, optional): Defaults to None. Input header to modify.
+        hdr (astropy.header, optional): Defaults to None. Input header to modify. Pass an empty header to get the extension keywords only, e.g. as a template for *table_header*.
         primary (bool, optional): Defaults to False. True if the desired header is the primary header.
         respfile (str, optional): Response file name.
         extname (str, optional): Defaults to empty string. Name of the FITS extension.
+        run_values (tuple, optional): Defaults to None, in which case they are determined now. DATE and OBSERVER keyword values, see *run_header_values*.
     
     Returns:
         astropy.header: FITS header."""
-    if not hdr:
+    if hdr is None:
         hdu = fits.PrimaryHDU()
         hdr = hdu.header
-    else:
+    elif 'TFIELDS' in hdr:
         hdr.set("COMMENT",  "*** End of mandatory fields ***", after = "TFIELDS")
         #sort columns by formats then names, put at end (to do later)
     
@@ -40,12 +44,9 @@ def make_stix_header(spec, hdr = None, primary = False, respfile=None,extname=''
             elut_filename = spec.elut_filename[spec.elut_filename.rfind('/')+1:]
         hdr.set('ELUT_FILENAME', elut_filename, "Filename of ELUT")
 
-    hdr.set('DATE', dt.strftime(dt.now(),"%Y-%m-%dT%H:%M:%S"), 'File creation date (YYYY-MM-DDThh:mm:ss UTC)')
+    date, observer = run_header_values() if run_values is None else run_values
+    hdr.set('DATE', date, 'File creation date (YYYY-MM-DDThh:mm:ss UTC)')
     hdr.set('ORIGIN', 'STIX','Spectrometer Telescope for Imaging X-rays')
-    try:
-        observer = os.environ['USER']
-    except KeyError:
-        observer = 'Unknown'
     hdr.set('OBSERVER', observer,'Usually the name of the user who generated file')
     hdr.set('TELESCOP', 'Solar Orbiter', 'Name of the Telescope or Mission')
     hdr.set('INSTRUME', 'STIX', 'Name of the instrument')
@@ -95,7 +96,16 @@ def make_rate_header(rate_header,spec,respfile=None):
     Returns:
         astropy.header: FITS header."""
     hdr = make_stix_header(spec, hdr=rate_header, respfile=respfile, extname='RATE')
+    return set_rate_keywords(hdr, spec)
 
+def set_rate_keywords(hdr, spec):
+    """Set the keywords specific to the Rate HDU, i.e. those of *make_rate_header* that are not in *make_stix_header*.
+    Args:
+        hdr (astropy.header): Header to update in place.
+        spec (stix2xspec.Spectrogram): Input spectrogram to make FITS headers for.
+    
+    Returns:
+        astropy.header: FITS header."""
     hdr.set('TIMEREF','LOCAL','Reference frame for the times')
     hdr.set('MJDREF',43874.0,'TIMESYS in MJD (d)')
     
@@ -145,6 +155,41 @@ def make_rate_header(rate_header,spec,respfile=None):
 
     return hdr
 
+def table_header(data, template = None, extname = ''):
+    """Make the header of a binary table extension holding a structured array, with the table layout keywords derived from the array dtype followed by the cards of a template header.
+    
+    Args:
+        data (np.array): Structured array with big-endian fields, as written to the file.
+        template (astropy.header, optional): Defaults to None. Keywords common to all extensions, e.g. from *make_stix_header* with an empty header. Copied, not modified.
+        extname (str, optional): Defaults to empty string. Name of the FITS extension.
+    
+    Returns:
+        astropy.header: FITS header."""
+    hdr = fits.BinTableHDU(data = data[:0]).header
+    hdr['NAXIS2'] = len(data)
+    hdr.set("COMMENT",  "*** End of mandatory fields ***", after = "TFIELDS")
+    if template is not None:
+        hdr.extend(template.copy())
+    hdr.set('EXTNAME', extname, 'Extension name')
+    return hdr
+
+def write_fits_buffered(fitsfilename, primary_header, tables, overwrite = False):
+    """Write a FITS file with an empty primary HDU and binary table extensions of structured arrays in one call, without building HDU objects.
+    
+    Args:
+        fitsfilename (str): Name of the FITS file to be written.
+        primary_header (astropy.header): Header of the primary HDU.
+        tables (list): (header, data) pairs, see *table_header*. The data must have big-endian fields.
+        overwrite (bool, optional): Defaults to False. Overwrite fitsfilename if it exists."""
+    if os.path.exists(fitsfilename) and not overwrite:
+        raise OSError(f"File {fitsfilename} already exists. If you mean to replace it then use the argument overwrite = True.")
+    blocks = [primary_header.tostring().encode('ascii')]
+    for hdr, data in tables:
+        data_bytes = np.ascontiguousarray(data).tobytes()
+        blocks += [hdr.tostring().encode('ascii'), data_bytes, b'\0'*(-len(data_bytes) % 2880)] #pad to a full FITS block
+    with open(fitsfilename, 'wb') as f:
+        f.write(b''.join(blocks))
+
 def ogip_time_calcs(spec):
     """ Calculate time parameters to be written into the FITS file.
     
@@ -159,8 +204,7 @@ def ogip_time_calcs(spec):
 #    timedel = float( reform( ut[1,*] - ut[0,*] ) )
 #    timecen = double( reform( ut[0,*] + timedel/2.0 ) )
 #    exposure = total( timedel*livetime )
-    #use datetimes in t_axis...(will this write to FITS correctly?)
-    timecen = np.array(spec.t_axis.time_mean) #datetimes
+    timecen = spec.t_axis.time_mean_mjd #MJD
 
     factor = 1
     #units for L1 are centiseconds
@@ -174,3 +218,133 @@ def ogip_time_calcs(spec):
     exposure = np.sum((spec.data['timedel']/factor)*spec.eff_livetime_fraction)
 
     return {"specnum": specnum, "channel": channel, "timedel": spec.data['timedel']/factor, "timecen": timecen, "exposure": exposure}
+
+class PHA2Writer:
+    """Write many spectra into a single OGIP type II PHA file, one row per spectrum. Rows are appended to the file as they come, so the full set of spectra never has to be held in memory. The SPECTRUM extension is followed by one energy band table and one attenuator state table shared by all rows, and all rows refer to the same response file.
+    
+    Times in the TSTART and TSTOP columns and in the TSTARTI/F and TSTOPI/F keywords are in days relative to MJDREF (taken from rate_header, 0 if it has none), with TIMEZERO 0. ONTIME is the summed exposure of all rows.
+    
+    Use as a context manager, e.g.::
+    
+        with PHA2Writer('spectra.fits', n_channels, energy_hdu = energy_hdu, respfile = 'stx_srm.fits') as writer:
+            writer.append(rate, stat_err, exposure, tstart, tstop)
+    """
+    #keywords that describe the table layout and are set by the writer rather than copied from a template header
+    _STRUCTURAL_KEYWORDS = ('XTENSION', 'BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2', 'PCOUNT', 'GCOUNT', 'TFIELDS', 'EXTNAME', 'EXPOSURE', 'ONTIME')
+    _STRUCTURAL_PREFIXES = ('TTYPE', 'TFORM', 'TUNIT', 'TDIM', 'TNULL', 'TSCAL', 'TZERO', 'TDISP')
+    
+    def __init__(self, fitsfilename, n_channels, primary_header = None, rate_header = None, energy_hdu = None, att_hdu = None, respfile = None, overwrite = False):
+        """Args:
+            fitsfilename (str): Name of the output FITS file.
+            n_channels (int): Number of energy channels per spectrum.
+            primary_header (astropy.header, optional): Defaults to None. Header of the primary HDU.
+            rate_header (astropy.header, optional): Defaults to None. Template for the SPECTRUM extension header, e.g. the RATE header of a converted file. Table layout keywords are not copied.
+            energy_hdu (astropy.io.fits.BinTableHDU, optional): Defaults to None. Energy band table, written once after the spectra.
+            att_hdu (astropy.io.fits.BinTableHDU, optional): Defaults to None. Attenuator state table, written once after the energy band table.
+            respfile (str, optional): Defaults to None, in which case RESPFILE is taken from rate_header. Response file used for all rows.
+            overwrite (bool, optional): Defaults to False. Overwrite fitsfilename if it exists."""
+        self.fitsfilename = fitsfilename
+        self.n_channels = n_channels
+        self.energy_hdu = energy_hdu
+        self.att_hdu = att_hdu
+        self.n_rows = 0
+        self.ontime = 0.
+        self._time_range = [np.inf, -np.inf]
+        self.row_dtype = np.dtype([('SPEC_NUM', '>i4'), ('CHANNEL', '>i4', (n_channels,)), ('RATE', '>f8', (n_channels,)), ('STAT_ERR', '>f8', (n_channels,)), ('SYS_ERR', '>f8', (n_channels,)), ('LIVETIME', '>f8'), ('EXPOSURE', '>f8'), ('TSTART', '>f8'), ('TSTOP', '>f8'), ('TIMEDEL', '>f8')])
+        self.header = self._make_header(rate_header, respfile)
+        self.mjdref = self.header.get('MJDREF', 0.)
+        
+        if os.path.exists(fitsfilename) and not overwrite:
+            raise OSError(f"File {fitsfilename} already exists. If you mean to replace it then use the argument overwrite = True.")
+        self._file = open(fitsfilename, 'wb')
+        fits.PrimaryHDU(header = primary_header).writeto(self._file)
+        self._header_offset = self._file.tell()
+        self._file.write(self.header.tostring().encode('ascii'))
+        
+    def _make_header(self, rate_header, respfile):
+        hdr = fits.BinTableHDU(data = np.zeros(0, dtype = self.row_dtype), name = 'SPECTRUM').header
+        if rate_header is not None:
+            for card in rate_header.cards:
+                if card.keyword in self._STRUCTURAL_KEYWORDS or card.keyword.startswith(self._STRUCTURAL_PREFIXES) or card.keyword in ('', 'COMMENT', 'HISTORY'):
+                    continue
+                hdr.set(card.keyword, card.value, card.comment)
+            hdr.remove('HDUCALS3', ignore_missing = True) #misspelt in older files
+        for col, unit in [('RATE', 'counts/s'), ('STAT_ERR', 'counts/s'), ('EXPOSURE', 's'), ('TSTART', 'd'), ('TSTOP', 'd'), ('TIMEDEL', 's')]:
+            hdr.set(f"TUNIT{self.row_dtype.names.index(col) + 1}", unit, after = f"TFORM{self.row_dtype.names.index(col) + 1}")
+        hdr.set('HDUCLASS', 'OGIP', 'File conforms to OGIP/GSFC convention')
+        hdr.set('HDUCLAS1', 'SPECTRUM', 'File contains spectra')
+        hdr.set('HDUCLAS2', 'TOTAL', 'Extension contains total spectra')
+        hdr.set('HDUCLAS3', 'RATE', 'Extension contains rates')
+        hdr.set('HDUCLAS4', 'TYPE:II', 'Multiple PHA files contained')
+        hdr.set('HDUVERS', '1.2.1', 'File conforms to this version of OGIP')
+        hdr.set('DETCHANS', self.n_channels, 'Total number of detector channels available')
+        hdr.set('CHANTYPE', 'PI', 'Channels assigned by detector electronics')
+        hdr.set('POISSERR', False, 'Poissonian errors not applicable')
+        if respfile is not None:
+            hdr.set('RESPFILE', respfile, 'Response file used for all spectra')
+        hdr.set('TIMEZERO', 0., 'Times are relative to MJDREF')
+        for key in ['TSTARTI', 'TSTOPI']: #updated in close()
+            hdr.set(key, int(hdr.get(key, 0)))
+        for key in ['TSTARTF', 'TSTOPF']:
+            hdr.set(key, float(hdr.get(key, 0.)))
+        hdr.set('ONTIME', 0., 'Summed exposure of all spectra in seconds')
+        return hdr
+        
+    def append(self, rate, stat_err, exposure, tstart, tstop, sys_err = None, livetime = None, timedel = None):
+        """Append one spectrum, or several if the arguments have a leading row axis, to the file.
+        
+        Args:
+            rate (np.array): Count rate per channel.
+            stat_err (np.array): Statistical error of the count rate.
+            exposure (float or np.array): Exposure time in seconds.
+            tstart (float or np.array): Start time in MJD. Written relative to MJDREF.
+            tstop (float or np.array): End time in MJD. Written relative to MJDREF.
+            sys_err (np.array, optional): Defaults to None, in which case it is zero. Fractional systematic error.
+            livetime (float or np.array, optional): Defaults to None, in which case it is 1. Livetime fraction.
+            timedel (float or np.array, optional): Defaults to None, in which case it is (tstop - tstart) in seconds. Duration in seconds."""
+        rate = np.atleast_2d(rate)
+        if rate.shape[1] != self.n_channels:
+            raise ValueError(f"Expected {self.n_channels} channels, got {rate.shape[1]}")
+        rows = np.zeros(rate.shape[0], dtype = self.row_dtype)
+        rows['SPEC_NUM'] = self.n_rows + 1 + np.arange(rows.size)
+        rows['CHANNEL'] = np.arange(self.n_channels)
+        rows['RATE'] = rate
+        rows['STAT_ERR'] = np.atleast_2d(stat_err)
+        rows['SYS_ERR'] = 0. if sys_err is None else np.atleast_2d(sys_err)
+        rows['LIVETIME'] = 1. if livetime is None else livetime
+        rows['EXPOSURE'] = exposure
+        rows['TSTART'] = np.asarray(tstart) - self.mjdref
+        rows['TSTOP'] = np.asarray(tstop) - self.mjdref
+        rows['TIMEDEL'] = (rows['TSTOP'] - rows['TSTART'])*86400. if timedel is None else timedel
+        self._file.write(rows.tobytes())
+        self.n_rows += rows.size
+        self.ontime += float(rows['EXPOSURE'].sum())
+        self._time_range = [min(self._time_range[0], rows['TSTART'].min()), max(self._time_range[1], rows['TSTOP'].max())]
+        
+    def close(self):
+        """Finish the SPECTRUM extension and write the shared energy band and attenuator tables."""
+        if self._file.closed:
+            return
+        data_size = self.n_rows*self.row_dtype.itemsize
+        self._file.write(b'\0'*(-data_size % 2880)) #pad to a full FITS block
+        self.header['NAXIS2'] = self.n_rows
+        self.header['ONTIME'] = self.ontime
+        if self.n_rows:
+            for key, value in [('TSTART', self._time_range[0]), ('TSTOP', self._time_range[1])]:
+                frac, whole = np.modf(value)
+                self.header[f"{key}I"] = int(whole)
+                self.header[f"{key}F"] = float(frac)
+        self._file.seek(self._header_offset)
+        self._file.write(self.header.tostring().encode('ascii')) #same length as before, only values changed
+        self._file.close()
+        extra_hdus = [hdu for hdu in (self.energy_hdu, self.att_hdu) if hdu is not None]
+        if extra_hdus:
+            with fits.open(self.fitsfilename, mode = 'append') as hdul:
+                for hdu in extra_hdus:
+                    hdul.append(hdu.copy())
+                    
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
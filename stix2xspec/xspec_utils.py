@@ -1,64 +1,105 @@
 import numpy as np
-import pandas as pd
+import time
+import importlib
+import importlib.util
 #import matplotlib.pyplot as plt
 
 from datetime import datetime as dt
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-from IPython.display import Markdown
 from astropy.io import fits
 from astropy.time import Time
-from astropy.table import Table
+from itertools import islice
+from .write_spectrum2fits import PHA2Writer
+from .rate_index import prefix_sums
+from .jobs import map_jobs, run_reported
+from .instrumentation import stage
 
-def spectrum_from_time_interval(original_fitsfile, start_time, end_time, out_fitsname=None):
-    """Write average count rate over selected time interval to new FITS file for fitting with XSPEC.
+def _rate_time_mjd(time_bin_center, rate_header):
+    """Bin centers of the rate table in MJD. Older files store TIME in seconds since TIMEZERO + MJDREF instead of in MJD."""
+    year = Time(time_bin_center[0], format='mjd').datetime.year
+    if year < 2020 or year > dt.now().year: #fix the time
+        return rate_header['TIMEZERO'] + rate_header['MJDREF'] + np.asarray(time_bin_center)/86400.
+    return np.asarray(time_bin_center)
+
+def _interval_default_fitsname(original_fitsfile, start_time, end_time):
+    import pandas as pd
+    return f"{original_fitsfile[:-5]}_{pd.to_datetime(start_time):%H%M%S}-{pd.to_datetime(end_time):%H%M%S}.fits"
+
+def read_rate_table(original_fitsfile):
+    """Read the rate table of a converted FITS file once, for use with *average_time_intervals* and *time_intervals_to_pha2*.
     
     Args:
-        original_fitsfile (str): Name of FITS file from which to get the spectrum.
-        start_time (str, datetime, int, float): Start time in format readable by astropy.Time.
-        end_time (str, datetime, int, float): End time in format readable by astropy.Time.
-        out_fitsname (str): Name of output FITS file. Defaults to None."""
-    reference_fits = fits.open(original_fitsfile)
-    primary_HDU = reference_fits[0] #header = reference_fits[0].header.copy()
-    rate_header = reference_fits[1].header.copy()
-    #energy_header = reference_fits[2].header.copy()
-    rate_data = reference_fits[1].data.copy()
-    #energy_data = reference_fits[2].data.copy()
-    energy_HDU = reference_fits[2]
-    nchan = len(rate_data['CHANNEL'][0])
-
-    #time axis
-    duration_seconds = rate_data['TIMEDEL'] #seconds
-    duration_day = duration_seconds/86400
-    time_bin_center = rate_data['TIME']
-    if Time(time_bin_center[0], format='mjd').datetime.year < 2020 or Time(time_bin_center[0], format='mjd').datetime.year > dt.now().year: #fix the time
-        #compare time axis
-        tt = Time([Time(rate_header['TIMEZERO']+rate_header['MJDREF'], format='mjd').datetime + td(seconds = t) for t in time_bin_center])
-        time_bin_center = tt.mjd
-
-    t_start = Time([bc - d/2. for bc,d in zip(time_bin_center, duration_day)], format='mjd')
-    t_end = Time([bc + d/2. for bc,d in zip(time_bin_center, duration_day)], format='mjd')
-    t_mean = Time(time_bin_center, format='mjd')
-    
-    #index times that fall within selected interval
-    tstart = Time(start_time)
-    tend = Time(end_time)
-    tselect = np.where(np.logical_and(time_bin_center >= tstart.mjd,time_bin_center < tend.mjd)) #boolean mask
-    #ttimes = time_bin_center[tselect] #actual times
-    #print(f"tselect {tselect[0][0]} {tselect[0][-1]}")
-    exposure =  np.sum(rate_data['TIMEDEL'][tselect[0]]*rate_data['LIVETIME'][tselect[0]])
-
-    #rate data
-    avg_counts = np.array([np.mean(rate_data['RATE'][tselect],axis=0)]).reshape((1,nchan)) #mean since it's already a rate
-    #print(f"max counts: {np.max(total_counts)}")
-    
-    #average livetime data - same number for each channel
-    avg_livetime = np.array([np.mean(rate_data['LIVETIME'][tselect]) for n in range(nchan)]).reshape((1,nchan)) #now sum #np.array([np.mean(rate_data['LIVETIME'][tselect])]).reshape((1,))
-    
-    #error...
-    avg_err = np.mean(rate_data['STAT_ERR'][tselect],axis=0).reshape((1,nchan))
-    avg_sys_err = np.mean(rate_data['SYS_ERR'][tselect],axis=0).reshape((1,nchan))
+        original_fitsfile (str): Name of the converted FITS file.
+        
+    Returns:
+        dict: The 'RATE', 'STAT_ERR', 'SYS_ERR', 'LIVETIME', 'TIME' and 'TIMEDEL' columns, 'time_mjd' (bin centers in MJD), 'channel', 'primary_header', 'rate_header', 'energy_hdu' and 'att_hdu' (None if the file has no attenuator table)."""
+    with fits.open(original_fitsfile) as reference_fits:
+        rate_data = reference_fits[1].data
+        table = {c: np.array(rate_data[c]) for c in ['RATE', 'STAT_ERR', 'SYS_ERR', 'LIVETIME', 'TIME', 'TIMEDEL']}
+        table['channel'] = np.array(rate_data['CHANNEL'][0])
+        table['primary_header'] = reference_fits[0].header.copy()
+        table['rate_header'] = reference_fits[1].header.copy()
+        table['energy_hdu'] = fits.BinTableHDU(header = reference_fits[2].header.copy(), data = reference_fits[2].data.copy())
+        table['att_hdu'] = None
+        if len(reference_fits) > 3:
+            table['att_hdu'] = fits.BinTableHDU(header = reference_fits[3].header.copy(), data = reference_fits[3].data.copy())
+    table['time_mjd'] = _rate_time_mjd(table['TIME'], table['rate_header'])
+    return table
+
+def average_time_intervals(original_fitsfile, intervals):
+    """Average the rate table of a converted FITS file over many time intervals. The file is opened and decoded once, the bins of every interval are found with a single *searchsorted*, and the sums over all intervals are differences of two rows of the prefix sums of each column, so the cost does not depend on the number or length of the intervals.
+    
+    The rate and errors of an interval are the plain means of those of its bins, as for a single interval with *spectrum_from_time_interval*. Note that the mean STAT_ERR is not the error of the mean rate; *rate_index.RateIndex.query* instead returns the exposure-weighted rate of a window with the errors of its bins added in quadrature.
     
+    Args:
+        original_fitsfile (str or dict): Name of FITS file from which to get the spectra, or its rate table as returned by *read_rate_table*.
+        intervals (list): List of (start_time, end_time) tuples, in any format readable by astropy.Time. Bins with start_time <= TIME < end_time are used.
+        
+    Returns:
+        dict: One row per interval: 'rate', 'stat_err', 'sys_err' and 'livetime' (n_intervals x n_channels, averages over the interval), 'time' (TIME of the first bin), 'timedel' (summed duration), 'exposure' (summed livetime x duration), 'n_bins', 'tstart' and 'tstop' (interval bounds in MJD), as well as 'channel', 'primary_header', 'rate_header' and 'energy_hdu' from the original file."""
+    if isinstance(original_fitsfile, dict):
+        columns = original_fitsfile
+    else:
+        columns = read_rate_table(original_fitsfile)
+    channel = columns['channel']
+    time_bin_center = columns['time_mjd']
+    tstart = Time([i[0] for i in intervals]).mjd
+    tend = Time([i[1] for i in intervals]).mjd
+    
+    #index times that fall within selected intervals; the rate table is in time order
+    first = np.searchsorted(time_bin_center, tstart, side = 'left')
+    last = np.searchsorted(time_bin_center, tend, side = 'left')
+    n_bins = last - first
+    if np.any(n_bins <= 0):
+        raise ValueError(f"No time bins in interval(s) {[intervals[i] for i in np.where(n_bins <= 0)[0]]}")
+    
+    def interval_sums(values):
+        sums = prefix_sums(values)
+        return sums[last] - sums[first]
+    
+    livetime = columns['LIVETIME']
+    if livetime.ndim > 1: #same number for each channel
+        livetime = livetime[:,0]
+    avg_livetime = interval_sums(livetime)/n_bins
+    return {'rate': interval_sums(columns['RATE'])/n_bins[:,None],
+            'stat_err': interval_sums(columns['STAT_ERR'])/n_bins[:,None],
+            'sys_err': interval_sums(columns['SYS_ERR'])/n_bins[:,None],
+            'livetime': np.repeat(avg_livetime[:,None], channel.size, axis = 1),
+            'time': columns['TIME'][first],
+            'timedel': interval_sums(columns['TIMEDEL']),
+            'exposure': interval_sums(columns['TIMEDEL']*livetime),
+            'n_bins': n_bins,
+            'tstart': tstart,
+            'tstop': tend,
+            'channel': channel,
+            'primary_header': columns['primary_header'],
+            'rate_header': columns['rate_header'],
+            'energy_hdu': columns['energy_hdu']}
+
+def _write_interval_spectrum(averages, i, out_fitsname):
+    """Write row i of the result of *average_time_intervals* as a single-spectrum FITS file."""
+    from astropy.table import Table
+    nchan = averages['channel'].size
+    rate_header = averages['rate_header'].copy()
     # Update keywords that need updating
     #rate_header['DETCHANS'] = self.n_energies
     rate_header.set('NAXIS',1)
@@ -67,26 +108,76 @@ def spectrum_from_time_interval(original_fitsfile, start_time, end_time, out_fit
     
     #rate_header['EXPOSURE'] = exposure #does this make a difference?
     #rate_header['ONTIME'] = exposure
-    #print(f"exposure: {exposure}")
     #update times in rate header
-    rate_header['TSTARTI'] = int(np.modf(tstart.mjd)[1]) #Integer portion of start time rel to TIMESYS
-    rate_header['TSTARTF'] = np.modf(tstart.mjd)[0] #Fractional portion of start time
-    rate_header['TSTOPI'] = int(np.modf(tend.mjd)[1])
-    rate_header['TSTOPF'] = np.modf(tend.mjd)[0]
+    rate_header['TSTARTI'] = int(np.modf(averages['tstart'][i])[1]) #Integer portion of start time rel to TIMESYS
+    rate_header['TSTARTF'] = np.modf(averages['tstart'][i])[0] #Fractional portion of start time
+    rate_header['TSTOPI'] = int(np.modf(averages['tstop'][i])[1])
+    rate_header['TSTOPF'] = np.modf(averages['tstop'][i])[0]
 
     #update rate data
-    #print(f"max count rate: {np.max(total_counts/exposure)}")
     rate_names = ['RATE', 'STAT_ERR', 'CHANNEL', 'SPEC_NUM', 'LIVETIME', 'TIME', 'TIMEDEL', 'SYS_ERR']
-    rate_table = Table([avg_counts.astype('>f8'), avg_err.astype('>f8'), rate_data['CHANNEL'][0].reshape((1,nchan)), [0],avg_livetime.astype('>f8'), np.array([rate_data['TIME'][tselect[0][0]]]), np.array([np.sum(rate_data['TIMEDEL'][tselect])]), avg_sys_err], names = rate_names) #is spec.counts what we want?
+    rate_table = Table([averages['rate'][i:i+1].astype('>f8'), averages['stat_err'][i:i+1].astype('>f8'), averages['channel'].reshape((1,nchan)), [0], averages['livetime'][i:i+1].astype('>f8'), averages['time'][i:i+1], averages['timedel'][i:i+1].astype('>f4'), averages['sys_err'][i:i+1]], names = rate_names) #is spec.counts what we want?
 
-    #primary_HDU = fits.PrimaryHDU(header = primary_header)
+    primary_HDU = fits.PrimaryHDU(header = averages['primary_header'])
     rate_HDU = fits.BinTableHDU(header = rate_header, data = rate_table)
-    #energy_HDU = fits.BinTableHDU(header = energy_header, data = energy_data)
-    #print(energy_HDU.header)
-    hdul = fits.HDUList([primary_HDU, rate_HDU, energy_HDU]) #, att_header, att_table])
-    if not out_fitsname:
-        out_fitsname=f"{original_fitsfile[:-5]}_{pd.to_datetime(start_time):%H%M%S}-{pd.to_datetime(end_time):%H%M%S}.fits"
+    hdul = fits.HDUList([primary_HDU, rate_HDU, averages['energy_hdu']]) #, att_header, att_table])
     hdul.writeto(out_fitsname)
+
+def spectra_from_time_intervals(original_fitsfile, intervals, out_fitsnames = None, write = True):
+    """Average count rates over many selected time intervals of one converted FITS file for fitting with XSPEC, see *average_time_intervals*.
+    
+    Args:
+        original_fitsfile (str): Name of FITS file from which to get the spectra.
+        intervals (list): List of (start_time, end_time) tuples, in any format readable by astropy.Time.
+        out_fitsnames (list, optional): Defaults to None. Names of the output FITS files, one per interval. By default they are named after the original file and the interval times.
+        write (bool, optional): Defaults to True. If False, nothing is written and the averages are returned as one multi-row result instead.
+        
+    Returns:
+        list or dict: Names of the FITS files written, one per interval, or the multi-row result of *average_time_intervals* if write is False."""
+    intervals = list(intervals)
+    averages = average_time_intervals(original_fitsfile, intervals)
+    if not write:
+        return averages
+    if out_fitsnames is None:
+        out_fitsnames = [_interval_default_fitsname(original_fitsfile, start_time, end_time) for start_time, end_time in intervals]
+    elif len(out_fitsnames) != len(intervals):
+        raise ValueError("Parameter 'out_fitsnames' must have one entry per interval")
+    for i, out_fitsname in enumerate(out_fitsnames):
+        _write_interval_spectrum(averages, i, out_fitsname)
+    return list(out_fitsnames)
+
+def time_intervals_to_pha2(original_fitsfile, intervals, out_fitsname, batch_size = 1000, overwrite = False):
+    """Average count rates over many time intervals of one converted FITS file and write them as the rows of a single OGIP type II PHA file, see *PHA2Writer*. The rate table is read once; the intervals are averaged and appended in batches.
+    
+    Args:
+        original_fitsfile (str or dict): Name of FITS file from which to get the spectra, or its rate table as returned by *read_rate_table*.
+        intervals (iterable): (start_time, end_time) tuples, in any format readable by astropy.Time.
+        out_fitsname (str): Name of the output FITS file.
+        batch_size (int, optional): Defaults to 1000. Number of intervals averaged and written at a time.
+        overwrite (bool, optional): Defaults to False. Overwrite out_fitsname if it exists.
+        
+    Returns:
+        int: Number of spectra written."""
+    table = original_fitsfile if isinstance(original_fitsfile, dict) else read_rate_table(original_fitsfile)
+    intervals = iter(intervals)
+    with PHA2Writer(out_fitsname, table['channel'].size, primary_header = table['primary_header'], rate_header = table['rate_header'], energy_hdu = table['energy_hdu'], att_hdu = table['att_hdu'], overwrite = overwrite) as writer:
+        while True:
+            batch = list(islice(intervals, batch_size))
+            if not batch:
+                break
+            averages = average_time_intervals(table, batch)
+            writer.append(averages['rate'], averages['stat_err'], averages['exposure'], averages['tstart'], averages['tstop'], sys_err = averages['sys_err'], livetime = averages['livetime'][:,0], timedel = averages['timedel'])
+    return writer.n_rows
+
+def spectrum_from_time_interval(original_fitsfile, start_time, end_time, out_fitsname=None):
+    """Write average count rate over selected time interval to new FITS file for fitting with XSPEC. To extract many intervals from the same file, use *spectra_from_time_intervals*. RATE, STAT_ERR and SYS_ERR are the means over the bins of the interval, see *average_time_intervals*.
+    
+    Args:
+        original_fitsfile (str): Name of FITS file from which to get the spectrum.
+        start_time (str, datetime, int, float): Start time in format readable by astropy.Time.
+        end_time (str, datetime, int, float): End time in format readable by astropy.Time.
+        out_fitsname (str): Name of output FITS file. Defaults to None."""
+    spectra_from_time_intervals(original_fitsfile, [(start_time, end_time)], out_fitsnames = None if not out_fitsname else [out_fitsname])
     
 def fits_time_to_datetime(fitsfile, idx = None):
     """Return a datetime axis or single datetime given an OGIP-format FITS file.
@@ -98,18 +189,36 @@ def fits_time_to_datetime(fitsfile, idx = None):
     Returns:
         np.array: Array of datetimes, or single datetime if idx is not None."""
     with fits.open(fitsfile) as f:
-        time_bin_center = f[1].data.TIME
-        if Time(time_bin_center[0], format='mjd').datetime.year < 2020 or Time(time_bin_center[0], format='mjd').datetime.year > dt.now().year:
-            tt = Time([Time(f[1].header['TIMEZERO']+f[1].header['MJDREF'], format='mjd').datetime + td(seconds = t) for t in time_bin_center])
-        else:
-            tt = Time(time_bin_center, format = 'mjd')
+        tt = Time(_rate_time_mjd(f[1].data.TIME, f[1].header), format = 'mjd')
     if idx:
         return tt.datetime[idx]
     return tt.datetime
 
 #def select_background_interval():
 
-def fit_thermal_nonthermal(xspec, thmodel = 'apec', ntmodel = 'bknpower', lowErange = [2.0,10.0], highErange = [8.0,30.0], breakEstart = 15, breakEfrozen=False, minCounts=10, statMethod='chi',query='no',renorm=True,nIterations = 1000,renotice = True):
+def _setup_break_energy(m, ntmodel, breakEstart):
+    """Start the break energy of the non-thermal component at breakEstart, frozen, with an upper soft limit 2 keV above.
+    
+    Returns:
+        str: Name of the break energy parameter, or None if the component has none."""
+    m_nt = getattr(m,ntmodel)
+    try: #in thick2 it's eebrk not BreakE...
+        breakEindex = getattr(m_nt, 'BreakE')._Parameter__index
+        m.setPars({breakEindex:f"{breakEstart} -.5,,,{breakEstart+2}"})
+        return 'BreakE'
+    except AttributeError:
+        try:
+            breakEindex = getattr(m_nt, 'eebrk')._Parameter__index
+            m.setPars({breakEindex:f"{breakEstart} -.5,,,{breakEstart+2}"})
+            lowEindex = getattr(m_nt, 'eelow')._Parameter__index
+            m.setPars({lowEindex:f"{breakEstart-5} -.5,,,{breakEstart-2}"})
+            p = getattr(getattr(m,ntmodel),'eelow')
+            p.frozen = False
+            return 'eebrk'
+        except AttributeError:
+            return None
+
+def fit_thermal_nonthermal(xspec, thmodel = 'apec', ntmodel = 'bknpower', lowErange = [2.0,10.0], highErange = [8.0,30.0], breakEstart = 15, breakEfrozen=False, minCounts=10, statMethod='chi',query='no',renorm=True,nIterations = 1000,renotice = True, fit_info = None):
     '''Fit thermal and non-thermal components to spectrum via the following steps:
     
     1) fit thermal over low energy
@@ -131,11 +240,12 @@ def fit_thermal_nonthermal(xspec, thmodel = 'apec', ntmodel = 'bknpower', lowEra
         renorm (bool, optional): Defaults to True. Whether to re-normalize the data or not.
         nIterations (int, optional): Defaults to 1000. Number of iterations before querying for more or stopping.
         renotice (bool, optional): Defaults to True. Whether to notice all the channels after the fit is complete (for plotting purposes mainly) or not.
+        fit_info (dict, optional): Defaults to None. If given, the number of minimizations performed is stored in it under 'n_fits'.
         
     Returns:
         tuple: model, chisq
     '''
-    breakE = True #assume there's a break energy
+    n_fits = 0
     xspec.Xset.abund="felc"
     if ntmodel != 'thick2':
         xspec.AllModels.clear() #for now...
@@ -150,6 +260,7 @@ def fit_thermal_nonthermal(xspec, thmodel = 'apec', ntmodel = 'bknpower', lowEra
     
     xspec.Fit.renorm()
     xspec.Fit.perform()
+    n_fits += 1
     
     mtherm_params = get_xspec_model_params(getattr(m,thmodel), norm = True)
     
@@ -159,24 +270,7 @@ def fit_thermal_nonthermal(xspec, thmodel = 'apec', ntmodel = 'bknpower', lowEra
         m = xspec.Model(f'{thmodel}+{ntmodel}')
         m_th = getattr(m, thmodel)
         set_xspec_model_params(m, thmodel, mtherm_params, frozen = True)
-            
-        m_nt = getattr(m,ntmodel)
-        try: #in thick2 it's eebrk not BreakE...
-            breakEindex = getattr(m_nt, 'BreakE')._Parameter__index
-            m.setPars({breakEindex:f"{breakEstart} -.5,,,{breakEstart+2}"})
-            breakparname = 'BreakE'
-            #p = getattr(m_nt,'BreakE')
-        except AttributeError:
-            try:
-                breakEindex = getattr(m_nt, 'eebrk')._Parameter__index
-                m.setPars({breakEindex:f"{breakEstart} -.5,,,{breakEstart+2}"})
-                breakparname = 'eebrk'
-                lowEindex = getattr(m_nt, 'eelow')._Parameter__index
-                m.setPars({lowEindex:f"{breakEstart-5} -.5,,,{breakEstart-2}"})
-                p = getattr(getattr(m,ntmodel),'eelow')
-                p.frozen = False
-            except AttributeError:
-                breakE = False
+        breakparname = _setup_break_energy(m, ntmodel, breakEstart)
      
         xspec.AllData.notice('all')
         #check that count rate at highErange is above minCounts, otherwise adjust highErange and warn
@@ -187,12 +281,14 @@ def fit_thermal_nonthermal(xspec, thmodel = 'apec', ntmodel = 'bknpower', lowEra
         
         xspec.Fit.renorm()
         xspec.Fit.perform()
+        n_fits += 1
 
-        if breakE and not breakEfrozen: #fit again with unfrozen break E
+        if breakparname is not None and not breakEfrozen: #fit again with unfrozen break E
             p = getattr(getattr(m,ntmodel),breakparname)
             p.frozen = False
             xspec.Fit.renorm()
             xspec.Fit.perform()
+            n_fits += 1
             
         #step 3 - fit together, all parameters free
         for param in ['kT','norm']:
@@ -204,12 +300,160 @@ def fit_thermal_nonthermal(xspec, thmodel = 'apec', ntmodel = 'bknpower', lowEra
         
         xspec.Fit.renorm()
         xspec.Fit.perform()
+        n_fits += 1
     print(f"Fit statistic: {xspec.Fit.statMethod.capitalize()}   {xspec.Fit.statistic:.3f} \n Null hypothesis probability of {xspec.Fit.nullhyp:.2e} with {xspec.Fit.dof} degrees of freedom")
     fitstat = xspec.Fit.statistic
     if renotice:
         xspec.AllData.notice('all')
+    if fit_info is not None:
+        fit_info['n_fits'] = n_fits
     return m,fitstat
 
+def _warm_fit_thermal_nonthermal(xspec, start_params, thmodel = 'apec', ntmodel = 'bknpower', lowErange = [2.0,10.0], highErange = [8.0,30.0], breakEstart = 15, breakEfrozen = False, minCounts = 10, statMethod = 'chi', query = 'no', renorm = True, nIterations = 1000, renotice = True):
+    """Joint fit (step 3 of *fit_thermal_nonthermal*) only, with the same free parameters and limits but starting from the parameter values of a previous fit instead of the separate thermal and non-thermal fits.
+    
+    Args:
+        xspec
+        start_params (dict): Parameter values (including norm) of each model component, as returned by *get_xspec_model_params*.
+        renorm (bool, optional): Defaults to True. Renormalize the model before the fit, as *fit_thermal_nonthermal* does before each of its fits.
+        Other arguments as in *fit_thermal_nonthermal*; minCounts is not used by either yet.
+    
+    Returns:
+        tuple: model, fit statistic"""
+    xspec.Xset.abund="felc"
+    if ntmodel != 'thick2':
+        xspec.AllModels.clear()
+    xspec.Fit.statMethod = statMethod
+    xspec.Fit.query = query
+    xspec.Fit.nIterations = nIterations
+    
+    if ntmodel is None:
+        m = xspec.Model(f'{thmodel}')
+        Erange = lowErange
+    else:
+        m = xspec.Model(f'{thmodel}+{ntmodel}')
+        breakparname = _setup_break_energy(m, ntmodel, breakEstart)
+        if breakparname is not None and not breakEfrozen:
+            getattr(getattr(m,ntmodel),breakparname).frozen = False
+        Erange = [lowErange[0], highErange[1]]
+    for component, params in start_params.items():
+        set_xspec_model_params(m, component, params, values_only = True)
+    
+    xspec.AllData.notice('all')
+    xspec.AllData.ignore(f"0.-{Erange[0]} {Erange[1]}-**")
+    if renorm:
+        xspec.Fit.renorm()
+    xspec.Fit.perform()
+    fitstat = xspec.Fit.statistic
+    if renotice:
+        xspec.AllData.notice('all')
+    return m, fitstat
+
+def fit_thermal_nonthermal_series(xspec, spectra, thmodel = 'apec', ntmodel = 'bknpower', warm_start = True, restart_factor = 2., **kwargs):
+    '''Fit an ordered series of spectra, e.g. consecutive time intervals, with *fit_thermal_nonthermal*. With warm_start, each spectrum after the first only gets the joint fit, starting from the best-fit parameters of the previous spectrum; the separate thermal and non-thermal fits are skipped. If the reduced fit statistic of a warm-started fit is more than restart_factor times that of the previous spectrum, the spectrum is fit again from scratch with the full procedure.
+    
+    Args:
+        xspec
+        spectra (list): Spectra to load one at a time with *xspec.AllData*, in order, e.g. ["stx_spectra_pha2.fits{1}", "stx_spectra_pha2.fits{2}", ...].
+        thmodel (str, optional): Defaults to 'apec'. Thermal model to use.
+        ntmodel (str, optional): Defaults to 'bknpower'. Non-thermal model to use, or None.
+        warm_start (bool, optional): Defaults to True. Start each fit from the previous best fit.
+        restart_factor (float, optional): Defaults to 2. Refit from scratch if the reduced statistic of a warm-started fit exceeds that of the previous spectrum by more than this factor. None never refits.
+        **kwargs: Passed to *fit_thermal_nonthermal*.
+        
+    Returns:
+        list: One dict per spectrum, with the best-fit 'params' and 'sigmas' of each model component, 'statistic', 'dof', whether the result is from a 'warm_start', the number of minimizations 'n_fits' and the 'wall_time' in seconds.
+    '''
+    components = [thmodel] if ntmodel is None else [thmodel, ntmodel]
+    results = []
+    for spectrum in spectra:
+        t0 = time.perf_counter()
+        xspec.AllData.clear()
+        xspec.AllData(spectrum)
+        warm = warm_start and len(results) > 0
+        n_fits = 0
+        if warm:
+            previous = results[-1]
+            m, fitstat = _warm_fit_thermal_nonthermal(xspec, previous['params'], thmodel = thmodel, ntmodel = ntmodel, **kwargs)
+            n_fits += 1
+            if restart_factor is not None and xspec.Fit.dof > 0 and previous['dof'] > 0 and fitstat/xspec.Fit.dof > restart_factor*previous['statistic']/previous['dof']:
+                warm = False
+        if not warm:
+            fit_info = {}
+            m, fitstat = fit_thermal_nonthermal(xspec, thmodel = thmodel, ntmodel = ntmodel, fit_info = fit_info, **kwargs)
+            n_fits += fit_info['n_fits']
+        results.append({'spectrum': spectrum,
+                        'params': {c: get_xspec_model_params(getattr(m,c), norm = True) for c in components},
+                        'sigmas': {c: get_xspec_model_sigmas(getattr(m,c)) for c in components},
+                        'statistic': fitstat,
+                        'dof': xspec.Fit.dof,
+                        'warm_start': warm,
+                        'n_fits': n_fits,
+                        'wall_time': time.perf_counter() - t0})
+    return results
+
+_worker_xspec = None #xspec session of a fitting worker process
+
+def _load_xspec_backend(backend):
+    """Import the xspec backend: a module name, or a callable returning an object with the pyxspec interface (e.g. a fake for testing)."""
+    if isinstance(backend, str):
+        return importlib.import_module(backend)
+    return backend()
+
+def _init_fit_worker(backend):
+    """Initializer for the worker processes of *fit_spectra*: start the xspec session owned by this process."""
+    global _worker_xspec
+    _worker_xspec = _load_xspec_backend(backend)
+
+def _fit_spectrum(result, spectrum, response, kwargs):
+    """Load one spectrum (and response) into the worker's xspec session and fit it, see *fit_spectra*."""
+    xspec = _worker_xspec
+    xspec.AllData.clear()
+    xspec.AllData(spectrum)
+    if response is not None:
+        xspec.AllData(1).response = response
+    with stage('fit', spectrum):
+        m, fitstat = fit_thermal_nonthermal(xspec, **kwargs)
+    components = m.componentNames
+    result['params'] = {c: tuple(float(v) for v in get_xspec_model_params(getattr(m,c), norm = True)) for c in components}
+    result['sigmas'] = {c: tuple(float(v) for v in get_xspec_model_sigmas(getattr(m,c))) for c in components}
+    result['statistic'] = float(fitstat)
+    result['dof'] = int(xspec.Fit.dof)
+
+def _fit_one(spectrum, response, kwargs):
+    """Worker for *fit_spectra*: fit one spectrum and report the result as plain data instead of raising."""
+    return run_reported(_fit_spectrum, {'spectrum': spectrum, 'response': response, 'params': None, 'sigmas': None, 'statistic': None, 'dof': None}, spectrum, response, kwargs)
+
+def fit_spectra(spectra, responses = None, jobs = None, backend = 'xspec', **kwargs):
+    '''Fit many spectra with *fit_thermal_nonthermal*, in parallel over a pool of worker processes. Each worker has its own xspec session, into which it loads one spectrum (and response) at a time.
+    
+    Args:
+        spectra (list): Spectra to load with *xspec.AllData*, e.g. ["stx_spectra_pha2.fits{1}", "stx_spectra_pha2.fits{2}", ...].
+        responses (str or list, optional): Defaults to None, in which case the response named in each spectrum file is used. Response file for all spectra, or one per spectrum.
+        jobs (int, optional): Defaults to None, in which case one worker per CPU is used. Number of worker processes. If 1, the spectra are fit in the current process.
+        backend (str or callable, optional): Defaults to 'xspec'. Name of the module providing the pyxspec interface, imported once by each worker, or a picklable callable returning such an object.
+        **kwargs: Further keyword arguments for *fit_thermal_nonthermal*, e.g. thmodel, ntmodel or lowErange.
+        
+    Returns:
+        list: One dictionary per spectrum, in input order, with keys 'spectrum', 'response', 'success', 'params' and 'sigmas' (tuples of floats per model component, as from *get_xspec_model_params* and *get_xspec_model_sigmas*), 'statistic', 'dof', 'error' (None or the error message), 'elapsed' and 'stages' (seconds spent in the 'fit', see *jobs.run_reported*).
+    '''
+    spectra = list(spectra)
+    if responses is None or isinstance(responses, str):
+        responses = [responses] * len(spectra)
+    else:
+        responses = list(responses)
+        if len(responses) != len(spectra):
+            raise ValueError("Parameter 'responses' must be a single file or have one entry per spectrum")
+    if isinstance(backend, str) and importlib.util.find_spec(backend) is None: #fail here rather than in every worker
+        raise ImportError(f"No module named '{backend}'")
+    kwargs.setdefault('renotice', False)
+    
+    global _worker_xspec
+    previous = _worker_xspec
+    try:
+        return map_jobs(_fit_one, spectra, responses, [kwargs] * len(spectra), jobs = jobs, initializer = _init_fit_worker, initargs = (backend,))
+    finally:
+        _worker_xspec = previous #with jobs = 1 the session was started in this process
 
 def get_xspec_model_params(model_component, norm=False):
     '''Returns tuple of current values of xspec model component parameters.
@@ -219,11 +463,15 @@ def get_xspec_model_params(model_component, norm=False):
     else:
         return tuple([getattr(model_component,p).values[0] for p in model_component.parameterNames])
         
-def set_xspec_model_params(model, model_component, component_params, frozen = False):
+def set_xspec_model_params(model, model_component, component_params, frozen = False, values_only = False):
     '''Sets current values of xspec model parameters.
-    Input: xspec Model Component object, tuple of xspec model parameters'''
+    Input: xspec Model Component object, tuple of xspec model parameters
+    With values_only, only the values are changed, keeping the limits and frozen state of each parameter.'''
     mcomp = getattr(model, model_component)
     for param, pval in zip(mcomp.parameterNames, component_params):
+        if values_only:
+            getattr(mcomp, param).values = pval
+            continue
         pidx =  getattr(mcomp, param)._Parameter__index
         model.setPars({pidx:f"{pval} -.1,,,{pval}"})
         if not frozen:
@@ -267,8 +515,10 @@ def show_model(model, df=False):
             pdict['Sigma'].append(plusminus)
             
     if df: #jupyterlab doesn't work with Mardown for whatever reason, but it will display a dataframe nicely
+        import pandas as pd
         return pd.DataFrame(pdict)
     else:
+        from IPython.display import Markdown #imported here so that IPython is only needed for display
         return Markdown(mdtable)
     
 def show_error(model):
@@ -294,14 +544,17 @@ def show_error(model):
             upper=err[1]
             lower=err[0]
             mdtable+=f"|{j+1+nprev} |{i+1} | {n}|{p}| {getattr(param,'unit')}| {getattr(param,'values')[0]:{fmt}} | {lower:{fmt}}| {upper:{fmt}} | {errcodes}\n"
+    from IPython.display import Markdown
     return Markdown(mdtable)
     
 def show_statistic(fit):
     '''input xspec.Fit'''
+    from IPython.display import Markdown
     return Markdown(f"Fit statistic: {fit.statMethod.capitalize()}   {fit.statistic:.3f} \n Null hypothesis probability of {fit.nullhyp:.2e} with {fit.dof} degrees of freedom")
 
 def plot_data(xspec,fitrange=False, dataGroup=1,erange=False,yrange=False, counts=False, title = None):
     '''Plot spectrum data in PlotLy, as either count rate (default) or counts. Input: xspec global object '''
+    import plotly.graph_objects as go #plotting dependencies are only imported when plotting
 
     xspec.Plot.xAxis = "keV"
     #xspec.Plot('ufspec')
@@ -348,6 +601,8 @@ def plot_fit(xspec, model, fitrange=False, dataGroup=1,erange=False,yrange = [-3
     plotdata_dict: dict
         The PlotLy plot data in a dictionary, to make tweaking the plot via update_layout, update_traces, update_axes, etc. later possible, since the Model object will overwrite itself eventually and be unable to plot via repeated calls to this function.
      '''
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
     
     if xspec is not None:
         xspec.Plot.xAxis = "keV"
@@ -0,0 +1,17 @@
+import pytest
+from .samples import STX_CONF, scaled_pixel_data
+
+@pytest.fixture
+def stx_conf(monkeypatch):
+    """Point STX_CONF to the minimal STIX-CONF in tests/stx_conf."""
+    monkeypatch.setenv('STX_CONF', STX_CONF)
+    return STX_CONF
+
+@pytest.fixture
+def pixel_data_file(tmp_path, stx_conf):
+    """Factory writing synthetic L1A pixel data with *samples.scaled_pixel_data* into tmp_path, with STX_CONF set for reading it."""
+    def write(n_times, **kwargs):
+        fits_path = str(tmp_path/f"pixel_data_{n_times}.fits")
+        scaled_pixel_data(n_times, fits_path, **kwargs)
+        return fits_path
+    return write
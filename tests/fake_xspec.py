@@ -0,0 +1,116 @@
+"""Minimal stand-in for the parts of the pyxspec interface used by *stix2xspec.xspec_utils*, for testing without XSPEC. Every session records the calls made to it in *calls*."""
+import os
+
+PARAMETERS = {'apec': ['kT', 'Abundanc', 'Redshift', 'norm'],
+              'bknpower': ['PhoIndx1', 'BreakE', 'PhoIndx2', 'norm'],
+              'powerlaw': ['PhoIndex', 'norm'],
+              'thick2': ['a', 'p', 'eebrk', 'q', 'eelow', 'eehigh', 'norm']}
+
+class Parameter:
+    def __init__(self, index, value = 1.):
+        self.__index = index
+        self.values = value
+        self.frozen = False
+        self.sigma = 0.1
+
+    @property
+    def values(self):
+        return self._values
+
+    @values.setter
+    def values(self, value):
+        self._values = list(value) if isinstance(value, (list, tuple)) else [float(value)]
+
+class Component:
+    def __init__(self, name, first_index):
+        self.parameterNames = PARAMETERS[name]
+        for i, p in enumerate(self.parameterNames):
+            setattr(self, p, Parameter(first_index + i))
+
+class Model:
+    def __init__(self, expression):
+        self.componentNames = expression.split('+')
+        self._parameters = {}
+        index = 1
+        for name in self.componentNames:
+            component = Component(name, index)
+            setattr(self, name, component)
+            for p in component.parameterNames:
+                self._parameters[index] = getattr(component, p)
+                index += 1
+
+    def setPars(self, pars):
+        for index, value in pars.items():
+            self._parameters[index].values = float(str(value).split()[0])
+
+class Session:
+    def __init__(self, xspec):
+        self._xspec = xspec
+
+    def _call(self, name, *args):
+        self._xspec.calls.append((name,) + args)
+
+class Fit(Session):
+    def __init__(self, xspec):
+        super().__init__(xspec)
+        self.statMethod = 'chi'
+        self.query = 'no'
+        self.nIterations = 100
+        self.statistic = 0.
+        self.dof = 20
+        self.nullhyp = 0.5
+
+    def renorm(self):
+        self._call('renorm')
+
+    def perform(self):
+        self._call('perform')
+        self.statistic = float(len(self._xspec.AllData.loaded or ''))
+
+class Spectrum:
+    response = None
+
+class AllData(Session):
+    loaded = None
+
+    def __call__(self, spectrum):
+        self._call('load', spectrum)
+        if isinstance(spectrum, str):
+            if 'missing' in spectrum:
+                raise OSError(f"Cannot open {spectrum}")
+            self.loaded = spectrum
+        return Spectrum()
+
+    def clear(self):
+        self._call('AllData.clear')
+        self.loaded = None
+
+    def ignore(self, channels):
+        self._call('ignore', channels)
+
+    def notice(self, channels):
+        self._call('notice', channels)
+
+class AllModels(Session):
+    def clear(self):
+        self._call('AllModels.clear')
+
+class Xset:
+    abund = None
+
+class FakeXspec:
+    """One fake xspec session. The class itself can be passed as the backend of *fit_spectra*."""
+    def __init__(self):
+        self.calls = []
+        self.pid = os.getpid()
+        self.Xset = Xset()
+        self.Fit = Fit(self)
+        self.AllData = AllData(self)
+        self.AllModels = AllModels(self)
+
+    def Model(self, expression):
+        self._call('Model', expression)
+        return Model(expression)
+
+    def _call(self, name, *args):
+        self.calls.append((name,) + args)
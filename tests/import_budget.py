@@ -0,0 +1,34 @@
+"""Import time budgets of the stix2xspec modules and the libraries they must only import on first use, enforced by *test_import* and tracked by the benchmarks in benchmarks/bench_import.py."""
+import subprocess
+import sys
+
+#seconds, with headroom over the measured ~0.15 s (rate_index) and ~0.45 s (everything importing astropy.io.fits)
+IMPORT_TIME_BUDGET = {'stix2xspec': 0.2,
+                      'stix2xspec.rate_index': 0.4,
+                      'stix2xspec.spectrogram': 1.,
+                      'stix2xspec.stix2xspec': 1.,
+                      'stix2xspec.xspec_utils': 1.,
+                      'stix2xspec.fitting': 1.,
+                      'stix2xspec.thermal_grid': 1.}
+
+#imported on first use only
+LAZY_DEPENDENCIES = ['matplotlib', 'plotly', 'IPython', 'pandas', 'astropy.table']
+
+_MEASURE = """
+import sys, time
+t0 = time.perf_counter()
+import {module}
+print(time.perf_counter() - t0)
+print(','.join(m for m in {lazy!r} if m in sys.modules))
+"""
+
+def measure_import(module):
+    """Import a module in a fresh interpreter.
+
+    Args:
+        module (str): Name of the module.
+
+    Returns:
+        tuple: Import time in seconds and the list of LAZY_DEPENDENCIES that were imported with it."""
+    out = subprocess.run([sys.executable, '-c', _MEASURE.format(module = module, lazy = LAZY_DEPENDENCIES)], check = True, capture_output = True, text = True).stdout.split('\n')
+    return float(out[0]), [m for m in out[1].split(',') if m]
@@ -0,0 +1,11 @@
+"""Reference implementations replaced by faster code, shared by the tests (as the expected result) and the benchmarks (as the baseline)."""
+import numpy as np
+
+def apply_elut_l1_tiled(spec, energy_bins, pixels_used, detectors_used):
+    """The L1 branch of *Spectrogram.apply_elut* before the pixel sum was fused: a tiled eff_ewidth divisor and chained fancy-index copies, all at full size."""
+    n_times, n_energies = spec.n_times, len(energy_bins)
+    counts_spec = spec.counts[...,energy_bins]/np.reshape(np.tile(spec.eff_ewidth, n_times*32*12),(n_times,32,12,n_energies))
+    counts_err = spec.counts_err[...,energy_bins]/np.reshape(np.tile(spec.eff_ewidth, n_times*32*12),(n_times,32,12,n_energies))
+    counts_spec = np.sum(counts_spec[:,detectors_used][:,:,pixels_used], axis = 2)
+    counts_err = np.sqrt(np.sum(counts_err[:,detectors_used][:,:,pixels_used]**2, axis = 2))
+    return counts_spec, counts_err
@@ -0,0 +1,40 @@
+"""Input files shared by the tests and the benchmarks: the bundled sample files, a minimal STIX-CONF and synthetic pixel data made by scaling the L1A sample up along time, detectors and energies.
+
+The minimal copy of STIX-CONF in tests/stx_conf holds only the files the conversion reads (the ELUT and its date index, the minimum time bin index and the science energy channels), with the ELUT of 2022-06-01 valid at all dates."""
+import os
+import numpy as np
+from importlib import resources
+from astropy.io import fits
+
+STX_CONF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stx_conf')
+
+L1A_FILE = 'solo_L1A_stix-sci-xray-l1-2207235029_20220723T113947-20220723T122747_079205_V01.fits'
+L4_FILE = 'solo_L1A_stix-sci-spectrogram-2207238956_20220723T122007-20220723T182511_079258_V01.fits'
+
+def sample_file(name):
+    """Full path of one of the bundled sample files."""
+    with resources.path('stix2xspec.data', name) as f:
+        return str(f)
+
+def scaled_pixel_data(n_times, fits_path, n_detectors = 32, n_energies = 32):
+    """Write a copy of the bundled L1A pixel data file with the time bin repeated n_times times, optionally with fewer detectors or energy channels enabled.
+
+    Args:
+        n_times (int): Number of time bins in the output file.
+        fits_path (str): Full path of the output FITS file.
+        n_detectors (int, optional): Defaults to 32. Only the first n_detectors detectors are enabled in the detector mask.
+        n_energies (int, optional): Defaults to 32. Only the first n_energies science energy channels are enabled in the energy bin mask."""
+    with fits.open(sample_file(L1A_FILE)) as hdul:
+        hdul = fits.HDUList([hdu.copy() for hdu in hdul])
+    data = hdul['DATA'].data
+    columns = []
+    for c in data.columns:
+        arr = np.repeat(data[c.name], n_times, axis = 0)
+        if c.name == 'time':
+            arr = data['time'][0] + np.arange(n_times)*data['timedel'][0]
+        elif c.name == 'detector_masks':
+            arr[:,n_detectors:] = 0
+        columns.append(fits.Column(name = c.name, format = c.format, dim = c.dim, unit = c.unit, array = arr))
+    hdul['DATA'] = fits.BinTableHDU.from_columns(columns, header = hdul['DATA'].header, name = 'DATA')
+    hdul['CONTROL'].data['energy_bin_mask'][:,n_energies:] = 0
+    hdul.writeto(fits_path, overwrite = True)
@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+import numpy as np
+from stix2xspec.spectrogram import Spectrogram
+from stix2xspec.spectrogram_utils import sum_over_pixels
+from .reference import apply_elut_l1_tiled
+
+def test_sum_over_pixels_against_tiled():
+    rng = np.random.default_rng(8)
+    n_times = 6
+    counts = rng.uniform(0., 100., (n_times, 32, 12, 32))
+    energy_bins = np.arange(3, 29)
+    pixels_used = np.array([0, 1, 2, 3, 4, 5, 6, 7])
+    detectors_used = np.delete(np.arange(32), [8, 9])
+    eff_ewidth = rng.uniform(0.5, 2., energy_bins.size)
+    spec = SimpleNamespace(n_times = n_times, counts = counts, counts_err = np.sqrt(counts), eff_ewidth = eff_ewidth)
+    counts_spec, counts_err = apply_elut_l1_tiled(spec, energy_bins, pixels_used, detectors_used)
+    np.testing.assert_allclose(sum_over_pixels(counts, pixels_used, detectors_used, energy_bins = energy_bins, eff_ewidth = eff_ewidth), counts_spec, rtol = 1e-12)
+    np.testing.assert_allclose(np.sqrt(sum_over_pixels(spec.counts_err, pixels_used, detectors_used, energy_bins = energy_bins, eff_ewidth = eff_ewidth, squared = True)), counts_err, rtol = 1e-12)
+
+def test_pixel_sums_against_tiled(pixel_data_file):
+    spec = Spectrogram(pixel_data_file(5, n_detectors = 30))
+    energy_bins, pixels_used, detectors_used = spec._elut_setup()
+    spec._get_eff_ewidth(pixels_used, detectors_used)
+    for result, expected in zip(spec._pixel_sums(pixels_used, detectors_used, energy_bins = energy_bins, eff_ewidth = spec.eff_ewidth), apply_elut_l1_tiled(spec, energy_bins, pixels_used, detectors_used)):
+        np.testing.assert_allclose(result, expected, rtol = 1e-12)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from stix2xspec.fitting import MODELS, SpectrumFitter
+from stix2xspec.response import ResponseMatrix
+from stix2xspec.xspec_utils import read_rate_table
+
+TRUE_PARAMS = {'thermal': (1.8, 0.5), 'bknpower': (3e6, 4., 18., 6.)}
+EXPOSURE = 20.
+FIT_RANGES = {'lowErange': [4, 10], 'highErange': [10, 40]}
+SPECTRUM_FILE = 'stix2xspec/data/stx_spectrum_20220723_122031.fits'
+
+@pytest.fixture(scope = 'module')
+def response():
+    return ResponseMatrix.from_fits()
+
+def model_rate(response, components):
+    return SpectrumFitter(np.zeros(response.n_channels), np.ones(response.n_channels), EXPOSURE, response).model_rate(components, [TRUE_PARAMS[c] for c in components])[0]
+
+def noiseless_fitter(response, components, sys_err = None):
+    """Fitter for the model spectrum itself, with Poisson-like errors."""
+    rate = model_rate(response, components)
+    return SpectrumFitter(rate, np.sqrt(rate*EXPOSURE + 1.)/EXPOSURE, EXPOSURE, response, sys_err = sys_err)
+
+def noisy_fitter(response, sys_err = None, seed = 0):
+    counts = np.random.default_rng(seed).poisson(model_rate(response, ['thermal', 'bknpower'])*EXPOSURE)
+    return SpectrumFitter(counts/EXPOSURE, np.sqrt(np.maximum(counts, 1))/EXPOSURE, EXPOSURE, response, sys_err = sys_err)
+
+def chi_squared(fitter, result, mask):
+    model = fitter.model_rate(list(result['params']), list(result['params'].values()))[0]
+    return np.sum((fitter.rate - model)[mask]**2/(fitter.stat_err**2 + (fitter.sys_err*fitter.rate)**2)[mask])
+
+def cstat(fitter, result, mask):
+    model = fitter.model_rate(list(result['params']), list(result['params'].values()))[0][mask]*fitter.exposure
+    data = np.clip(fitter.rate[mask]*fitter.exposure, 0, None)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return 2*np.sum(model - data + np.where(data > 0, data*np.log(data/model), 0.))
+
+@pytest.mark.parametrize('statMethod', ['chi', 'cstat'])
+@pytest.mark.parametrize('components', [['thermal'], ['thermal', 'bknpower']])
+def test_fit_recovers_noiseless_parameters(response, statMethod, components):
+    ntmodel = components[1] if len(components) > 1 else None
+    result = noiseless_fitter(response, components).fit(ntmodel = ntmodel, breakEstart = 17, statMethod = statMethod, **FIT_RANGES)
+    assert list(result['params']) == components
+    for c in components:
+        np.testing.assert_allclose(result['params'][c], TRUE_PARAMS[c], rtol = 1e-5)
+    assert result['statistic'] < 1e-6
+
+@pytest.mark.parametrize('statMethod, statistic', [('chi', chi_squared), ('cstat', cstat)])
+def test_fit_statistic(response, statMethod, statistic):
+    fitter = noisy_fitter(response)
+    result = fitter.fit(statMethod = statMethod, **FIT_RANGES)
+    mask = fitter.noticed([FIT_RANGES['lowErange'][0], FIT_RANGES['highErange'][1]])
+    assert result['dof'] == mask.sum() - 6
+    np.testing.assert_allclose(result['statistic'], statistic(fitter, result, mask), rtol = 1e-9)
+    np.testing.assert_allclose(result['params']['thermal'], TRUE_PARAMS['thermal'], rtol = 0.1)
+
+def test_sys_err_weights_chi_squared_only(response):
+    sys_err = np.linspace(0.07, 0.03, response.n_channels)
+    fitter = noisy_fitter(response, sys_err = sys_err)
+    np.testing.assert_allclose(fitter.variance, fitter.stat_err**2 + (sys_err*fitter.rate)**2)
+    result = fitter.fit(**FIT_RANGES)
+    mask = fitter.noticed([FIT_RANGES['lowErange'][0], FIT_RANGES['highErange'][1]])
+    np.testing.assert_allclose(result['statistic'], chi_squared(fitter, result, mask), rtol = 1e-9)
+    assert result['statistic'] < noisy_fitter(response).fit(**FIT_RANGES)['statistic']
+    result = fitter.fit(statMethod = 'cstat', **FIT_RANGES)
+    np.testing.assert_allclose(result['statistic'], cstat(fitter, result, mask), rtol = 1e-9)
+
+def test_partial_start_runs_all_steps(response):
+    fitter = noisy_fitter(response)
+    cold = fitter.fit(**FIT_RANGES)
+    assert fitter.fit(start = {'thermal': MODELS['thermal']['start']}, **FIT_RANGES) == cold
+    warm = fitter.fit(start = cold['params'], **FIT_RANGES)
+    assert warm['iterations'] < cold['iterations']
+    np.testing.assert_allclose(warm['statistic'], cold['statistic'], rtol = 1e-3)
+
+def test_from_fits():
+    table = read_rate_table(SPECTRUM_FILE)
+    row = int(np.argmax(table['RATE'].sum(axis = 1)))
+    fitter = SpectrumFitter.from_fits(SPECTRUM_FILE, row = row)
+    np.testing.assert_array_equal(fitter.rate, table['RATE'][row])
+    np.testing.assert_array_equal(fitter.stat_err, table['STAT_ERR'][row])
+    np.testing.assert_array_equal(fitter.sys_err, table['SYS_ERR'][row])
+    np.testing.assert_allclose(fitter.exposure, table['TIMEDEL'][row]*np.ravel(table['LIVETIME'][row])[0])
+    np.testing.assert_allclose(fitter.response.e_min, table['energy_hdu'].data['E_MIN'])
+    result = fitter.fit(ntmodel = None)
+    assert np.isfinite(result['statistic']) and result['params']['thermal'][0] > 0
+    assert SpectrumFitter.from_fits(table, row = row).fit(ntmodel = None) == result
@@ -0,0 +1,8 @@
+import pytest
+from .import_budget import IMPORT_TIME_BUDGET, LAZY_DEPENDENCIES, measure_import
+
+@pytest.mark.parametrize('module', list(IMPORT_TIME_BUDGET))
+def test_import(module):
+    seconds, loaded = measure_import(module)
+    assert not loaded, f"Importing {module} also imports {', '.join(loaded)}, which should only be imported on first use (see LAZY_DEPENDENCIES)"
+    assert seconds <= IMPORT_TIME_BUDGET[module], f"Importing {module} took {seconds:.2f} s, over the budget of {IMPORT_TIME_BUDGET[module]:.2f} s"
@@ -0,0 +1,82 @@
+import json
+import math
+from importlib import resources
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from stix2xspec.livetime import livetime_fraction, spectrogram_livetime
+from stix2xspec.spectrogram import stx_time_axis
+from stix2xspec.triggergram import Triggergram
+
+with resources.path('stix2xspec.data', 'adg_table.json') as f, open(f) as table:
+    ADG_TABLE = json.load(table)[1:]
+
+def detector_adg_loop(det):
+    """ADG index of detector det (0-31), looked up in the ADG table."""
+    return [row['ADG_IDX'] for row in ADG_TABLE if row['SC'] == det + 1][0]
+
+def livetime_fraction_loop(triggergram, det_used, tau = 10.1e-6, eta = 2.63e-6, beta = 0.940591):
+    """Reference implementation of *livetime_fraction*: the dead-time formula for each detector and time bin."""
+    adg_idx = list(triggergram.adg_idx)
+    result = np.zeros((len(det_used), len(triggergram.t_axis)))
+    for i, det in enumerate(det_used):
+        row = adg_idx.index(detector_adg_loop(det))
+        for t, duration in enumerate(np.ravel(triggergram.t_axis.duration)):
+            triggers = float(triggergram.triggerdata[row, t])
+            rate = (tau + eta)/duration
+            nin = triggers/(1. - triggers*rate)
+            result[i, t] = math.exp(-beta*eta/duration*nin)/(1. + rate*nin)
+    return result
+
+def spectrogram_livetime_loop(spectrogram, level = 4):
+    """Reference implementation of *spectrogram_livetime*: one triggergram each for the lower, nominal and upper triggers, and livetime fractions tiled to the shape of the counts."""
+    det_used = np.where(spectrogram.detector_mask == 1)[0]
+    livetime_fracs = []
+    for sign in [-1, 0, 1]:
+        err = sign*spectrogram.triggers_err
+        if level == 1:
+            trig = spectrogram.triggers + err
+        else:
+            trig = np.transpose((spectrogram.triggers + err)*(np.ones(16)/16.))
+        if sign == -1:
+            trig[trig <= 0] = 0
+        livetime_frac = livetime_fraction_loop(Triggergram(trig, spectrogram.t_axis), det_used)
+        if level == 1:
+            livetime_frac = np.repeat(livetime_frac[:,np.newaxis,:], spectrogram.n_energies, axis = 1)
+        else:
+            livetime_frac = np.repeat(livetime_frac[0][:,np.newaxis], spectrogram.n_energies, axis = 1)
+        livetime_fracs.append(livetime_frac)
+    counts = spectrogram.counts
+    error_from_livetime = (counts/livetime_fracs[2] - counts/livetime_fracs[0])/2.
+    corrected_error = np.sqrt((spectrogram.error/livetime_fracs[1])**2. + error_from_livetime**2.)
+    return counts/livetime_fracs[1], corrected_error, livetime_fracs[1]
+
+def fake_spectrogram(level, n_times = 7, n_energies = 5, seed = 4):
+    """Spectrogram-like object with random counts and triggers."""
+    rng = np.random.default_rng(seed)
+    duration = rng.uniform(0.5, 20., n_times)
+    t_axis = stx_time_axis.from_bin_centers(np.datetime64('2022-07-23T12:00:00'), np.cumsum(duration) - duration/2., duration)
+    detector_mask = np.ones(32, dtype = int)
+    detector_mask[[8, 9, 20]] = 0
+    ndet = int(detector_mask.sum())
+    if level == 1:
+        triggers = rng.uniform(0., 2e3, (16, n_times))*duration
+        shape = (ndet, n_energies, n_times)
+    else:
+        triggers = rng.uniform(0., 3e4, (n_times, 1))*duration[:,np.newaxis]
+        shape = (n_times, n_energies)
+    counts = rng.uniform(0., 1e4, shape)
+    return SimpleNamespace(n_times = n_times, n_energies = n_energies, detector_mask = detector_mask, t_axis = t_axis, triggers = triggers, triggers_err = np.sqrt(triggers) + 1., counts = counts, error = np.sqrt(counts + 1.))
+
+def test_livetime_fraction_against_loop():
+    spec = fake_spectrogram(1)
+    triggergram = Triggergram(spec.triggers, spec.t_axis)
+    det_used = np.where(spec.detector_mask == 1)[0]
+    np.testing.assert_allclose(livetime_fraction(triggergram, det_used), livetime_fraction_loop(triggergram, det_used), rtol = 1e-12)
+
+@pytest.mark.parametrize('level', [1, 4])
+def test_spectrogram_livetime_against_loop(level):
+    spec = fake_spectrogram(level)
+    for result, expected in zip(spectrogram_livetime(spec, level = level), spectrogram_livetime_loop(spec, level = level)):
+        assert result.shape == expected.shape
+        np.testing.assert_allclose(result, expected, rtol = 1e-12)
@@ -0,0 +1,58 @@
+import numpy as np
+from astropy.time import Time
+from stix2xspec.rate_index import RateIndex
+from stix2xspec.xspec_utils import average_time_intervals
+
+def random_rate_table(n_times = 200, n_energies = 6, seed = 12):
+    rng = np.random.default_rng(seed)
+    duration = rng.uniform(1., 20., n_times)
+    time_mean = 59783.5 + (np.cumsum(duration) - duration/2.)/86400.
+    counts = rng.uniform(0., 1e3, (n_times, n_energies))
+    livetime = rng.uniform(0.5, 1., n_times)
+    return time_mean, counts, counts + rng.uniform(0., 10., counts.shape), duration, livetime
+
+def test_query_against_brute_force():
+    time_mean, counts, variance, duration, livetime = random_rate_table()
+    index = RateIndex(time_mean, counts, variance, duration, livetime)
+    rng = np.random.default_rng(0)
+    t0 = rng.uniform(time_mean[0] - 0.01, time_mean[-1], 50)
+    t1 = t0 + rng.uniform(-0.001, 0.02, 50)
+    result = index.query(t0, t1)
+    for i in range(t0.size):
+        in_window = (time_mean >= t0[i]) & (time_mean < t1[i])
+        exposure = np.sum(duration[in_window]*livetime[in_window])
+        assert result['n_bins'][i] == in_window.sum()
+        np.testing.assert_allclose(result['counts'][i], counts[in_window].sum(axis = 0), rtol = 1e-9, atol = 1e-6)
+        np.testing.assert_allclose(result['variance'][i], variance[in_window].sum(axis = 0), rtol = 1e-9, atol = 1e-6)
+        np.testing.assert_allclose(result['exposure'][i], exposure, rtol = 1e-9, atol = 1e-9)
+        np.testing.assert_allclose(result['duration'][i], duration[in_window].sum(), rtol = 1e-9, atol = 1e-9)
+        if in_window.any():
+            np.testing.assert_allclose(result['rate'][i], counts[in_window].sum(axis = 0)/exposure, rtol = 1e-9)
+            np.testing.assert_allclose(result['stat_err'][i], np.sqrt(variance[in_window].sum(axis = 0))/exposure, rtol = 1e-9)
+        else:
+            assert np.isnan(result['rate'][i]).all() and np.isnan(result['stat_err'][i]).all()
+
+def test_query_scalar_window():
+    time_mean, counts, variance, duration, livetime = random_rate_table()
+    index = RateIndex(time_mean, counts, variance, duration, livetime)
+    window = index.query(time_mean[10], time_mean[20])
+    assert window['rate'].shape == (counts.shape[1],)
+    np.testing.assert_allclose(window['counts'], counts[10:20].sum(axis = 0), rtol = 1e-9)
+
+def test_query_against_average_time_intervals():
+    """With the same exposure in every bin, the rate is the mean rate and the error is the mean STAT_ERR of the bins added in quadrature instead of averaged."""
+    time_mean, counts, variance, duration, livetime = random_rate_table()
+    duration[:] = 4.
+    livetime[:] = 0.8
+    exposure = (duration*livetime)[:,None]
+    rate, stat_err = counts/exposure, np.sqrt(variance)/exposure
+    table = {'RATE': rate, 'STAT_ERR': stat_err, 'SYS_ERR': np.zeros_like(rate), 'LIVETIME': np.repeat(livetime[:,None], rate.shape[1], axis = 1), 'TIME': time_mean, 'TIMEDEL': duration, 'time_mjd': time_mean, 'channel': np.arange(rate.shape[1]), 'primary_header': None, 'rate_header': None, 'energy_hdu': None}
+    bounds = Time(time_mean[[0, 30, 31, 120]] - 1e-6, format = 'mjd').isot
+    intervals = [(bounds[0], bounds[1]), (bounds[2], bounds[3])]
+    averages = average_time_intervals(table, intervals)
+    windows = RateIndex.from_rates(time_mean, rate, stat_err, duration, livetime).query([i[0] for i in intervals], [i[1] for i in intervals])
+    np.testing.assert_array_equal(windows['n_bins'], averages['n_bins'])
+    np.testing.assert_allclose(windows['rate'], averages['rate'], rtol = 1e-9)
+    np.testing.assert_allclose(windows['exposure'], averages['exposure'], rtol = 1e-9)
+    for i, (first, last) in enumerate([(0, 30), (31, 120)]):
+        np.testing.assert_allclose(windows['stat_err'][i], np.sqrt(np.sum(stat_err[first:last]**2, axis = 0))/(last - first), rtol = 1e-9)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+from stix2xspec.response import ResponseMatrix
+from stix2xspec.spectrogram_utils import open_full_srm
+
+#packed rows of a 3 x 4 matrix: (first channels, channel counts, values), with 1-based channels
+PACKED_ROWS = [([1, 0], [2, 0], [0.5, 0.25, 0., 0.]), ([2, 4], [1, 1], [0.125, 1., 0., 0.]), ([0, 0], [0, 0], [0., 0., 0., 0.])]
+DENSE = np.array([[0.5, 0.25, 0., 0.], [0., 0.125, 0., 1.], [0., 0., 0., 0.]])
+
+def write_packed_srm(fitsfilename, first_channel = None):
+    """Write a small SRM with grouped rows, with channels numbered from first_channel (TLMIN of F_CHAN), or from 1 without TLMIN."""
+    offset = 0 if first_channel is None else first_channel - 1
+    f_chan = np.array([[f + offset if n else 0 for f, n in zip(fc, nc)] for fc, nc, _ in PACKED_ROWS])
+    matrix = fits.BinTableHDU.from_columns([fits.Column('ENERG_LO', 'E', array = [1., 2., 3.]), fits.Column('ENERG_HI', 'E', array = [2., 3., 4.]),
+        fits.Column('N_GRP', 'I', array = [1, 2, 0]), fits.Column('F_CHAN', '2I', array = f_chan),
+        fits.Column('N_CHAN', '2I', array = [r[1] for r in PACKED_ROWS]), fits.Column('MATRIX', '4E', array = [r[2] for r in PACKED_ROWS])], name = 'MATRIX')
+    if first_channel is not None:
+        matrix.header['TLMIN4'] = first_channel
+    ebounds = fits.BinTableHDU.from_columns([fits.Column('CHANNEL', 'I', array = np.arange(4)), fits.Column('E_MIN', 'E', array = [1., 2., 3., 4.]), fits.Column('E_MAX', 'E', array = [2., 3., 4., 5.])], name = 'EBOUNDS')
+    fits.HDUList([fits.PrimaryHDU(), matrix, ebounds]).writeto(fitsfilename)
+    return fitsfilename
+
+@pytest.fixture(scope = 'module')
+def response():
+    return ResponseMatrix.from_fits()
+
+def test_from_fits_matches_bundled_matrix(response):
+    np.testing.assert_array_equal(response.to_dense(), np.array(open_full_srm()[1].data['MATRIX'], dtype = float))
+
+@pytest.mark.parametrize('first_channel', [None, 0, 1])
+def test_from_fits_channel_numbering(tmp_path, first_channel):
+    response = ResponseMatrix.from_fits(write_packed_srm(str(tmp_path/'srm.fits'), first_channel))
+    np.testing.assert_array_equal(response.to_dense(), DENSE)
+
+@pytest.mark.parametrize('method', ['sparse', 'dense', 'auto'])
+@pytest.mark.parametrize('channels', [None, [2, 3, 4, 5, 10, 20], [7, 3, 12]])
+def test_fold_against_dense(response, method, channels):
+    if channels is not None:
+        response = response.crop(channels)
+    flux = np.random.default_rng(19).random((5, response.n_energies))
+    expected = flux @ response.to_dense()
+    assert response.fold(flux, method = method, block_size = 2).shape == (5, response.n_channels)
+    np.testing.assert_allclose(response.fold(flux, method = method, block_size = 2), expected, rtol = 1e-12)
+    np.testing.assert_allclose(response.fold(flux[0], method = method), expected[0], rtol = 1e-12)
+
+def test_crop_against_dense(response):
+    channels = [4, 9, 2, 15]
+    cropped = response.crop(channels)
+    np.testing.assert_array_equal(cropped.to_dense(), response.to_dense()[:,channels])
+    np.testing.assert_array_equal(cropped.e_min, response.e_min[channels])
+    np.testing.assert_array_equal(cropped.crop([1, 3]).to_dense(), response.to_dense()[:,[9, 15]])
+    assert cropped.data is response.data
+
+def test_fold_rejects_wrong_shape(response):
+    with pytest.raises(ValueError):
+        response.fold(np.ones(response.n_energies + 1))
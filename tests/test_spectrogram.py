@@ -0,0 +1,10 @@
+import pytest
+from stix2xspec.spectrogram import Spectrogram
+from stix2xspec.stix2xspec import convert_spectrogram
+
+def test_streaming_rejects_short_bin_removal(pixel_data_file):
+    fits_path = pixel_data_file(3)
+    with pytest.raises(ValueError, match = 'keep_short_bins'):
+        Spectrogram(fits_path, keep_short_bins = False, streaming = True)
+    with pytest.raises(ValueError, match = 'keep_short_bins'):
+        convert_spectrogram(fits_path, keep_short_bins = False, chunk_size = 2)
@@ -0,0 +1,65 @@
+import warnings
+from importlib import resources
+import numpy as np
+from astropy.io import fits
+from stix2xspec.spectrogram_utils import cached_cropped_srm, cropped_srm_key, match_energies, open_full_srm
+
+def match_energies_loop(values, reference, rtol = 1e-6, atol = 1e-6):
+    """Reference implementation of *match_energies*: compare each value with each entry of the reference."""
+    idx, matched = [], []
+    for v in values:
+        candidates = [i for i, r in enumerate(reference) if r == v or (np.isfinite(v) and abs(r - v) <= atol + rtol*abs(v))]
+        if candidates:
+            best = min(candidates, key = lambda i: (0. if reference[i] == v else abs(reference[i] - v), i))
+            idx.append(best)
+            matched.append(True)
+        else:
+            idx.append(-1)
+            matched.append(False)
+    return np.array(idx), np.array(matched)
+
+def test_match_energies_float32_edges():
+    edges = np.array([4., 5., 6., 7., 8., 10., 12., 150.])
+    idx, matched = match_energies(edges.astype(np.float32), edges[::-1])
+    assert matched.all()
+    assert np.array_equal(idx, np.arange(edges.size)[::-1])
+
+def test_match_energies_non_finite():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        idx, matched = match_energies([4., 5., np.inf], [4., 5., np.inf])
+        assert np.array_equal(idx, [0, 1, 2])
+        assert matched.all()
+        idx, matched = match_energies([np.inf, -np.inf, np.nan, 5.], [5., 4., -np.inf])
+    assert np.array_equal(idx, [-1, 2, -1, 0])
+    assert np.array_equal(matched, [False, True, False, True])
+
+def test_match_energies_against_loop():
+    rng = np.random.default_rng(15)
+    reference = np.concatenate([rng.uniform(4., 150., 40), [np.inf]])
+    values = np.concatenate([reference[rng.permutation(reference.size)[:20]]*(1 + rng.uniform(-5e-7, 5e-7, 20)), rng.uniform(4., 150., 20), [np.inf, np.nan]])
+    idx, matched = match_energies(values, reference)
+    idx_loop, matched_loop = match_energies_loop(values, reference)
+    assert np.array_equal(matched, matched_loop)
+    assert np.array_equal(idx, idx_loop)
+
+def test_cropped_srm_key_depends_on_matrix():
+    with resources.path('stix2xspec.data', 'stx_srm_full.fits') as f, fits.open(f) as srm:
+        keep_channels = [0, 1, 2, 5]
+        key = cropped_srm_key(srm, keep_channels)
+        assert cropped_srm_key(srm, keep_channels) == key
+        assert cropped_srm_key(srm, keep_channels[:-1]) != key
+        srm[1].data.MATRIX[10, 3] *= 2.
+        assert cropped_srm_key(srm, keep_channels) != key
+
+def test_cached_cropped_srm(tmp_path):
+    srm = open_full_srm()
+    keep_channels = [0, 1, 2, 5]
+    fitsfilename = cached_cropped_srm(srm, keep_channels, srm_dir = str(tmp_path))
+    assert [p.name for p in tmp_path.iterdir()] == [fitsfilename]
+    mtime = (tmp_path/fitsfilename).stat().st_mtime_ns
+    assert cached_cropped_srm(srm, keep_channels, srm_dir = str(tmp_path)) == fitsfilename
+    assert (tmp_path/fitsfilename).stat().st_mtime_ns == mtime
+    with fits.open(tmp_path/fitsfilename) as cropped:
+        np.testing.assert_array_equal(cropped[1].data.MATRIX, srm[1].data.MATRIX[:,keep_channels])
+        np.testing.assert_array_equal(cropped[2].data.E_MIN, srm[2].data.E_MIN[keep_channels])
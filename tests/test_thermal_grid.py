@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from stix2xspec.fitting import SpectrumFitter
+from stix2xspec.response import ResponseMatrix
+from stix2xspec.thermal_grid import ThermalGrid
+
+EXPOSURE = 20.
+
+@pytest.fixture(scope = 'module')
+def response():
+    return ResponseMatrix.from_fits()
+
+@pytest.fixture(scope = 'module')
+def grid():
+    return ThermalGrid.compute()
+
+def thermal_fitters(response, kT, EM = 0.5, seed = 1):
+    """One fitter per temperature, for Poisson realizations of thermal spectra folded through the response."""
+    model = SpectrumFitter(np.zeros(response.n_channels), np.ones(response.n_channels), EXPOSURE, response)
+    rng = np.random.default_rng(seed)
+    fitters = []
+    for t in kT:
+        counts = rng.poisson(model.model_rate(['thermal'], [(t, EM)])[0]*EXPOSURE)
+        fitters.append(SpectrumFitter(counts/EXPOSURE, np.sqrt(np.maximum(counts, 1))/EXPOSURE, EXPOSURE, response))
+    return fitters
+
+@pytest.mark.parametrize('index', [None, np.arange(2, 10.1, 0.5)])
+def test_save_load_round_trip(tmp_path, index):
+    grid = ThermalGrid.compute(kT = np.geomspace(0.5, 5., 11), index = index)
+    filename = str(tmp_path/'grid.npz')
+    grid.save(filename)
+    loaded = ThermalGrid.load(filename)
+    for name in ['kT', 'thermal', 'e_min', 'e_max', 'index', 'power_law']:
+        if getattr(grid, name) is None:
+            assert getattr(loaded, name) is None
+        else:
+            np.testing.assert_array_equal(getattr(loaded, name), getattr(grid, name))
+
+def test_estimate_against_fitter(response, grid):
+    kT = [1.2, 1.8, 2.5, 3.3]
+    fitters = thermal_fitters(response, kT)
+    result = grid.estimate(np.array([f.rate for f in fitters]), np.array([f.stat_err for f in fitters]), response.e_min, Erange = [4, 10])
+    assert not result['at_grid_edge'].any()
+    for i, fitter in enumerate(fitters):
+        fit = fitter.fit(ntmodel = None, lowErange = [4, 10])
+        np.testing.assert_allclose(result['kT'][i], fit['params']['thermal'][0], rtol = 1e-4)
+        np.testing.assert_allclose(result['EM'][i], fit['params']['thermal'][1], rtol = 1e-3)
+        np.testing.assert_allclose(result['chisq'][i], fit['statistic'], rtol = 0.05)
+        assert result['dof'][i] == fit['dof']
+
+def test_estimate_at_grid_edge(response, grid):
+    fitters = thermal_fitters(response, [1.8, 8.])
+    result = grid.estimate(np.array([f.rate for f in fitters]), np.array([f.stat_err for f in fitters]), response.e_min, Erange = [4, 10])
+    np.testing.assert_array_equal(result['at_grid_edge'], [False, True])
+    np.testing.assert_allclose(result['kT'][1], grid.kT[-1], rtol = 1e-12)
+
+def test_estimate_channel_subset(response, grid):
+    channels = np.arange(12) #all channels of Erange
+    fitter, = thermal_fitters(response, [1.8])
+    full = grid.estimate(fitter.rate, fitter.stat_err, response.e_min, Erange = [4, 10])
+    subset = grid.estimate(fitter.rate[channels], fitter.stat_err[channels], response.e_min[channels], Erange = [4, 10])
+    np.testing.assert_allclose(subset['kT'], full['kT'], rtol = 1e-12)
+    with pytest.raises(ValueError):
+        grid.estimate(fitter.rate[:2], fitter.stat_err[:2], [4.5, 5.5])
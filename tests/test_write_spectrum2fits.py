@@ -0,0 +1,29 @@
+import numpy as np
+from astropy.io import fits
+from stix2xspec.write_spectrum2fits import PHA2Writer
+
+def test_pha2_times_relative_to_mjdref(tmp_path):
+    fitsfilename = str(tmp_path/'spectra.fits')
+    rate_header = fits.Header([('MJDREF', 43874.0), ('TSTARTI', 0.), ('TSTOPI', 0.)])
+    tstart = 59783.5 + np.arange(3)/24.
+    with PHA2Writer(fitsfilename, 4, rate_header = rate_header) as writer:
+        writer.append(np.ones((3, 4)), np.ones((3, 4)), 60., tstart, tstart + 1./24.)
+    with fits.open(fitsfilename) as hdul:
+        header, data = hdul['SPECTRUM'].header, hdul['SPECTRUM'].data
+        assert isinstance(header['TSTARTI'], int) and isinstance(header['TSTOPI'], int)
+        np.testing.assert_allclose(data['TSTART'] + header['MJDREF'], tstart, rtol = 0, atol = 1e-9)
+        np.testing.assert_allclose(header['TSTARTI'] + header['TSTARTF'], data['TSTART'][0], rtol = 0, atol = 1e-9)
+        np.testing.assert_allclose(header['TSTOPI'] + header['TSTOPF'], data['TSTOP'][-1], rtol = 0, atol = 1e-9)
+        np.testing.assert_allclose(data['TIMEDEL'], 3600., rtol = 1e-9)
+
+def test_pha2_header_from_rate_header(tmp_path):
+    fitsfilename = str(tmp_path/'spectra.fits')
+    rate_header = fits.Header([('MJDREF', 43874.0), ('TIMEZERO', 15909.), ('ONTIME', 21870.), ('EXPOSURE', 21870.)])
+    with PHA2Writer(fitsfilename, 4, rate_header = rate_header) as writer:
+        writer.append(np.ones((3, 4)), np.ones((3, 4)), [600., 600., 500.], 59783.5 + np.arange(3)/144., 59783.5 + np.arange(1, 4)/144., sys_err = np.full((3, 4), 0.05))
+    with fits.open(fitsfilename) as hdul:
+        header, data = hdul['SPECTRUM'].header, hdul['SPECTRUM'].data
+        assert header['TIMEZERO'] == 0.
+        assert header['ONTIME'] == 1700.
+        assert data.columns['SYS_ERR'].unit is None
+        assert data.columns['RATE'].unit == 'counts/s'
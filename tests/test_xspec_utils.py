@@ -0,0 +1,54 @@
+import pytest
+from stix2xspec.xspec_utils import _warm_fit_thermal_nonthermal, fit_spectra, fit_thermal_nonthermal_series
+from .fake_xspec import FakeXspec
+
+START_PARAMS = {'apec': (1.5, 1., 0., 0.3), 'bknpower': (4., 18., 6., 2.)}
+
+def call_names(xspec):
+    return [c[0] for c in xspec.calls]
+
+@pytest.mark.parametrize('ntmodel, clears', [('bknpower', 1), ('thick2', 0)])
+def test_warm_fit_clears_models_unless_thick2(ntmodel, clears):
+    xspec = FakeXspec()
+    start_params = {'apec': START_PARAMS['apec'], ntmodel: (1.,)*7}
+    _warm_fit_thermal_nonthermal(xspec, start_params, ntmodel = ntmodel)
+    assert call_names(xspec).count('AllModels.clear') == clears
+
+def test_warm_fit_starts_from_previous_params():
+    xspec = FakeXspec()
+    m, fitstat = _warm_fit_thermal_nonthermal(xspec, START_PARAMS, minCounts = 5)
+    assert m.apec.kT.values[0] == 1.5
+    assert m.bknpower.BreakE.values[0] == 18.
+    assert call_names(xspec).count('perform') == 1
+
+@pytest.mark.parametrize('renorm', [True, False])
+def test_warm_fit_renorm(renorm):
+    xspec = FakeXspec()
+    _warm_fit_thermal_nonthermal(xspec, START_PARAMS, renorm = renorm)
+    assert ('renorm' in call_names(xspec)) == renorm
+
+def test_warm_fit_rejects_unknown_arguments():
+    with pytest.raises(TypeError):
+        _warm_fit_thermal_nonthermal(FakeXspec(), START_PARAMS, lowErnage = [3., 10.])
+
+def test_series_passes_fit_options_to_warm_fits():
+    xspec = FakeXspec()
+    results = fit_thermal_nonthermal_series(xspec, ['a.fits', 'bb.fits'], renorm = False, minCounts = 5, restart_factor = None)
+    assert [r['warm_start'] for r in results] == [False, True]
+    assert results[1]['n_fits'] == 1
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_fit_spectra_reports_each_spectrum_in_input_order(jobs):
+    spectra = ['a.fits{1}', 'missing.fits{1}', 'ccc.fits{1}']
+    results = fit_spectra(spectra, jobs = jobs, backend = FakeXspec, ntmodel = 'powerlaw')
+    assert [r['spectrum'] for r in results] == spectra
+    assert [r['success'] for r in results] == [True, False, True]
+    assert results[1]['error'].startswith('OSError') and results[1]['params'] is None
+    assert [r['statistic'] for r in results if r['success']] == [float(len('a.fits{1}')), float(len('ccc.fits{1}'))]
+    assert list(results[0]['params']) == ['apec', 'powerlaw']
+    assert len(results[0]['sigmas']['powerlaw']) == 2
+    assert 'fit' in results[0]['stages']
+
+def test_fit_spectra_thermal_only():
+    results = fit_spectra(['a.fits'], jobs = 1, backend = FakeXspec, ntmodel = None)
+    assert list(results[0]['params']) == ['apec']